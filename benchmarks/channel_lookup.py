@@ -0,0 +1,65 @@
+"""Measure the cost of looking up a channel by number, as done for every segment and key request.
+
+Compares the indexed `ChannelRegistry` against the previous approach of
+scanning `_CHANNELS` and re-applying the config filters on every lookup.
+
+Usage:
+
+    python benchmarks/channel_lookup.py
+
+    # with channel filters configured
+    DLHDHR_COUNTRY_EXCLUDE=it,pl python benchmarks/channel_lookup.py
+"""
+
+import argparse
+import random
+import timeit
+from typing import Iterator
+
+from dlhdhr import config
+from dlhdhr.dlhd.channels import _CHANNELS, DLHDChannel, get_registry
+
+
+def _filtered_channels() -> Iterator[DLHDChannel]:
+    # The previous `get_channels()`
+    for channel in _CHANNELS:
+        if config.CHANNEL_ALLOW is not None and channel.number not in config.CHANNEL_ALLOW:
+            continue
+        if config.CHANNEL_EXCLUDE is not None and channel.number in config.CHANNEL_EXCLUDE:
+            continue
+        if config.COUNTRY_ALLOW is not None and channel.country_code not in config.COUNTRY_ALLOW:
+            continue
+        if config.COUNTRY_EXCLUDE is not None and channel.country_code in config.COUNTRY_EXCLUDE:
+            continue
+        yield channel
+
+
+def scan_lookup(channel_number: str) -> DLHDChannel | None:
+    for channel in _filtered_channels():
+        if channel.number == channel_number:
+            return channel
+    return None
+
+
+def registry_lookup(channel_number: str) -> DLHDChannel | None:
+    return get_registry().get(channel_number)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    # A mix of channel numbers from across the list, plus some which don't exist
+    rng = random.Random(0)
+    numbers = [rng.choice(_CHANNELS).number for _ in range(args.lookups)]
+    numbers[::10] = ["999999"] * len(numbers[::10])
+
+    print(f"{len(_CHANNELS)} channels, {len(get_registry())} after filters, {args.lookups} lookups")
+    for name, lookup in (("scan", scan_lookup), ("registry", registry_lookup)):
+        elapsed = min(timeit.repeat(lambda: [lookup(n) for n in numbers], number=1, repeat=5))
+        print(f"{name:>10}: {elapsed / args.lookups * 1e6:8.3f} us/lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Measure the time from startup to the first byte of `/xmltv.xml`.
+
+Every provider's upstream is replaced by a fake which returns synthetic
+listings after `--upstream-latency` seconds, standing in for the real grid
+downloads. The app is started (lifespan included) and `/xmltv.xml` requested
+straight away, once without a snapshot and once with a snapshot saved by a
+previous run.
+
+Usage:
+
+    python benchmarks/epg_cold_start.py
+
+    python benchmarks/epg_cold_start.py --channels 200 --days 7 --upstream-latency 5
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+
+from dlhdhr import config
+from dlhdhr.app import create_app
+from dlhdhr.dlhd.channels import get_registry
+from dlhdhr.epg import EPG
+from dlhdhr.epg.program import Program
+from dlhdhr.epg.provider import EPGProvider
+
+
+def make_listings(keys: list[str], days: int) -> dict[str, list[Program]]:
+    # Half hour programmes, starting an hour ago
+    start = datetime.datetime.now(datetime.UTC).replace(minute=0, second=0, microsecond=0)
+    start -= datetime.timedelta(hours=1)
+    slot = datetime.timedelta(minutes=30)
+    return {
+        key: [
+            Program.create(
+                start_time=start + slot * i,
+                end_time=start + slot * (i + 1),
+                title=f"Programme {i} on {key}",
+                description="A description of the programme which is a sentence or two long. " * 2,
+                tags=["Sports", "Live"],
+                subtitle=f"Episode {i}",
+                season=1,
+                episode=i,
+            )
+            for i in range(days * 48)
+        ]
+        for key in keys
+    }
+
+
+def fake_upstream(provider: EPGProvider, listings: dict[str, list[Program]], latency: float) -> None:
+    async def fetch() -> dict[str, list[Program]]:
+        await asyncio.sleep(latency)
+        return listings
+
+    provider._fetch_listings = fetch
+
+
+async def first_byte(args: argparse.Namespace) -> tuple[float, float, int]:
+    # Returns the seconds until the first and last bytes of /xmltv.xml, and the response size
+    app = create_app()
+    epg: EPG = app.state.epg
+
+    registry = get_registry()
+    channels = [c for c in registry if c.xmltv_id][: args.channels]
+    fake_upstream(
+        epg.epgsky, make_listings([c.epgsky_id for c in channels if c.epgsky_id], args.days), args.upstream_latency
+    )
+    fake_upstream(
+        epg.zap2it, make_listings([c.call_sign for c in channels if c.call_sign], args.days), args.upstream_latency
+    )
+    fake_upstream(
+        epg.zaptv, make_listings([c.call_sign for c in channels if c.call_sign], args.days), args.upstream_latency
+    )
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/xmltv.xml",
+        "raw_path": b"/xmltv.xml",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "server": ("127.0.0.1", 8000),
+        "client": ("127.0.0.1", 12345),
+    }
+
+    started = time.perf_counter()
+    first = last = 0.0
+    size = 0
+
+    requested = False
+
+    async def receive() -> dict:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # The client never disconnects
+        await asyncio.Event().wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal first, last, size
+        if message["type"] == "http.response.body" and message.get("body"):
+            if not first:
+                first = time.perf_counter() - started
+            size += len(message["body"])
+            last = time.perf_counter() - started
+
+    async with app.router.lifespan_context(app):
+        await app(scope, receive, send)
+        # Let the snapshot be written before shutting down
+        for provider in epg.providers.values():
+            async with provider._refresh_lock:
+                pass
+
+    return first, last, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=100)
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--upstream-latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.EPG_SNAPSHOT_PATH = os.path.join(tmp, "epg.sqlite")
+
+        for name in ("no snapshot", "snapshot"):
+            first, last, size = asyncio.run(first_byte(args))
+            print(f"{name:>12}: first byte {first * 1000:8.1f} ms, last byte {last * 1000:8.1f} ms, {size} bytes")
+
+        print(f"snapshot size: {os.path.getsize(config.EPG_SNAPSHOT_PATH)} bytes")
+
+
+if __name__ == "__main__":
+    main()
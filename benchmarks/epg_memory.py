@@ -0,0 +1,106 @@
+"""Measure the memory held by a multi-day guide for every channel.
+
+Compares the compact `Program` (epoch seconds, shared strings, tags and
+ratings) against the previous dataclass holding two aware datetimes and a
+list of tags per programme. Every channel gets listings from each provider,
+with titles, tags and ratings repeating the way real listings do.
+
+Usage:
+
+    python benchmarks/epg_memory.py
+
+    python benchmarks/epg_memory.py --days 14 --providers 3
+"""
+
+import argparse
+import datetime
+import gc
+import random
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable
+
+from dlhdhr.dlhd.channels import get_registry
+from dlhdhr.epg.program import Program, Rating
+
+
+@dataclass(frozen=True)
+class _Program:
+    # The previous `Program`
+    start_time: datetime.datetime
+    end_time: datetime.datetime
+    title: str
+    description: str
+    tags: list[str]
+    subtitle: str | None = None
+    thumbnail: str | None = None
+    season: int | None = None
+    episode: int | None = None
+    rating: Rating | None = None
+    release_year: str | None = None
+    dd_progid: str | None = None
+
+
+_TAGS = [["Sports"], ["Sports", "Live"], ["News"], ["Movie", "Drama"], ["Series", "Comedy"]]
+_RATINGS = [None, ("USA Parental Rating", "TV-G"), ("USA Parental Rating", "TV-14"), ("MPAA", "PG-13")]
+
+
+def build_guide(factory: Callable[..., object], keys: int, days: int) -> list[list[object]]:
+    # Half hour programmes, every field decoded fresh the way the providers' JSON parsing does
+    rng = random.Random(0)
+    start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone(datetime.timedelta(hours=-5)))
+    slot = datetime.timedelta(minutes=30)
+    guide = []
+    for key in range(keys):
+        programs = []
+        for i in range(days * 48):
+            show = rng.randrange(40)
+            rating = rng.choice(_RATINGS)
+            programs.append(
+                factory(
+                    start_time=start + slot * i,
+                    end_time=start + slot * (i + 1),
+                    title="".join(["Show ", str(show)]),
+                    description=f"Episode {i} of show {show} on channel {key}, a sentence or two about what happens.",
+                    tags=[str(tag) for tag in rng.choice(_TAGS)],
+                    subtitle=f"Episode {i}",
+                    thumbnail="".join(["https://example.com/", str(show), ".jpg"]),
+                    season=1,
+                    episode=i,
+                    rating=Rating(system=rating[0], value=rating[1]) if rating else None,
+                )
+            )
+        guide.append(programs)
+    return guide
+
+
+def measure(factory: Callable[..., object], keys: int, days: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    guide = build_guide(factory, keys, days)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del guide
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--providers", type=int, default=2, help="how many providers list each channel")
+    args = parser.parse_args()
+
+    keys = len(list(get_registry())) * args.providers
+    programs = keys * args.days * 48
+    print(f"{keys} channel listings, {args.days} days, {programs} programmes")
+
+    before = measure(_Program, keys, args.days)
+    after = measure(Program.create, keys, args.days)
+    for name, size in (("dataclass", before), ("compact", after)):
+        print(f"{name:>10}: {size / 2**20:8.1f} MiB, {size / programs:6.0f} bytes/programme")
+    print(f"     saved: {(before - after) / 2**20:8.1f} MiB ({1 - after / before:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""Measure parsing the providers' listings and rendering them as XMLTV.
+
+Every provider's `_fetch_listings` is run against a fake upstream serving
+its JSON for every channel in the registry, with `--days` days of half hour
+programmes (1, 7 and 14 by default). The parsed programmes are then rendered
+one by one with `Program.to_xmltv`, and as a whole guide with
+`EPG.generate_xmltv`, first with nothing serialized yet and then again with
+every fragment cached.
+
+Each step reports its best time out of `--repeat` runs, along with the peak
+memory traced while it ran and how many memory blocks it left allocated,
+measured in a separate run under tracemalloc. Tracing 14 days of listings is
+slow, the default run takes several minutes.
+
+Recorded responses can be used instead of the synthetic ones by passing a
+`--fixtures` directory with any of `zap2it.json` (a `/grid` page),
+`epgsky.json` (a `/schedule` response) and `zaptv.json` (`/schedules/today`).
+Their times are moved so the first programme starts an hour ago, and the
+same response is served for every request to that provider.
+
+Usage:
+
+    python benchmarks/epg_pipeline.py
+
+    python benchmarks/epg_pipeline.py --days 7 --repeat 5 --fixtures ./recorded
+"""
+
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import math
+import pathlib
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+from xml.etree.ElementTree import tostring
+
+import httpx
+
+from dlhdhr import config
+from dlhdhr.dlhd.channels import DLHDChannel, get_registry
+from dlhdhr.epg import EPG
+from dlhdhr.epg.program import Program
+from dlhdhr.epg.provider import EPGProvider
+from dlhdhr.epg.store import ProgramStore
+from dlhdhr.epg.zap2it import Zap2it
+
+SLOT = 30 * 60
+
+_TAGS = [["Stereo", "CC"], ["Live", "Stereo", "CC"], ["New", "CC"], ["CC"]]
+_RATINGS = [None, "TV-G", "TV-PG", "TV-14"]
+
+
+@dataclass()
+class Result:
+    seconds: float
+    peak: int
+    blocks: int
+
+
+def _slots(days: int) -> list[int]:
+    # Half hour programmes, starting an hour ago
+    start = int(time.time()) // SLOT * SLOT - 2 * SLOT
+    return [start + SLOT * i for i in range(days * 48)]
+
+
+def _event(rng: random.Random, key: str, i: int) -> dict[str, Any]:
+    # What every provider's events have in common, titles and descriptions repeating the way real listings do
+    show = rng.randrange(40)
+    return {
+        "title": f"Show {show}",
+        "subtitle": f"Episode {i}",
+        "description": f"Episode {i} of show {show} on {key}, a sentence or two about what happens in it.",
+        "season": rng.randrange(1, 10),
+        "episode": i,
+        "year": str(2000 + show),
+    }
+
+
+def _isoformat(timestamp: int) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.UTC).isoformat()
+
+
+def zap2it_grids(call_signs: list[str], days: int) -> tuple[int, dict[tuple[str, int], bytes]]:
+    # Returns when the first grid page starts, and the pages of every lineup (all listing every channel) by index
+    base = int(time.time())
+    page_seconds = Zap2it.GRID_HOURS * 3600
+    pages = math.ceil(days * 24 / Zap2it.GRID_HOURS)
+    slots = _slots(days)
+
+    channels = []
+    for n, call_sign in enumerate(call_signs):
+        rng = random.Random(call_sign)
+        events = []
+        for i, start in enumerate(slots):
+            evt = _event(rng, call_sign, i)
+            events.append(
+                {
+                    "startTime": _isoformat(start),
+                    "endTime": _isoformat(start + SLOT),
+                    "program": {
+                        "title": evt["title"],
+                        "episodeTitle": evt["subtitle"],
+                        "shortDesc": evt["description"],
+                        "season": str(evt["season"]),
+                        "episode": str(evt["episode"]),
+                        "tmsId": f"EP{n:06d}{i:04d}",
+                        "releaseYear": evt["year"],
+                    },
+                    "tags": rng.choice(_TAGS),
+                    "thumbnail": f"p{n}_{evt['title'][5:]}_h3_aa",
+                    "rating": rng.choice(_RATINGS),
+                    "start": start,
+                }
+            )
+        channels.append(
+            {"callSign": call_sign, "thumbnail": f"//zap2it.tmsimg.com/assets/s{n}_h3_aa.png", "events": events}
+        )
+
+    grids = {}
+    for i in range(pages):
+        # Programmes running across the edge of a page are on both pages, as they are upstream
+        page_start = base + page_seconds * i
+        page_end = page_start + page_seconds
+        page = [
+            {
+                **channel,
+                "events": [
+                    {k: v for k, v in evt.items() if k != "start"}
+                    for evt in channel["events"]
+                    if evt["start"] < page_end and evt["start"] + SLOT > page_start
+                ],
+            }
+            for channel in channels
+        ]
+        content = json.dumps({"channels": page}).encode()
+        for lineup in config.ZAP2IT_LINEUPS:
+            grids[(lineup.lineup_id, i)] = content
+    return base, grids
+
+
+def epgsky_schedules(services: list[str], days: int) -> dict[str, bytes]:
+    # Responses by the services they are for, in the batches of 20 the provider asks for
+    slots = _slots(days)
+    schedules = {}
+    for b in range(0, len(services), 20):
+        batch = services[b : b + 20]
+        schedule = []
+        for sid in batch:
+            rng = random.Random(sid)
+            events = []
+            for i, start in enumerate(slots):
+                evt = _event(rng, sid, i)
+                events.append(
+                    {
+                        "st": start,
+                        "d": SLOT,
+                        "t": evt["title"],
+                        "sy": evt["description"],
+                        "seasonnumber": evt["season"],
+                        "episodenumber": evt["episode"],
+                    }
+                )
+            schedule.append({"sid": sid, "events": events})
+        schedules[",".join(batch)] = json.dumps({"schedule": schedule}).encode()
+    return schedules
+
+
+def zaptv_schedules(codes: list[str], days: int) -> bytes:
+    slots = _slots(days)
+    data = []
+    for code in codes:
+        rng = random.Random(code)
+        broadcasts = []
+        for i, start in enumerate(slots):
+            evt = _event(rng, code, i)
+            broadcasts.append(
+                {
+                    "uid": f"{code}-{start}",
+                    "startsAt": _isoformat(start),
+                    "endsAt": _isoformat(start + SLOT),
+                    "title": evt["title"],
+                    "image": f"//www.zaptv.co.uk/images/{evt['title'][5:]}.jpg",
+                    "metadata": {
+                        "episode": {"season": evt["season"], "number": evt["episode"], "title": evt["subtitle"]},
+                        "year": evt["year"],
+                    },
+                }
+            )
+        data.append({"channel": {"code": code}, "broadcasts": broadcasts})
+    return json.dumps(data).encode()
+
+
+def _shift_iso(value: str, delta: int) -> str:
+    return (datetime.datetime.fromisoformat(value) + datetime.timedelta(seconds=delta)).isoformat()
+
+
+def load_recorded(path: pathlib.Path, name: str) -> bytes:
+    # Move a recorded response's programmes so the first one started an hour ago, otherwise they'd all be dropped as over
+    data = json.loads(path.read_bytes())
+    now = int(time.time()) - 2 * SLOT
+    if name == "zap2it":
+        events = [evt for ch in data["channels"] for evt in ch["events"]]
+        delta = now - min(int(datetime.datetime.fromisoformat(evt["startTime"]).timestamp()) for evt in events)
+        for evt in events:
+            evt["startTime"] = _shift_iso(evt["startTime"], delta)
+            evt["endTime"] = _shift_iso(evt["endTime"], delta)
+    elif name == "epgsky":
+        events = [evt for ch in data["schedule"] for evt in ch["events"]]
+        delta = now - min(evt["st"] for evt in events)
+        for evt in events:
+            evt["st"] += delta
+    elif name == "zaptv":
+        events = [evt for ch in data for evt in ch["broadcasts"]]
+        delta = now - min(int(datetime.datetime.fromisoformat(evt["startsAt"]).timestamp()) for evt in events)
+        for evt in events:
+            evt["startsAt"] = _shift_iso(evt["startsAt"], delta)
+            evt["endsAt"] = _shift_iso(evt["endsAt"], delta)
+    return json.dumps(data).encode()
+
+
+def fake_upstream(provider: EPGProvider, handler: Callable[[httpx.Request], bytes]) -> None:
+    def respond(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=handler(request), headers={"Content-Type": "application/json"})
+
+    provider._get_client = lambda: httpx.AsyncClient(
+        base_url=provider._BASE_URL, transport=httpx.MockTransport(respond)
+    )
+
+
+def setup_upstreams(
+    epg: EPG, days: int, fixtures: pathlib.Path | None
+) -> tuple[dict[str, dict[str, DLHDChannel]], list[str]]:
+    # Returns the channel each provider's listings are for by key, and which providers are served recorded responses
+    registry = list(get_registry())
+    keys = {
+        "zap2it": {c.call_sign: c for c in registry if c.country_code == "us" and c.call_sign},
+        "epgsky": {c.epgsky_id: c for c in registry if c.epgsky_id},
+        # Hardly any channels fall back to ZapTV, so give it every UK channel to get some work out of it
+        "zaptv": {f"ZAPTV{c.number}": c for c in registry if c.country_code == "uk"},
+    }
+
+    recorded = []
+    for name, provider in epg.providers.items():
+        path = fixtures / f"{name}.json" if fixtures is not None else None
+        if path is not None and path.exists():
+            content = load_recorded(path, name)
+            fake_upstream(provider, lambda request, content=content: content)
+            recorded.append(name)
+        elif name == "zap2it":
+            base, grids = zap2it_grids(list(keys[name]), days)
+            page_seconds = Zap2it.GRID_HOURS * 3600
+
+            def grid(request: httpx.Request, base: int = base, grids: dict = grids) -> bytes:
+                page = round((int(request.url.params["time"]) - base) / page_seconds)
+                return grids[(request.url.params["lineupId"], page)]
+
+            fake_upstream(provider, grid)
+        elif name == "epgsky":
+            schedules = epgsky_schedules(list(keys[name]), days)
+            fake_upstream(provider, lambda request, s=schedules: s[request.url.path.rpartition("/")[2]])
+        else:
+            content = zaptv_schedules(list(keys[name]), days)
+            fake_upstream(provider, lambda request, content=content: content)
+
+    # Zap2it covers as many days as we have grid pages for, a recorded page only needs fetching once per lineup
+    config.ZAP2IT_GRID_HOURS = Zap2it.GRID_HOURS if "zap2it" in recorded else days * 24
+    return keys, recorded
+
+
+async def no_setup() -> None:
+    return None
+
+
+async def measure(step: Callable[[Any], Awaitable[Any]], setup: Callable[[], Awaitable[Any]], repeat: int) -> Result:
+    best = math.inf
+    for _ in range(repeat):
+        arg = await setup()
+        gc.collect()
+        started = time.perf_counter()
+        await step(arg)
+        best = min(best, time.perf_counter() - started)
+        del arg
+
+    # A separate run for the memory, tracemalloc slows everything down quite a bit
+    arg = await setup()
+    gc.collect()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    result = await step(arg)
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result, arg
+    return Result(seconds=best, peak=peak, blocks=blocks)
+
+
+async def fetch_all(epg: EPG) -> dict[str, dict[str, list[Program]]]:
+    return {name: await provider._fetch_listings() for name, provider in epg.providers.items()}
+
+
+def load_listings(epg: EPG, listings: dict[str, dict[str, list[Program]]]) -> None:
+    # The same as a refresh does, without fetching anything
+    for name, provider in epg.providers.items():
+        provider._listings = {key: ProgramStore(programs) for key, programs in listings[name].items()}
+        provider._last_fetch = time.time()
+        provider._loaded.set()
+        provider.version += 1
+
+
+async def run(days: int, args: argparse.Namespace) -> dict[str, Result]:
+    epg = EPG()
+    keys, recorded = setup_upstreams(epg, days, args.fixtures)
+    channels = [c for c in get_registry() if c.xmltv_id]
+
+    results = {}
+    listings: dict[str, dict[str, list[Program]]] = {}
+    for name, provider in epg.providers.items():
+
+        async def parse(_: None, provider: EPGProvider = provider) -> dict[str, list[Program]]:
+            return await provider._fetch_listings()
+
+        label = f"parse {name}" + (" (recorded)" if name in recorded else "")
+        results[label] = await measure(parse, no_setup, args.repeat)
+        listings[name] = await provider._fetch_listings()
+
+    # Recorded listings are for whichever channels they were recorded for, render them as any of the provider's
+    pairs = []
+    for name, provider_listings in listings.items():
+        fallback = next(iter(keys[name].values()), None)
+        for key, programs in provider_listings.items():
+            channel = keys[name].get(key, fallback)
+            if channel is not None:
+                pairs.append((channel, programs))
+    count = sum(len(programs) for _, programs in pairs)
+
+    async def to_xmltv(_: None) -> int:
+        size = 0
+        for channel, programs in pairs:
+            for program in programs:
+                node = program.to_xmltv(channel)
+                if node is not None:
+                    size += len(tostring(node))
+        return size
+
+    results[f"Program.to_xmltv ({count} programmes)"] = await measure(to_xmltv, no_setup, args.repeat)
+
+    async def fresh_guide() -> None:
+        # Freshly parsed programmes and no cached <channel> nodes, as after a refresh
+        load_listings(epg, await fetch_all(epg))
+        for channel in channels:
+            channel._xmltv.clear()
+
+    async def generate(_: None) -> bytes:
+        return await epg.generate_xmltv(channels)
+
+    results["generate_xmltv (cold)"] = await measure(generate, fresh_guide, args.repeat)
+    results["generate_xmltv (warm)"] = await measure(generate, no_setup, args.repeat)
+    size = len(await epg.generate_xmltv(channels))
+    print(f"{days} days: {count} programmes, {len(channels)} channels, {size / 2**20:.1f} MiB of XMLTV")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7, 14])
+    parser.add_argument("--repeat", type=int, default=3, help="report the best of this many runs of each step")
+    parser.add_argument("--fixtures", type=pathlib.Path, help="directory of recorded provider responses")
+    args = parser.parse_args()
+
+    rows = []
+    for days in args.days:
+        results = asyncio.run(run(days, args))
+        rows.extend((days, step, result) for step, result in results.items())
+
+    print()
+    print(f"{'days':>4}  {'step':<40} {'time':>10} {'peak':>12} {'blocks':>10}")
+    for days, step, result in rows:
+        print(
+            f"{days:>4}  {step:<40} {result.seconds * 1000:>7.1f} ms"
+            f" {result.peak / 2**20:>8.1f} MiB {result.blocks:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
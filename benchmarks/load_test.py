@@ -0,0 +1,334 @@
+"""Load test the app with simulated HDHomeRun clients, against a local stand-in for the DLHD upstream.
+
+Runs fully offline. A fake upstream (in its own process) serves everything
+tuning a channel needs: the player page which is scraped for the master
+playlist, the master and (live, sliding window) media playlists, the AES key
+and AES-128 encrypted synthetic MPEG-TS segments at `--bitrate`. The real app
+is started in another process pointed at it, and `--clients` clients stream
+`/channel/{n}` spread over `--channels` channels.
+
+Reports the time to first byte, throughput, the app's CPU use per stream and
+memory, and how often clients fell behind and had data dropped (the listener
+lag policy, read from `/metrics`). CPU and memory are read from `/proc`, so
+this needs Linux.
+
+Usage:
+
+    python benchmarks/load_test.py
+
+    python benchmarks/load_test.py --channels 4 --clients 40 --bitrate 8000000 --duration 60
+
+    # ffmpeg tuners (needs ffmpeg installed)
+    python benchmarks/load_test.py --engine ffmpeg
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, Response
+
+from dlhdhr.dlhd.channels import get_registry
+from dlhdhr.mpegts import TS_PACKET_SIZE
+
+try:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+KEY = bytes(range(16))
+PMT_PID = 0x1000
+VIDEO_PID = 0x100
+# How many segments the live media playlist lists
+PLAYLIST_WINDOW = 6
+
+
+def _packet(pid: int, payload: bytes, start: bool = False, keyframe: bool = False) -> bytes:
+    header = bytes([0x47, (0x40 if start else 0) | (pid >> 8), pid & 0xFF])
+    if keyframe:
+        # Adaptation field with the random access indicator, followed by the payload
+        adaptation = bytes([0x40]) + b"\xff" * (TS_PACKET_SIZE - 4 - 2 - len(payload))
+        return header + bytes([0x30, len(adaptation)]) + adaptation + payload
+    return header + bytes([0x10]) + payload.ljust(TS_PACKET_SIZE - 4, b"\xff")
+
+
+def make_segment(size: int) -> bytes:
+    # A PAT, a PMT, a video keyframe and then filler video packets, about `size` bytes in total
+    pat = _packet(0, bytes([0x00, 0x00, 0xB0, 0x0D, 0x00, 0x01, 0xC1, 0x00, 0x00, 0x00, 0x01, 0xF0, 0x00]), start=True)
+    pmt = _packet(PMT_PID, bytes([0x00, 0x02, 0xB0, 0x12, 0x00, 0x01, 0xC1, 0x00, 0x00]), start=True)
+    keyframe = _packet(VIDEO_PID, b"\x00\x00\x01\xe0\x00\x00", start=True, keyframe=True)
+    filler = _packet(VIDEO_PID, b"\x00" * (TS_PACKET_SIZE - 4))
+    return pat + pmt + keyframe + filler * max(0, size // TS_PACKET_SIZE - 3)
+
+
+def encrypt(data: bytes, sequence: int) -> bytes:
+    # AES-128 with the media sequence number as the IV, as the playlist doesn't give one
+    padder = padding.PKCS7(128).padder()
+    data = padder.update(data) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(KEY), modes.CBC(sequence.to_bytes(16, "big"))).encryptor()
+    return encryptor.update(data) + encryptor.finalize()
+
+
+def create_upstream(args: argparse.Namespace) -> Starlette:
+    base_url = f"http://127.0.0.1:{args.upstream_port}"
+    segment = make_segment(int(args.bitrate * args.segment_duration / 8))
+    # Every channel streams the same content, so segments are only encrypted once per sequence number
+    segments: dict[int, bytes] = {}
+
+    async def player(request: Request) -> Response:
+        channel = request.path_params["channel"]
+        return HTMLResponse(f"""<html><body><div class="player_div"><script>
+            var player = new Clappr.Player({{source:'{base_url}/hls/{channel}/index.m3u8', autoPlay: true}});
+            </script></div></body></html>""")
+
+    async def master(request: Request) -> Response:
+        return Response(
+            f"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH={args.bitrate}\nmono.m3u8\n",
+            media_type="application/vnd.apple.mpegurl",
+        )
+
+    async def media(request: Request) -> Response:
+        channel = request.path_params["channel"]
+        last = int(time.time() / args.segment_duration)
+        first = last - PLAYLIST_WINDOW + 1
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{int(args.segment_duration + 0.999)}",
+            f"#EXT-X-MEDIA-SEQUENCE:{first}",
+        ]
+        if not args.no_encryption:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="{base_url}/key/{channel}"')
+        for sequence in range(first, last + 1):
+            lines.append(f"#EXTINF:{args.segment_duration:.3f},")
+            lines.append(f"{sequence}.ts")
+        return Response("\n".join(lines) + "\n", media_type="application/vnd.apple.mpegurl")
+
+    async def media_segment(request: Request) -> Response:
+        sequence = int(request.path_params["sequence"])
+        if args.no_encryption:
+            return Response(segment, media_type="video/mp2t")
+
+        data = segments.get(sequence)
+        if data is None:
+            data = segments[sequence] = encrypt(segment, sequence)
+            for old in [s for s in segments if s < sequence - PLAYLIST_WINDOW * 2]:
+                del segments[old]
+        return Response(data, media_type="video/mp2t")
+
+    async def key(_: Request) -> Response:
+        return Response(KEY, media_type="application/octet-stream")
+
+    app = Starlette()
+    app.add_route("/player/{channel}", player)
+    app.add_route("/hls/{channel}/index.m3u8", master)
+    app.add_route("/hls/{channel}/mono.m3u8", media)
+    app.add_route("/hls/{channel}/{sequence:int}.ts", media_segment)
+    app.add_route("/key/{channel}", key)
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cpu_seconds(pid: int) -> float:
+    # utime + stime of the process, from /proc/<pid>/stat
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def memory(pid: int) -> dict[str, int]:
+    # Current and peak resident set size, in bytes
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                values[name] = int(value.split()[0]) * 1024
+    return values
+
+
+async def scrape_metrics(client: httpx.AsyncClient) -> dict[str, float]:
+    # Sum every sample of each metric, across all labels
+    res = await client.get("/metrics")
+    totals: dict[str, float] = {}
+    for line in res.text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        sample, _, value = line.rpartition(" ")
+        name = sample.partition("{")[0]
+        totals[name] = totals.get(name, 0) + float(value)
+    return totals
+
+
+async def wait_ready(client: httpx.AsyncClient, path: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            res = await client.get(path)
+            if res.status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{client.base_url} did not start in time")
+        await asyncio.sleep(0.2)
+
+
+class Client:
+    # A simulated HDHomeRun client watching a channel
+    channel: str
+    ttfb: float | None = None
+    bytes: int = 0
+    error: str | None = None
+
+    def __init__(self, channel: str):
+        self.channel = channel
+
+    async def run(self, http: httpx.AsyncClient) -> None:
+        started = time.monotonic()
+        try:
+            async with http.stream("GET", f"/channel/{self.channel}") as res:
+                if res.status_code != 200:
+                    self.error = f"HTTP {res.status_code}"
+                    return
+                async for chunk in res.aiter_raw():
+                    if self.ttfb is None:
+                        self.ttfb = time.monotonic() - started
+                    self.bytes += len(chunk)
+        except httpx.HTTPError as e:
+            self.error = repr(e)
+
+
+def pick_channels(count: int) -> list[str]:
+    # Channels without EPG listings, so the app doesn't try to reach the real EPG providers
+    channels = [c.number for c in get_registry() if c.country_code not in ("us", "uk")]
+    return channels[:count]
+
+
+async def run(args: argparse.Namespace) -> None:
+    channels = pick_channels(args.channels)
+    app_port = free_port()
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+
+    upstream = subprocess.Popen(
+        [sys.executable, __file__, "--upstream", *sys.argv[1:], "--upstream-port", str(args.upstream_port)]
+    )
+    env = {
+        **os.environ,
+        "DLHDHR_HOST": "127.0.0.1",
+        "DLHDHR_PORT": str(app_port),
+        "DLHD_BASE_URL": f"{upstream_url}/",
+        "DLHD_PLAYER_URL": f"{upstream_url}/player/{{channel}}",
+        "DLHDHR_TUNER_ENGINE": args.engine,
+        "DLHDHR_TUNER_COUNT": str(len(channels)),
+        "DLHDHR_CHANNEL_ALLOW": ",".join(channels),
+    }
+    app = subprocess.Popen([sys.executable, "-m", "dlhdhr"], env=env, stdout=subprocess.DEVNULL)
+
+    http = httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=httpx.Timeout(30, read=None))
+    tasks: list[asyncio.Task] = []
+    try:
+        async with httpx.AsyncClient(base_url=upstream_url) as upstream_http:
+            await wait_ready(upstream_http, "/key/0")
+        await wait_ready(http, "/discover.json")
+
+        clients = [Client(channels[i % len(channels)]) for i in range(args.clients)]
+        started = time.monotonic()
+        for client in clients:
+            tasks.append(asyncio.create_task(client.run(http)))
+            if args.ramp:
+                await asyncio.sleep(args.ramp / len(clients))
+
+        # Measure once every client is receiving data (or has given up)
+        while time.monotonic() - started < args.warmup and any(c.ttfb is None and c.error is None for c in clients):
+            await asyncio.sleep(0.1)
+
+        before_bytes = sum(c.bytes for c in clients)
+        before_cpu = cpu_seconds(app.pid)
+        before_metrics = await scrape_metrics(http)
+        wall_start = time.monotonic()
+        await asyncio.sleep(args.duration)
+        wall = time.monotonic() - wall_start
+        cpu = cpu_seconds(app.pid) - before_cpu
+        received = sum(c.bytes for c in clients) - before_bytes
+        after_metrics = await scrape_metrics(http)
+        mem = memory(app.pid)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await http.aclose()
+        for process in (app, upstream):
+            process.terminate()
+            process.wait()
+
+    def delta(name: str) -> float:
+        return after_metrics.get(name, 0) - before_metrics.get(name, 0)
+
+    ttfbs = sorted(c.ttfb for c in clients if c.ttfb is not None)
+    errors = [c for c in clients if c.error is not None]
+    streaming = len(clients) - len(errors)
+    expected = args.bitrate / 8 * wall * streaming
+
+    print(f"engine={args.engine} channels={len(channels)} clients={args.clients} bitrate={args.bitrate / 1e6:.1f}Mbps")
+    print(f"duration={wall:.1f}s segment_duration={args.segment_duration}s encryption={not args.no_encryption}")
+    if ttfbs:
+        p95 = ttfbs[min(len(ttfbs) - 1, int(len(ttfbs) * 0.95))]
+        print(
+            f"ttfb: p50 {statistics.median(ttfbs) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, max {ttfbs[-1] * 1000:.0f} ms"
+        )
+    print(f"throughput: {received / wall / 2**20:.2f} MiB/s total, {received / max(1, expected):.1%} of the bitrate")
+    print(f"cpu: {cpu / wall * 100:.1f}% total, {cpu / wall * 100 / max(1, streaming):.3f}% per stream")
+    print(f"rss: {mem.get('VmRSS', 0) / 2**20:.1f} MiB, peak {mem.get('VmHWM', 0) / 2**20:.1f} MiB")
+    print(
+        f"dropped: {delta('dlhdhr_listener_lag_actions_total'):.0f} lag policy actions, "
+        f"{delta('dlhdhr_upstream_errors_total'):.0f} upstream errors"
+    )
+    if errors:
+        print(f"errors: {len(errors)} clients failed, e.g. {errors[0].error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=30.0, help="the longest to wait for every client to start")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds to spread starting the clients over")
+    parser.add_argument("--bitrate", type=int, default=4_000_000)
+    parser.add_argument("--segment-duration", type=float, default=2.0)
+    parser.add_argument("--engine", choices=("native", "ffmpeg"), default="native")
+    parser.add_argument("--no-encryption", action="store_true")
+    parser.add_argument("--upstream-port", type=int, default=0)
+    parser.add_argument("--upstream", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not args.no_encryption and Cipher is None:
+        parser.error("encrypted segments need the `cryptography` package (or pass --no-encryption)")
+
+    if args.upstream:
+        uvicorn.run(create_upstream(args), host="127.0.0.1", port=args.upstream_port, log_level="warning")
+        return
+
+    if not args.upstream_port:
+        args.upstream_port = free_port()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
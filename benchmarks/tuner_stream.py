@@ -0,0 +1,118 @@
+"""Measure the CPU cost of streaming a tuned channel to clients.
+
+A subprocess stands in for ffmpeg and writes a synthetic MPEG-TS stream to
+stdout at a fixed bitrate, the same way `ffmpeg -re` does. That stream is read
+by a real `Tuner` and sent to `--listeners` clients through Starlette's
+`StreamingResponse`, exactly like the `/channel/{n}` endpoint.
+
+Usage:
+
+    # current defaults
+    python benchmarks/tuner_stream.py
+
+    # the previous behaviour: 512 byte reads, one send per read
+    python benchmarks/tuner_stream.py --read-size 512 --write-size 1 --max-latency 0
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from starlette.responses import StreamingResponse
+
+from dlhdhr import config
+from dlhdhr.dlhd import DLHDClient
+from dlhdhr.dlhd.channels import DLHDChannel
+from dlhdhr.ffmpeg import FFMpegProcess
+from dlhdhr.mpegts import TS_PACKET_SIZE
+from dlhdhr.tuner import Tuner
+
+
+def source(bitrate: int, write_size: int) -> None:
+    # Write null TS packets at `bitrate` bits per second, `write_size` bytes at a time
+    packet = bytes([0x47, 0x1F, 0xFF, 0x10]) + b"\xff" * (TS_PACKET_SIZE - 4)
+    chunk = packet * max(1, write_size // TS_PACKET_SIZE)
+    interval = len(chunk) * 8 / bitrate
+
+    out = sys.stdout.buffer
+    next_write = time.monotonic()
+    while True:
+        out.write(chunk)
+        out.flush()
+        next_write += interval
+        delay = next_write - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+async def listen(tuner: Tuner, stats: dict[str, int]) -> None:
+    listener = await tuner.get_listener()
+    response = StreamingResponse(listener, media_type="video/mp2t")
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            stats["sends"] += 1
+            stats["bytes"] += len(message.get("body", b""))
+
+    await response({"type": "http"}, receive, send)
+
+
+async def run(args: argparse.Namespace) -> None:
+    FFMpegProcess.READ_SIZE = args.read_size
+    config.STREAM_WRITE_SIZE = args.write_size
+    config.STREAM_MAX_LATENCY = args.max_latency
+
+    config.TUNER_ENGINE = "ffmpeg"
+    tuner = Tuner(DLHDChannel(number="1", name="Benchmark", country_code="us"), DLHDClient())
+    tuner._source._ffmpeg_command = (
+        f"{sys.executable} {__file__} --source --bitrate {args.bitrate} --source-write-size {args.source_write_size}"
+    )
+
+    stats = {"sends": 0, "bytes": 0}
+    tasks = [asyncio.create_task(listen(tuner, stats)) for _ in range(args.listeners)]
+
+    # Give the source a moment to start before measuring
+    await asyncio.sleep(1)
+    stats.update(sends=0, bytes=0)
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    await asyncio.sleep(args.duration)
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+
+    tuner._stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(f"read_size={args.read_size} write_size={args.write_size} max_latency={args.max_latency}")
+    print(f"listeners={args.listeners} bitrate={args.bitrate / 1_000_000:.1f}Mbps duration={wall:.1f}s")
+    print(f"throughput: {stats['bytes'] / wall / 1024 / 1024:.2f} MiB/s total")
+    print(f"sends/s per stream: {stats['sends'] / wall / args.listeners:.0f}")
+    print(f"cpu: {cpu / wall * 100:.2f}% total, {cpu / wall * 100 / args.listeners:.3f}% per stream")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listeners", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--bitrate", type=int, default=8_000_000)
+    parser.add_argument("--read-size", type=int, default=FFMpegProcess.READ_SIZE)
+    parser.add_argument("--write-size", type=int, default=config.STREAM_WRITE_SIZE)
+    parser.add_argument("--max-latency", type=float, default=config.STREAM_MAX_LATENCY)
+    parser.add_argument("--source-write-size", type=int, default=TS_PACKET_SIZE * 7)
+    parser.add_argument("--source", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.source:
+        source(args.bitrate, args.source_write_size)
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import base64
-from typing import cast
+import datetime
+import contextlib
+from typing import AsyncIterator, cast
 import urllib.parse
 from xml.sax import saxutils
 
@@ -9,9 +11,11 @@ from starlette.requests import Request
 from starlette.responses import JSONResponse, Response, StreamingResponse
 
 from dlhdhr import config
-from dlhdhr.dlhd import DLHDClient
+from dlhdhr.dlhd import DLHDChannel, DLHDClient
 from dlhdhr.tuner import TunerManager, TunerNotFoundError
 from dlhdhr.epg import EPG
+from dlhdhr.metrics import render_metrics
+from dlhdhr.responses import BodyCache, DocumentCache
 
 
 def get_public_url(request: Request, path: str) -> str:
@@ -71,12 +75,9 @@ async def channel_proxy(request: Request) -> Response:
 
     listener = await tuner.get_listener()
 
-    async def _generator():
-        async for chunk in listener:
-            yield chunk
-
+    # The listener batches chunks into large writes itself, so hand it straight to the response
     return StreamingResponse(
-        _generator(),
+        listener,
         status_code=200,
         media_type="video/mp2t",
         headers={
@@ -87,40 +88,50 @@ async def channel_proxy(request: Request) -> Response:
     )
 
 
-async def listings_json(request: Request) -> JSONResponse:
+async def listings_json(request: Request) -> Response:
     dlhd = cast(DLHDClient, request.app.state.dlhd)
-    channels = sorted(dlhd.get_channels(), key=lambda c: int(c.number))
+    lineup = cast(BodyCache, request.app.state.lineup)
+    channels = dlhd.channels
+
+    def render() -> bytes:
+        return JSONResponse(
+            [
+                {
+                    "GuideName": channel.name,
+                    "GuideNumber": channel.number,
+                    "URL": get_public_url(request, channel.channel_proxy),
+                }
+                for channel in sorted(channels, key=lambda c: int(c.number))
+            ]
+        ).body
+
+    # Clients poll this, but it only changes with the channels (or the URL we are reached at)
+    return await lineup.response(request, (channels.version, get_public_url(request, "/")), render)
+
+
+async def discover_json(request: Request) -> Response:
+    tuners = cast(TunerManager, request.app.state.tuners)
+    discover = cast(BodyCache, request.app.state.discover)
+    tuner_count = tuners.total_available_listeners
 
-    return JSONResponse(
-        [
+    def render() -> bytes:
+        return JSONResponse(
             {
-                "GuideName": channel.name,
-                "GuideNumber": channel.number,
-                "URL": get_public_url(request, channel.channel_proxy),
+                "FriendlyName": config.DLHD_FRIENDLY_NAME,
+                "Manufacturer": "dlhdhomerun",
+                "ManufacturerURL": "https://c653labs.com/",
+                "ModelNumber": "HDTC-2US",
+                "FirmwareName": "hdhomeruntc_atsc",
+                "TunerCount": tuner_count,
+                "FirmwareVersion": "20170930",
+                "DeviceID": config.DLHD_DEVICE_ID,
+                "DeviceAuth": "",
+                "BaseURL": get_public_url(request, "/"),
+                "LineupURL": get_public_url(request, "/lineup.json"),
             }
-            for channel in channels
-        ]
-    )
+        ).body
 
-
-async def discover_json(request: Request) -> JSONResponse:
-    tuners = cast(TunerManager, request.app.state.tuners)
-
-    return JSONResponse(
-        {
-            "FriendlyName": config.DLHD_FRIENDLY_NAME,
-            "Manufacturer": "dlhdhomerun",
-            "ManufacturerURL": "https://c653labs.com/",
-            "ModelNumber": "HDTC-2US",
-            "FirmwareName": "hdhomeruntc_atsc",
-            "TunerCount": tuners.total_available_listeners,
-            "FirmwareVersion": "20170930",
-            "DeviceID": config.DLHD_DEVICE_ID,
-            "DeviceAuth": "",
-            "BaseURL": get_public_url(request, "/"),
-            "LineupURL": get_public_url(request, "/lineup.json"),
-        }
-    )
+    return await discover.response(request, (tuner_count, get_public_url(request, "/")), render)
 
 
 async def lineup_status_json(_: Request) -> JSONResponse:
@@ -134,27 +145,111 @@ async def lineup_status_json(_: Request) -> JSONResponse:
     )
 
 
+def _parse_xmltv_filter(request: Request) -> tuple[datetime.datetime | None, datetime.datetime | None, set[str] | None]:
+    # ?start=<unix timestamp or ISO 8601 datetime>&hours=<hours>&channels=<number>,<number>
+    start: datetime.datetime | None = None
+    end: datetime.datetime | None = None
+    numbers: set[str] | None = None
+
+    value = request.query_params.get("start")
+    if value:
+        try:
+            start = datetime.datetime.fromtimestamp(float(value), datetime.UTC)
+        except (ValueError, OverflowError):
+            try:
+                start = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                msg = f"Invalid start {value!r}, expected a unix timestamp or ISO 8601 datetime"
+                raise ValueError(msg) from None
+            if start.tzinfo is None:
+                start = start.replace(tzinfo=datetime.UTC)
+
+    value = request.query_params.get("hours")
+    if value:
+        if start is None:
+            start = datetime.datetime.now(datetime.UTC)
+        try:
+            end = start + datetime.timedelta(hours=float(value))
+        except (ValueError, OverflowError):
+            # Not a number, infinite or NaN, or a window ending beyond what a datetime can hold
+            msg = f"Invalid hours {value!r}"
+            raise ValueError(msg) from None
+
+    value = request.query_params.get("channels")
+    if value:
+        numbers = {v.strip() for v in value.split(",") if v.strip()}
+
+    return start, end, numbers
+
+
 async def xmltv_xml(request: Request) -> Response:
     dlhd = cast(DLHDClient, request.app.state.dlhd)
     epg = cast(EPG, request.app.state.epg)
 
-    dlhd_channels = dlhd.get_channels()
-    return Response(await epg.generate_xmltv(dlhd_channels), media_type="application/xml; charset=utf-8")
+    xmltv = cast(DocumentCache, request.app.state.xmltv)
+
+    channels = dlhd.channels
+    version = await epg.get_version(channels)
+
+    # Clients can ask for only the channels and time window they display, which is rendered for them alone
+    if {"start", "hours", "channels"} & request.query_params.keys():
+        try:
+            start, end, numbers = _parse_xmltv_filter(request)
+        except ValueError as e:
+            return Response(str(e), status_code=400)
+
+        filtered = [c for c in channels if c.number in numbers] if numbers is not None else channels
+        return StreamingResponse(
+            epg.stream_xmltv(filtered, start=start, end=end), media_type="application/xml; charset=utf-8"
+        )
+
+    # Only render the guide again when the channels or listings have changed since last time,
+    # a guide which is missing channels' listings is rendered again after EPG_INCOMPLETE_TTL
+    missing: list[DLHDChannel] = []
+    return xmltv.response(
+        request,
+        version,
+        lambda: epg.stream_xmltv(channels, missing=missing),
+        is_complete=lambda: not missing,
+    )
+
+
+async def epg_status_json(request: Request) -> JSONResponse:
+    epg = cast(EPG, request.app.state.epg)
+    return JSONResponse(epg.status())
+
+
+async def metrics(request: Request) -> Response:
+    dlhd = cast(DLHDClient, request.app.state.dlhd)
+    tuners = cast(TunerManager, request.app.state.tuners)
+    epg = cast(EPG, request.app.state.epg)
+
+    return Response(render_metrics(dlhd, tuners, epg), media_type="text/plain; version=0.0.4")
+
+
+async def traces_json(request: Request) -> JSONResponse:
+    dlhd = cast(DLHDClient, request.app.state.dlhd)
+    return JSONResponse([trace.to_dict() for trace in dlhd.tracer.slow_traces])
 
 
 async def iptv_m3u(request: Request) -> Response:
     dlhd = cast(DLHDClient, request.app.state.dlhd)
-    dlhd_channels = dlhd.get_channels()
+    iptv = cast(BodyCache, request.app.state.iptv)
+    channels = dlhd.channels
 
-    output = "#EXTM3U\n"
-    for channel in dlhd_channels:
-        if not channel.xmltv_id:
-            continue
-        output += f'#EXTINF:-1 CUID="{channel.number}" tvg-id="{channel.xmltv_id}" tvg-chno="{channel.number}" channel-id="{channel.number}",{channel.name}\n'
-        output += get_public_url(request, channel.channel_proxy)
-        output += "\n"
+    def render() -> bytes:
+        lines = ["#EXTM3U"]
+        for channel in channels:
+            if not channel.xmltv_id:
+                continue
+            lines.append(
+                f'#EXTINF:-1 CUID="{channel.number}" tvg-id="{channel.xmltv_id}" tvg-chno="{channel.number}" channel-id="{channel.number}",{channel.name}'
+            )
+            lines.append(get_public_url(request, channel.channel_proxy))
+        lines.append("")
+        return "\n".join(lines).encode()
 
-    return Response(output, media_type="text/plain")
+    return await iptv.response(request, (channels.version, get_public_url(request, "/")), render)
 
 
 async def channel_key_proxy(request: Request) -> Response:
@@ -171,19 +266,44 @@ async def channel_key_proxy(request: Request) -> Response:
     return Response(key, status_code=200, media_type="application/octet-stream")
 
 
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    dlhd = cast(DLHDClient, app.state.dlhd)
+    tuners = cast(TunerManager, app.state.tuners)
+    epg = cast(EPG, app.state.epg)
+
+    await tuners.start()
+    epg.start()
+    try:
+        yield
+    finally:
+        epg.stop()
+        tuners.stop()
+        await dlhd.aclose()
+
+
 def create_app() -> Starlette:
     dlhd_client = DLHDClient()
-    tuner_manager = TunerManager()
+    tuner_manager = TunerManager(dlhd_client, max_tuners=config.TUNER_COUNT)
 
-    app = Starlette()
+    app = Starlette(lifespan=lifespan)
     app.state.dlhd = dlhd_client
     app.state.tuners = tuner_manager
     app.state.epg = EPG()
+    app.state.xmltv = DocumentCache(
+        media_type="application/xml; charset=utf-8", incomplete_ttl=config.EPG_INCOMPLETE_TTL
+    )
+    app.state.lineup = BodyCache(media_type="application/json")
+    app.state.discover = BodyCache(media_type="application/json")
+    app.state.iptv = BodyCache(media_type="text/plain")
     app.add_route("/discover.json", discover_json)
     app.add_route("/lineup_status.json", lineup_status_json)
     app.add_route("/listings.json", listings_json)
     app.add_route("/lineup.json", listings_json)
     app.add_route("/xmltv.xml", xmltv_xml)
+    app.add_route("/epg_status.json", epg_status_json)
+    app.add_route("/metrics", metrics)
+    app.add_route("/debug/traces.json", traces_json)
     app.add_route("/iptv.m3u", iptv_m3u)
     app.add_route("/channel/{channel_number:int}/playlist.m3u8", channel_playlist_m3u8)
     app.add_route("/channel/{channel_number:int}/{segment_path:path}.ts", channel_segment_ts)
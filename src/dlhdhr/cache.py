@@ -0,0 +1,282 @@
+import asyncio
+from collections import OrderedDict
+import functools
+import time
+from typing import AsyncIterator, Awaitable, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[K, V]):
+    """Coalesces concurrent calls for the same key into a single call.
+
+    The call runs in its own task so a caller going away (e.g. a client
+    disconnecting) doesn't cancel it for everyone else waiting on the result.
+    """
+
+    _tasks: dict[K, asyncio.Future[V]]
+
+    def __init__(self):
+        self._tasks = {}
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: K, fn: Callable[[], Awaitable[V]]) -> V:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+        return await asyncio.shield(task)
+
+    def _done(self, key: K, task: asyncio.Future[V]) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+        # Mark any exception as retrieved, the callers waiting on it will have seen it
+        if not task.cancelled():
+            task.exception()
+
+
+class TTLCache(Generic[K, V]):
+    """Simple key/value cache where every entry expires `ttl` seconds after it was set.
+
+    Concurrent `get_or_fetch` calls for a missing key share a single fetch.
+    """
+
+    _ttl: float
+    _entries: dict[K, tuple[float, V]]
+    _flight: SingleFlight[K, V]
+    _prune_at: int = 64
+    _hits: int = 0
+    _misses: int = 0
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._entries = {}
+        self._flight = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def get(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key: K, value: V, ttl: float | None = None) -> None:
+        now = time.monotonic()
+        self._entries[key] = (now + (self._ttl if ttl is None else ttl), value)
+
+        # Expired entries are otherwise only dropped when they are looked up again
+        if len(self._entries) > self._prune_at:
+            self._entries = {k: entry for k, entry in self._entries.items() if entry[0] > now}
+            self._prune_at = max(64, len(self._entries) * 2)
+
+    def invalidate(self, key: K) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_fetch(self, key: K, fetch: Callable[[], Awaitable[V]]) -> V:
+        value = self.get(key)
+        if value is not None:
+            self._hits += 1
+            return value
+        self._misses += 1
+
+        async def _fetch() -> V:
+            value = await fetch()
+            self.set(key, value)
+            return value
+
+        return await self._flight.do(key, _fetch)
+
+
+class CachedStream:
+    """A response body which is (or was) being downloaded, and can be read by any number of readers.
+
+    Readers get every chunk downloaded so far straight away, and then wait for
+    the rest as it arrives, so nobody needs to wait for the whole body before
+    they start receiving data.
+    """
+
+    _chunks: list[bytes]
+    _size: int = 0
+    _done: bool = False
+    _error: BaseException | None = None
+    _waiter: asyncio.Future | None = None
+    expires: float
+
+    def __init__(self, expires: float):
+        self._chunks = []
+        self.expires = expires
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def append(self, chunk: bytes) -> None:
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        self._wakeup()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        self._done = True
+        self._error = error
+        self._wakeup()
+
+    def _wakeup(self) -> None:
+        if self._waiter is not None:
+            if not self._waiter.done():
+                self._waiter.set_result(None)
+            self._waiter = None
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        i = 0
+        while True:
+            if i < len(self._chunks):
+                yield self._chunks[i]
+                i += 1
+            elif self._done:
+                if self._error is not None:
+                    raise self._error
+                return
+            else:
+                if self._waiter is None:
+                    self._waiter = asyncio.get_running_loop().create_future()
+                await asyncio.shield(self._waiter)
+
+
+class StreamCache(Generic[K]):
+    """LRU cache of downloaded response bodies, bounded by a total size in bytes.
+
+    Each download runs in its own task, readers asking for a body which is
+    still downloading share that download, and failed downloads are not kept.
+    """
+
+    _max_bytes: int
+    _entries: OrderedDict[K, CachedStream]
+    _downloads: set[asyncio.Task]
+    _size: int = 0
+    _hits: int = 0
+    _misses: int = 0
+    _prefetches: int = 0
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._downloads = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return self._get(key) is not None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def prefetches(self) -> int:
+        return self._prefetches
+
+    def _get(self, key: K) -> CachedStream | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        if entry.expires <= time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key: K) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _evict(self) -> None:
+        while self._size > self._max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+
+    async def _download(self, key: K, entry: CachedStream, fetch: Callable[[], AsyncIterator[bytes]]) -> None:
+        try:
+            async for chunk in fetch():
+                entry.append(chunk)
+                if self._entries.get(key) is entry:
+                    self._size += len(chunk)
+                    self._evict()
+        except BaseException as e:
+            # Don't keep failed downloads around, the next request should try again
+            if self._entries.get(key) is entry:
+                self._remove(key)
+            entry.finish(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            entry.finish()
+
+    def _get_or_download(
+        self, key: K, fetch: Callable[[], AsyncIterator[bytes]], ttl: float
+    ) -> tuple[CachedStream, bool]:
+        # The cached or downloading entry for `key`, otherwise start downloading it, and whether it was started
+        entry = self._get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry, False
+
+        entry = CachedStream(expires=time.monotonic() + ttl)
+        self._entries[key] = entry
+        task = asyncio.create_task(self._download(key, entry, fetch))
+        self._downloads.add(task)
+        task.add_done_callback(self._downloads.discard)
+        return entry, True
+
+    def prefetch(self, key: K, fetch: Callable[[], AsyncIterator[bytes]], ttl: float) -> CachedStream:
+        # Start downloading `key` in the background, unless it is already cached or downloading.
+        # Prefetches are counted on their own, hits and misses are only counted for readers.
+        entry, started = self._get_or_download(key, fetch, ttl)
+        if started:
+            self._prefetches += 1
+        return entry
+
+    async def stream(self, key: K, fetch: Callable[[], AsyncIterator[bytes]], ttl: float) -> AsyncIterator[bytes]:
+        entry, started = self._get_or_download(key, fetch, ttl)
+        if started:
+            self._misses += 1
+        else:
+            self._hits += 1
+        async for chunk in entry:
+            yield chunk
@@ -1,4 +1,5 @@
 import os
+from typing import NamedTuple
 
 
 def _set_or_none(name: str) -> set[str] | None:
@@ -9,13 +10,42 @@ def _set_or_none(name: str) -> set[str] | None:
     return set(v.strip() for v in env.split(",") if v.strip())
 
 
+class Zap2itLineup(NamedTuple):
+    lineup_id: str
+    headend_id: str
+    postal_code: str
+
+
+def _zap2it_lineups(name: str, default: str) -> list[Zap2itLineup]:
+    # "<lineup id>:<headend id>:<postal code>,..."
+    lineups = []
+    for value in (os.getenv(name) or default).split(","):
+        if value.strip():
+            lineup_id, headend_id, postal_code = (v.strip() for v in value.split(":"))
+            lineups.append(Zap2itLineup(lineup_id=lineup_id, headend_id=headend_id, postal_code=postal_code))
+    return lineups
+
+
 HOST = os.getenv("DLHDHR_HOST", "127.0.0.1")
 PORT: int = int(os.getenv("DLHDHR_PORT", 8000))
 DEBUG: bool = os.getenv("DLHDHR_DEBUG", "0").lower() in ("1", "true")
 
 DLHD_BASE_URL = os.getenv("DLHD_BASE_URL", "https://dlhd.sx/")
+# `{channel}` is replaced with the channel number
+DLHD_PLAYER_URL = os.getenv("DLHD_PLAYER_URL", "https://weblivehdplay.ru/premiumtv/daddyhd.php?id={channel}")
 DLHD_DEVICE_ID = os.getenv("DLHD_DEVICE_ID", "dlhdhr")
 DLHD_FRIENDLY_NAME = os.getenv("DLHD_FRIENDLY_NAME", "dlhdhr")
+CHANNEL_RESOLVE_TTL: int = int(os.getenv("DLHDHR_CHANNEL_RESOLVE_TTL", "600"))
+KEY_CACHE_TTL: int = int(os.getenv("DLHDHR_KEY_CACHE_TTL", "300"))
+SEGMENT_CACHE_SIZE: int = int(os.getenv("DLHDHR_SEGMENT_CACHE_SIZE", str(64 * 1024 * 1024)))
+SEGMENT_PREFETCH: int = int(os.getenv("DLHDHR_SEGMENT_PREFETCH", "3"))
+
+UPSTREAM_MAX_CONNECTIONS: int = int(os.getenv("DLHDHR_UPSTREAM_MAX_CONNECTIONS", "20"))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("DLHDHR_UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+UPSTREAM_KEEPALIVE_EXPIRY: float = float(os.getenv("DLHDHR_UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_TRACE_SAMPLE_RATE: float = float(os.getenv("DLHDHR_UPSTREAM_TRACE_SAMPLE_RATE", "0.1"))
+UPSTREAM_SLOW_TRACE: float = float(os.getenv("DLHDHR_UPSTREAM_SLOW_TRACE", "2"))
+UPSTREAM_SLOW_TRACES: int = int(os.getenv("DLHDHR_UPSTREAM_SLOW_TRACES", "50"))
 
 CHANNEL_EXCLUDE: set[str] | None = _set_or_none("DLHDHR_CHANNEL_EXCLUDE")
 CHANNEL_ALLOW: set[str] | None = _set_or_none("DLHDHR_CHANNEL_ALLOW")
@@ -23,6 +53,30 @@ COUNTRY_EXCLUDE: set[str] | None = _set_or_none("DLHDHR_COUNTRY_EXCLUDE")
 COUNTRY_ALLOW: set[str] | None = _set_or_none("DLHDHR_COUNTRY_ALLOW")
 
 ZAP2IT_REFRESH_DELAY: int = int(os.getenv("DLHDHR_ZAP2IT_REFRESH_DELAY", "3600"))
+ZAP2IT_LINEUPS: list[Zap2itLineup] = _zap2it_lineups(
+    "DLHDHR_ZAP2IT_LINEUPS", "USA-NY31519-DEFAULT:NY31519:10001,USA-CA66511-DEFAULT:CA66511:90001"
+)
+ZAP2IT_GRID_HOURS: int = int(os.getenv("DLHDHR_ZAP2IT_GRID_HOURS", "18"))
+ZAP2IT_CONCURRENCY: int = int(os.getenv("DLHDHR_ZAP2IT_CONCURRENCY", "4"))
+ZAP2IT_RETRIES: int = int(os.getenv("DLHDHR_ZAP2IT_RETRIES", "2"))
 ZAPTV_REFRESH_DELAY: int = int(os.getenv("DLHDHR_ZAPTV_REFRESH_DELAY", "3600"))
 EPGSKY_REFRESH_DELAY: int = int(os.getenv("DLHDHR_EPGSKY_REFRESH_DELAY", "3600"))
+EPG_SNAPSHOT_PATH: str | None = os.getenv("DLHDHR_EPG_SNAPSHOT_PATH") or None
+EPG_REFRESH_JITTER: float = float(os.getenv("DLHDHR_EPG_REFRESH_JITTER", "0.1"))
+EPG_RETRY_DELAY: float = float(os.getenv("DLHDHR_EPG_RETRY_DELAY", "30"))
+EPG_DEADLINE: float = float(os.getenv("DLHDHR_EPG_DEADLINE", "30"))
+EPG_INCOMPLETE_TTL: float = float(os.getenv("DLHDHR_EPG_INCOMPLETE_TTL", "60"))
+EPG_PROVIDER_CONCURRENCY: int = int(os.getenv("DLHDHR_EPG_PROVIDER_CONCURRENCY", "4"))
 EPGSKY_LOCATION_ID: int = int(os.getenv("DLHDHR_EPGSKY_LOCATION_ID", "1"))
+
+TUNER_ENGINE: str = os.getenv("DLHDHR_TUNER_ENGINE", "ffmpeg").lower()
+TUNER_COUNT: int = int(os.getenv("DLHDHR_TUNER_COUNT", "2"))
+TUNER_BUFFER_SIZE: int = int(os.getenv("DLHDHR_TUNER_BUFFER_SIZE", str(8 * 1024 * 1024)))
+TUNER_HOT_CHANNELS: set[str] | None = _set_or_none("DLHDHR_TUNER_HOT_CHANNELS")
+TUNER_STANDBY_RECENT: int = int(os.getenv("DLHDHR_TUNER_STANDBY_RECENT", "0"))
+LISTENER_MAX_LAG: int = int(os.getenv("DLHDHR_LISTENER_MAX_LAG", str(4 * 1024 * 1024)))
+LISTENER_LAG_POLICY: str = os.getenv("DLHDHR_LISTENER_LAG_POLICY", "keyframe").lower()
+
+FFMPEG_READ_SIZE: int = int(os.getenv("DLHDHR_FFMPEG_READ_SIZE", str(64 * 1024)))
+STREAM_WRITE_SIZE: int = int(os.getenv("DLHDHR_STREAM_WRITE_SIZE", str(64 * 1024)))
+STREAM_MAX_LATENCY: float = float(os.getenv("DLHDHR_STREAM_MAX_LATENCY", "0.05"))
@@ -1,6 +1,9 @@
+import asyncio
 import base64
+from collections import Counter
+from dataclasses import dataclass, field
 import time
-from typing import Iterator
+from typing import AsyncIterator, Awaitable, Callable, Iterator
 import urllib.parse
 import re
 
@@ -10,22 +13,86 @@ import httpx
 import m3u8
 
 from dlhdhr import config
+from dlhdhr.cache import SingleFlight, StreamCache, TTLCache
 
-from dlhdhr.dlhd.channels import DLHDChannel, get_channels
+from dlhdhr.dlhd.channels import ChannelRegistry, DLHDChannel, get_channels, get_registry
+from dlhdhr.dlhd.prefetch import SegmentPrefetcher
+from dlhdhr.dlhd.tracing import Trace, Tracer
+from dlhdhr.metrics import Histogram
+
+
+@dataclass()
+class PoolStats:
+    requests: int = 0
+    connections: int = 0
+
+    @property
+    def hits(self) -> int:
+        # Requests which were sent on an already open (keep-alive) connection
+        return max(0, self.requests - self.connections)
+
+    @property
+    def misses(self) -> int:
+        # Requests which had to open a new connection
+        return self.connections
+
+
+@dataclass()
+class UpstreamStats:
+    # Responses by status code
+    responses: Counter[str] = field(default_factory=Counter)
+    # Requests which failed without a response
+    errors: int = 0
+    # Seconds until the response headers were received
+    latency: Histogram = field(default_factory=Histogram)
+
+
+@dataclass(frozen=True)
+class ChannelSource:
+    # The player page url, which needs to be sent as the referer for upstream requests
+    referer: str
+    # The media playlist url, which segment and key uris are relative to
+    playlist_url: str
 
 
 class DLHDClient:
     CHANNEL_REFRESH = 60 * 60 * 12  # every 12 hours
+    # How long to keep segments cached for if we haven't seen the playlist yet
+    DEFAULT_PLAYLIST_WINDOW = 60
 
     _channels: dict[str, DLHDChannel]
     _channels_last_fetch: float = 0
-    _base_urls: dict[DLHDChannel, (float, str)]
-    _referers: dict[DLHDChannel, str]
+    _sources: TTLCache[DLHDChannel, ChannelSource]
+    _playlists: SingleFlight[DLHDChannel, tuple[str, bytes]]
+    _playlist_windows: dict[DLHDChannel, float]
+    _segments: StreamCache[tuple[str, str]]
+    _prefetchers: dict[DLHDChannel, SegmentPrefetcher]
+    _keys: TTLCache[tuple[str, str], bytes]
+    _tasks: set[asyncio.Task]
+    _clients: dict[str, httpx.AsyncClient]
+    _pool_stats: dict[str, PoolStats]
+    _upstream_stats: dict[str, UpstreamStats]
+    _traces: dict[str, Callable[[str, dict], Awaitable[None]]]
+    _tracer: Tracer
 
     def __init__(self):
         self._channels = {}
-        self._base_urls = {}
-        self._referers = {}
+        self._sources = TTLCache(ttl=config.CHANNEL_RESOLVE_TTL)
+        self._playlists = SingleFlight()
+        self._playlist_windows = {}
+        self._segments = StreamCache(max_bytes=config.SEGMENT_CACHE_SIZE)
+        self._prefetchers = {}
+        self._keys = TTLCache(ttl=config.KEY_CACHE_TTL)
+        self._tasks = set()
+        self._clients = {}
+        self._pool_stats = {}
+        self._upstream_stats = {}
+        self._traces = {}
+        self._tracer = Tracer(
+            sample_rate=config.UPSTREAM_TRACE_SAMPLE_RATE,
+            slow=config.UPSTREAM_SLOW_TRACE,
+            keep=config.UPSTREAM_SLOW_TRACES,
+        )
 
     async def _log_request(self, request):
         if config.DEBUG:
@@ -36,12 +103,12 @@ class DLHDClient:
             request = response.request
             print(f"Response event hook: {request.method} {request.url} - Status {response.status_code}")
 
-    def _get_client(self, referer: str = ""):
+    def _get_headers(self, referer: str = "") -> dict[str, str]:
         parsed = urllib.parse.urlparse(referer)
         origin = f"{parsed.scheme}://{parsed.netloc}"
         referer = f"{parsed.scheme}://{parsed.netloc}/"
 
-        headers = {
+        return {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:122.0) Gecko/20100101 Firefox/122.0",
             "Origin": origin,
             "Referer": referer,
@@ -55,126 +122,307 @@ class DLHDClient:
             "Cache-Control": "no-cache",
             "TE": "trailers",
         }
-        return httpx.AsyncClient(
-            base_url=config.DLHD_BASE_URL,
-            headers=headers,
-            max_redirects=2,
-            verify=True,
-            timeout=8.0,
-            event_hooks={"request": [self._log_request], "response": [self._log_response]},
-        )
+
+    def _get_trace(self, host: str) -> Callable[[str, dict], Awaitable[None]]:
+        # httpcore calls the trace extension for every step of a request, which
+        # tells us whether the request had to open a new connection or not
+        if host not in self._traces:
+            stats = self._pool_stats.setdefault(host, PoolStats())
+
+            async def trace(event_name: str, _info: dict) -> None:
+                if event_name == "connection.connect_tcp.started":
+                    stats.connections += 1
+                elif event_name.endswith(".send_request_headers.started"):
+                    stats.requests += 1
+
+            self._traces[host] = trace
+        return self._traces[host]
+
+    def _get_client(self, url: str) -> tuple[httpx.AsyncClient, str, UpstreamStats]:
+        # Keep a long lived connection pool per upstream host, so we don't
+        # need a new connection (and TLS handshake) for every request
+        parsed = urllib.parse.urlparse(url)
+        host = f"{parsed.scheme}://{parsed.netloc}"
+        stats = self._upstream_stats.get(host)
+        if stats is None:
+            stats = self._upstream_stats[host] = UpstreamStats()
+        if host not in self._clients:
+            self._clients[host] = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config.UPSTREAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=config.UPSTREAM_KEEPALIVE_EXPIRY,
+                ),
+                max_redirects=2,
+                verify=True,
+                timeout=8.0,
+                event_hooks={"request": [self._log_request], "response": [self._log_response]},
+            )
+        return self._clients[host], host, stats
+
+    async def _get(self, url: str, referer: str, phase: str) -> httpx.Response:
+        # `phase` names the request in traces, e.g. "player_page" or "key"
+        client, host, stats = self._get_client(url)
+        trace = self._tracer.current()
+        with self._tracer.span(trace, phase, host=host) as span:
+            extensions = {"trace": self._tracer.http_trace(span, trace, self._get_trace(host))}
+            started = time.monotonic()
+            try:
+                res = await client.get(
+                    url, headers=self._get_headers(referer), follow_redirects=True, extensions=extensions
+                )
+            except httpx.TransportError:
+                stats.errors += 1
+                raise
+            stats.latency.observe(time.monotonic() - started)
+            stats.responses[str(res.status_code)] += 1
+            res.raise_for_status()
+            return res
+
+    async def _stream(self, url: str, referer: str, phase: str, trace: Trace | None = None) -> AsyncIterator[bytes]:
+        # Generators can outlive the context they were created in, so their trace can be given explicitly
+        client, host, stats = self._get_client(url)
+        trace = trace or self._tracer.current()
+        headers = self._get_headers(referer)
+        with self._tracer.span(trace, phase, host=host) as span:
+            extensions = {"trace": self._tracer.http_trace(span, trace, self._get_trace(host))}
+            started = time.monotonic()
+            try:
+                async with client.stream(
+                    "GET", url, headers=headers, follow_redirects=True, extensions=extensions
+                ) as res:
+                    stats.latency.observe(time.monotonic() - started)
+                    stats.responses[str(res.status_code)] += 1
+                    res.raise_for_status()
+                    async for chunk in res.aiter_bytes():
+                        yield chunk
+            except httpx.TransportError:
+                stats.errors += 1
+                raise
+
+    @property
+    def pool_stats(self) -> dict[str, PoolStats]:
+        return dict(self._pool_stats)
+
+    @property
+    def upstream_stats(self) -> dict[str, UpstreamStats]:
+        return dict(self._upstream_stats)
+
+    @property
+    def tracer(self) -> Tracer:
+        return self._tracer
+
+    @property
+    def prefetchers(self) -> dict[DLHDChannel, SegmentPrefetcher]:
+        return dict(self._prefetchers)
+
+    @property
+    def segment_cache(self) -> StreamCache[tuple[str, str]]:
+        return self._segments
+
+    @property
+    def source_cache(self) -> TTLCache[DLHDChannel, ChannelSource]:
+        return self._sources
+
+    @property
+    def key_cache(self) -> TTLCache[tuple[str, str], bytes]:
+        return self._keys
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
 
     def get_channels(self) -> Iterator[DLHDChannel]:
         return get_channels()
 
+    @property
+    def channels(self) -> ChannelRegistry:
+        return get_registry()
+
     def get_channel(self, channel_number: str) -> DLHDChannel | None:
-        for channel in self.get_channels():
-            if channel.number == channel_number:
-                return channel
-        return None
+        return get_registry().get(channel_number)
+
+    async def _resolve_channel(self, channel: DLHDChannel) -> ChannelSource:
+        # Scrape the player page for the master playlist, and pick the media playlist from it
+        base_url = config.DLHD_PLAYER_URL.format(channel=channel.number)
+        referer = urllib.parse.urljoin(config.DLHD_BASE_URL, f"stream/stream-{channel.number}.php")
+
+        res = await self._get(base_url, referer=referer, phase="player_page")
+        referer = str(res.request.url)
+
+        content = html.fromstring(res.content)
+        scripts = content.cssselect(".player_div script")
+        index_m3u8_url = None
+        for script in scripts:
+            urls = re.findall(r"source:'(https?://.*?index\.m3u8.*?)'", script.text)
+            if urls:
+                index_m3u8_url = urls[0]
+                break
+        else:
+            raise ValueError("Could not find index m3u8")
+
+        res = await self._get(index_m3u8_url, referer=referer, phase="master_playlist")
+        playlist = m3u8.loads(res.content.decode())
+
+        # We only expect a single playlist right now
+        mono_url = urllib.parse.urljoin(str(res.request.url), playlist.playlists[0].uri)
+        return ChannelSource(referer=referer, playlist_url=mono_url)
+
+    async def get_channel_source(self, channel: DLHDChannel) -> ChannelSource:
+        # Resolving a channel takes a couple of round trips, so cache the result
+        # and share a single resolution between concurrent callers
+        return await self._sources.get_or_fetch(channel, lambda: self._resolve_channel(channel))
 
     async def get_channel_referer(self, channel: DLHDChannel) -> str:
-        if channel not in self._referers:
-            base_url = f"https://weblivehdplay.ru/premiumtv/daddyhd.php?id={channel.number}"
-            referer = f"https://dlhd.sx/stream/stream-{channel.number}.php"
-            async with self._get_client(referer=referer) as client:
-                res = await client.get(base_url, follow_redirects=True)
-                res.raise_for_status()
-                self._referers[channel] = str(res.request.url)
-        return self._referers[channel]
+        source = await self.get_channel_source(channel)
+        return source.referer
+
+    async def _fetch_media_playlist(self, channel: DLHDChannel) -> tuple[str, bytes]:
+        source = await self.get_channel_source(channel)
+        try:
+            res = await self._get(source.playlist_url, referer=source.referer, phase="media_playlist")
+        except httpx.HTTPStatusError:
+            # The cached playlist url might have gone stale, resolve the channel again and retry once
+            self._sources.invalidate(channel)
+            source = await self.get_channel_source(channel)
+            res = await self._get(source.playlist_url, referer=source.referer, phase="media_playlist")
+        return source.playlist_url, res.content
+
+    async def get_channel_media_playlist(self, channel: DLHDChannel) -> m3u8.M3U8:
+        # Fetch the upstream media playlist as-is, segment and key uris are relative to the upstream url.
+        # Concurrent fetches for the same channel share a single request, but each gets its own copy
+        playlist_url, content = await self._playlists.do(channel, lambda: self._fetch_media_playlist(channel))
+        playlist = m3u8.loads(content.decode(), uri=playlist_url)
+
+        # Cached segments are only useful while they are in the playlist
+        window = sum(segment.duration or 0 for segment in playlist.segments)
+        if window:
+            self._playlist_windows[channel] = window + (playlist.target_duration or 0)
+
+        await self._prefetch_segments(channel, playlist)
+        return playlist
+
+    async def _prefetch_segments(self, channel: DLHDChannel, playlist: m3u8.M3U8) -> None:
+        # Start downloading the newest segments as soon as they show up in the playlist,
+        # so they are already cached (or on their way) when the clients ask for them
+        if config.SEGMENT_CACHE_SIZE <= 0 or config.SEGMENT_PREFETCH <= 0 or not playlist.segments:
+            return
+
+        prefetcher = self._prefetchers.get(channel)
+        if prefetcher is None:
+            prefetcher = self._prefetchers[channel] = SegmentPrefetcher(max_segments=config.SEGMENT_PREFETCH)
+
+        source = await self.get_channel_source(channel)
+        ttl = self._playlist_windows.get(channel, self.DEFAULT_PLAYLIST_WINDOW)
+        for segment in playlist.segments[-prefetcher.segments :]:
+            segment_url = urllib.parse.urljoin(source.playlist_url, segment.uri)
+            key = (channel.number, segment_url)
+            if key in self._segments:
+                continue
+
+            def fetch(segment_url: str = segment_url, duration: float = segment.duration or 0) -> AsyncIterator[bytes]:
+                return prefetcher.measure(self._stream(segment_url, referer=source.referer, phase="prefetch"), duration)
+
+            # The download outlives the playlist request which started it
+            with self._tracer.detach():
+                self._segments.prefetch(key, fetch, ttl)
 
     async def get_channel_playlist(self, channel: DLHDChannel) -> m3u8.M3U8:
-        base_url = f"https://weblivehdplay.ru/premiumtv/daddyhd.php?id={channel.number}"
-        referer = f"https://dlhd.sx/stream/stream-{channel.number}.php"
-
-        async with self._get_client(referer=referer) as client:
-            res = await client.get(base_url, follow_redirects=True)
-            res.raise_for_status()
-            referer = str(res.request.url)
-
-            content = html.fromstring(res.content)
-            scripts = content.cssselect(".player_div script")
-            index_m3u8_url = None
-            for script in scripts:
-                urls = re.findall(r"source:'(https://.*?index\.m3u8.*?)'", script.text)
-                if urls:
-                    index_m3u8_url = urls[0]
-                    break
-            else:
-                raise ValueError("Could not find index m3u8")
-
-        async with self._get_client(referer=referer) as client:
-            res = await client.get(index_m3u8_url, follow_redirects=True)
-            res.raise_for_status()
-
-            playlist = m3u8.loads(res.content.decode())
-
-            # We only expect a single playlist right now
-            mono_url = urllib.parse.urljoin(str(res.request.url), playlist.playlists[0].uri)
-
-            res = await client.get(mono_url)
-            res.raise_for_status()
-
-            mono_playlist = m3u8.loads(res.content.decode())
-
-            new_keys = []
-            for key in mono_playlist.keys:
-                if not key:
-                    continue
-
-                uri = str(key.absolute_uri or key.uri)
-                if not uri:
-                    continue
-
-                proxy_uri = base64.urlsafe_b64encode(uri.encode())
-                new_key = m3u8.Key(
-                    method=key.method,
-                    base_uri=None,
-                    uri=f"/channel/{channel.number}/key/{proxy_uri.decode()}",
-                    iv=key.iv,
-                    keyformat=key.keyformat,
-                    keyformatversions=key.keyformatversions,
-                    **key._extra_params,
-                )
-                new_keys.append(new_key)
-
-                for segment in mono_playlist.segments:
-                    if segment.key == key:
-                        segment.key = new_key
-
-            mono_playlist.keys = new_keys
-            self._base_urls[channel] = (time.time(), mono_url)
-
+        with self._tracer.trace("channel_playlist", channel.number):
+            return await self._get_channel_playlist(channel)
+
+    async def _get_channel_playlist(self, channel: DLHDChannel) -> m3u8.M3U8:
+        mono_playlist = await self.get_channel_media_playlist(channel)
+
+        # Rewrite the keys to go through our key proxy
+        new_keys = []
+        for key in mono_playlist.keys:
+            if not key:
+                continue
+
+            uri = str(key.absolute_uri or key.uri)
+            if not uri:
+                continue
+            self.prefetch_channel_key(channel, uri)
+
+            proxy_uri = base64.urlsafe_b64encode(uri.encode())
+            new_key = m3u8.Key(
+                method=key.method,
+                base_uri=None,
+                uri=f"/channel/{channel.number}/key/{proxy_uri.decode()}",
+                iv=key.iv,
+                keyformat=key.keyformat,
+                keyformatversions=key.keyformatversions,
+                **key._extra_params,
+            )
+            new_keys.append(new_key)
+
+            for segment in mono_playlist.segments:
+                if segment.key == key:
+                    segment.key = new_key
+
+        mono_playlist.keys = new_keys
         return mono_playlist
 
-    async def get_channel_key(self, channel: DLHDChannel, proxy_url: str) -> bytes:
+    async def _fetch_channel_key(self, channel: DLHDChannel, key_url: str) -> bytes:
         referer = await self.get_channel_referer(channel)
 
-        async with self._get_client(referer=referer) as client:
-            res = await client.get(proxy_url)
-            res.raise_for_status()
+        res = await self._get(key_url, referer=referer, phase="key")
+        return res.content
 
-            return res.content
+    async def get_channel_key(self, channel: DLHDChannel, proxy_url: str) -> bytes:
+        # Keys rotate far less often than segments, cache them and share concurrent fetches
+        with self._tracer.trace("channel_key", channel.number):
+            return await self._keys.get_or_fetch(
+                (channel.number, proxy_url), lambda: self._fetch_channel_key(channel, proxy_url)
+            )
+
+    async def _prefetch_channel_key(self, channel: DLHDChannel, key_url: str) -> None:
+        try:
+            await self.get_channel_key(channel, key_url)
+        except Exception as e:
+            if config.DEBUG:
+                print(f"Failed to prefetch key {key_url} for {channel}: {e!r}")
+
+    def prefetch_channel_key(self, channel: DLHDChannel, key_url: str) -> None:
+        # Fetch the key in the background so it is already cached when the client asks for it
+        if self._keys.get((channel.number, key_url)) is not None:
+            return
+
+        with self._tracer.detach():
+            task = asyncio.create_task(self._prefetch_channel_key(channel, key_url))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
     async def get_channel_base_url(self, channel: DLHDChannel) -> str:
-        created, base_url = self._base_urls.get(channel, (None, None))
-        if not created or not base_url:
-            # This is how we get and populate the base url
-            await self.get_channel_playlist(channel)
-            return self._base_urls[channel][1]
-
-        if (time.time() - created) > 60:
-            await self.get_channel_playlist(channel)
-            return self._base_urls[channel][1]
-
-        return base_url
+        source = await self.get_channel_source(channel)
+        return source.playlist_url
 
     async def stream_segment(self, channel: DLHDChannel, segment_path: str):
-        referer = await self.get_channel_referer(channel)
-        base_url = await self.get_channel_base_url(channel)
-        segment_url = urllib.parse.urljoin(base_url, segment_path)
+        source = await self.get_channel_source(channel)
+        segment_url = urllib.parse.urljoin(source.playlist_url, segment_path)
 
-        async with self._get_client(referer=referer) as client:
-            async with client.stream("GET", segment_url, follow_redirects=True) as res:
-                async for chunk in res.aiter_bytes():
+        trace = self._tracer.start("channel_segment", channel.number)
+        try:
+            if config.SEGMENT_CACHE_SIZE <= 0:
+                async for chunk in self._stream(segment_url, referer=source.referer, phase="segment", trace=trace):
                     yield chunk
+                return
+
+            # Every client (and tuner) watching a channel asks for the same segments,
+            # so share a single download of each one between them
+            ttl = self._playlist_windows.get(channel, self.DEFAULT_PLAYLIST_WINDOW)
+            key = (channel.number, segment_url)
+
+            def fetch() -> AsyncIterator[bytes]:
+                return self._stream(segment_url, referer=source.referer, phase="segment", trace=trace)
+
+            async for chunk in self._segments.stream(key, fetch, ttl):
+                yield chunk
+        finally:
+            self._tracer.finish(trace)
+
+    async def get_segment(self, channel: DLHDChannel, segment_path: str) -> bytes:
+        return b"".join([chunk async for chunk in self.stream_segment(channel, segment_path)])
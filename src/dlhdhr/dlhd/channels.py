@@ -1,7 +1,7 @@
 from collections.abc import Generator
-from dataclasses import dataclass
-from xml.etree.ElementTree import Element, SubElement
-from typing import Iterator
+from dataclasses import dataclass, field
+from xml.etree.ElementTree import Element, SubElement, tostring
+from typing import Callable, Iterable, Iterator
 
 from dlhdhr import config
 
@@ -15,6 +15,8 @@ class DLHDChannel:
     call_sign: str | None = None
     epgsky_id: str | None = None
     thumbnail: str | None = None
+    # Serialized `<channel>` nodes, by the thumbnail they were rendered with
+    _xmltv: dict[str | None, bytes] = field(default_factory=dict, init=False, repr=False, compare=False)
 
     @property
     def playlist_m3u8(self) -> str:
@@ -34,6 +36,12 @@ class DLHDChannel:
 
         return node
 
+    def xmltv_fragment(self, thumbnail: str | None = None) -> bytes:
+        fragment = self._xmltv.get(thumbnail)
+        if fragment is None:
+            fragment = self._xmltv[thumbnail] = tostring(self.to_xmltv(thumbnail=thumbnail))
+        return fragment
+
 
 _CHANNELS = [
     DLHDChannel(number="31", name="TNT Sports 1 UK", country_code="uk", xmltv_id="TNTSport1.uk", epgsky_id="3661"),
@@ -867,21 +875,96 @@ _CHANNELS = [
 ]
 
 
+def _is_allowed(channel: DLHDChannel) -> bool:
+    if config.CHANNEL_ALLOW is not None:
+        if channel.number not in config.CHANNEL_ALLOW:
+            return False
+    if config.CHANNEL_EXCLUDE is not None:
+        if channel.number in config.CHANNEL_EXCLUDE:
+            return False
+
+    if config.COUNTRY_ALLOW is not None:
+        if channel.country_code not in config.COUNTRY_ALLOW:
+            return False
+
+    if config.COUNTRY_EXCLUDE is not None:
+        if channel.country_code in config.COUNTRY_EXCLUDE:
+            return False
+
+    return True
+
+
+def _group_by(
+    channels: Iterable[DLHDChannel], key: Callable[[DLHDChannel], str | None]
+) -> dict[str, tuple[DLHDChannel, ...]]:
+    groups: dict[str, list[DLHDChannel]] = {}
+    for channel in channels:
+        value = key(channel)
+        if value:
+            groups.setdefault(value, []).append(channel)
+    return {value: tuple(channels) for value, channels in groups.items()}
+
+
+class ChannelRegistry:
+    """Immutable snapshot of the channels we serve, with the config filters already applied.
+
+    Lookups by number, xmltv id, call sign, epgsky id and country are plain
+    dict lookups. Only the number is unique, several channels can share any of
+    the others (769 and 53 are both WNBC), so those indexes hold every match.
+    Changing the channel list or filters builds a whole new registry which
+    replaces the old one (see `reload_channels`), so readers always see a
+    consistent snapshot.
+    """
+
+    version: int
+    channels: tuple[DLHDChannel, ...]
+    by_number: dict[str, DLHDChannel]
+    by_xmltv_id: dict[str, tuple[DLHDChannel, ...]]
+    by_call_sign: dict[str, tuple[DLHDChannel, ...]]
+    by_epgsky_id: dict[str, tuple[DLHDChannel, ...]]
+    by_country: dict[str, tuple[DLHDChannel, ...]]
+
+    def __init__(self, channels: Iterable[DLHDChannel], version: int = 0):
+        self.version = version
+        self.channels = tuple(channels)
+        self.by_number = {c.number: c for c in self.channels}
+        self.by_xmltv_id = _group_by(self.channels, lambda c: c.xmltv_id)
+        self.by_call_sign = _group_by(self.channels, lambda c: c.call_sign)
+        self.by_epgsky_id = _group_by(self.channels, lambda c: c.epgsky_id)
+        self.by_country = _group_by(self.channels, lambda c: c.country_code)
+
+    @classmethod
+    def build(cls, channels: Iterable[DLHDChannel] | None = None, version: int = 0) -> "ChannelRegistry":
+        return cls((c for c in (_CHANNELS if channels is None else channels) if _is_allowed(c)), version=version)
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def __iter__(self) -> Iterator[DLHDChannel]:
+        return iter(self.channels)
+
+    def get(self, channel_number: str) -> DLHDChannel | None:
+        return self.by_number.get(channel_number)
+
+
+_registry: ChannelRegistry | None = None
+
+
+def get_registry() -> ChannelRegistry:
+    if _registry is None:
+        return reload_channels()
+    return _registry
+
+
+def reload_channels(channels: Iterable[DLHDChannel] | None = None) -> ChannelRegistry:
+    # Rebuild the registry from `channels` (or the built in list) with the current config filters,
+    # and swap it in as a whole so nothing ever sees a half built registry. Its version is part of
+    # the ETags of everything rendered from the channels, so those are rendered again
+    global _registry  # noqa: PLW0603
+    registry = ChannelRegistry.build(channels, version=_registry.version + 1 if _registry is not None else 0)
+    _registry = registry
+    return registry
+
+
 def get_channels() -> Iterator[DLHDChannel]:
-    for channel in _CHANNELS:
-        if config.CHANNEL_ALLOW is not None:
-            if channel.number not in config.CHANNEL_ALLOW:
-                continue
-        if config.CHANNEL_EXCLUDE is not None:
-            if channel.number in config.CHANNEL_EXCLUDE:
-                continue
-
-        if config.COUNTRY_ALLOW is not None:
-            if channel.country_code not in config.COUNTRY_ALLOW:
-                continue
-
-        if config.COUNTRY_EXCLUDE is not None:
-            if channel.country_code in config.COUNTRY_EXCLUDE:
-                continue
-
-        yield channel
+    return iter(get_registry())
@@ -0,0 +1,44 @@
+import asyncio
+import math
+from typing import AsyncIterator
+
+
+class SegmentPrefetcher:
+    """Decides how many of a channel's newest segments to download ahead of the clients.
+
+    Keeps a moving average of how long segment downloads take compared to the
+    segment's duration (`#EXTINF`). When upstream is fast a single segment ahead
+    is enough, when it is slow we need several downloads in flight at once to
+    keep up with playback.
+    """
+
+    # Weight given to the latest measurement in the moving average
+    SMOOTHING: float = 0.3
+
+    _max_segments: int
+    # Moving average of download time / segment duration
+    _ratio: float = 0.5
+
+    def __init__(self, max_segments: int):
+        self._max_segments = max_segments
+
+    @property
+    def ratio(self) -> float:
+        return self._ratio
+
+    @property
+    def segments(self) -> int:
+        return max(1, min(self._max_segments, math.ceil(self._ratio + 0.5)))
+
+    def record(self, elapsed: float, duration: float) -> None:
+        if duration <= 0:
+            return
+        self._ratio += self.SMOOTHING * (elapsed / duration - self._ratio)
+
+    async def measure(self, chunks: AsyncIterator[bytes], duration: float) -> AsyncIterator[bytes]:
+        # Pass `chunks` through, recording how long the whole download took once it completes
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        async for chunk in chunks:
+            yield chunk
+        self.record(loop.time() - started, duration)
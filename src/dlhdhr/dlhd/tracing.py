@@ -0,0 +1,197 @@
+import collections
+import contextlib
+import contextvars
+from dataclasses import dataclass, field
+import random
+import time
+from typing import Any, Awaitable, Callable, Iterator
+
+from dlhdhr.metrics import Histogram
+
+HTTPTrace = Callable[[str, dict], Awaitable[None]]
+
+# The httpcore trace events we time, and the phase they are recorded as. httpcore resolves
+# the host as part of opening the TCP connection, so DNS is included in "connect"
+_HTTP_PHASES = {
+    "connect_tcp": "http.connect",
+    "start_tls": "http.tls",
+    "receive_response_headers": "http.ttfb",
+    "receive_response_body": "http.body",
+}
+
+_current: contextvars.ContextVar["Trace | None"] = contextvars.ContextVar("dlhdhr_trace", default=None)
+
+
+@dataclass()
+class Span:
+    name: str
+    # Seconds since the start of the trace
+    start: float
+    duration: float | None = None
+    host: str | None = None
+    error: str | None = None
+    children: list["Span"] = field(default_factory=list)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "host": self.host,
+            "error": self.error,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+@dataclass()
+class Trace:
+    name: str
+    channel: str
+    started_at: float
+    started: float
+    duration: float | None = None
+    spans: list[Span] = field(default_factory=list)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "channel": self.channel,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+class Tracer:
+    """Times the phases of a sample of upstream operations (tuning a channel, fetching a key or segment).
+
+    A sampled operation gets a `Trace`, and every upstream request made for it
+    a `Span`, with the connect/TLS/time to first byte/body timings of the
+    request from httpcore as its children. Every span's duration is added to a
+    histogram for its phase, and the slowest traces are kept to be looked at.
+
+    Traces started with `trace` are found by the requests made inside of them
+    through a context variable, ones which span async generators are passed
+    along explicitly instead. Background tasks copy the context variable when
+    they are created, so they have to be started inside `detach` to keep them
+    out of a trace which will usually have finished before they do.
+    """
+
+    _sample_rate: float
+    _slow: float
+    _slow_traces: collections.deque[Trace]
+    _phases: dict[str, Histogram]
+
+    def __init__(self, sample_rate: float, slow: float, keep: int):
+        self._sample_rate = sample_rate
+        self._slow = slow
+        self._slow_traces = collections.deque(maxlen=max(1, keep))
+        self._phases = {}
+
+    @property
+    def phases(self) -> dict[str, Histogram]:
+        return dict(self._phases)
+
+    @property
+    def slow_traces(self) -> list[Trace]:
+        # Newest first
+        return list(reversed(self._slow_traces))
+
+    def _observe(self, phase: str, duration: float) -> None:
+        histogram = self._phases.get(phase)
+        if histogram is None:
+            histogram = self._phases[phase] = Histogram()
+        histogram.observe(duration)
+
+    def current(self) -> Trace | None:
+        return _current.get()
+
+    def start(self, name: str, channel: str) -> Trace | None:
+        # Returns None unless this operation is sampled
+        if self._sample_rate <= 0 or random.random() >= self._sample_rate:
+            return None
+        return Trace(name=name, channel=channel, started_at=time.time(), started=time.monotonic())
+
+    def finish(self, trace: Trace | None) -> None:
+        if trace is None or trace.duration is not None:
+            return
+
+        trace.duration = trace.elapsed()
+        self._observe(trace.name, trace.duration)
+        if trace.duration >= self._slow:
+            self._slow_traces.append(trace)
+
+    @contextlib.contextmanager
+    def trace(self, name: str, channel: str) -> Iterator[Trace | None]:
+        # Trace everything done inside the block, unless we are already part of a trace
+        if _current.get() is not None:
+            yield _current.get()
+            return
+
+        trace = self.start(name, channel)
+        if trace is None:
+            yield None
+            return
+
+        token = _current.set(trace)
+        try:
+            yield trace
+        finally:
+            _current.reset(token)
+            self.finish(trace)
+
+    @contextlib.contextmanager
+    def detach(self) -> Iterator[None]:
+        # Nothing done (or started) inside the block is part of the current trace
+        token = _current.set(None)
+        try:
+            yield
+        finally:
+            _current.reset(token)
+
+    @contextlib.contextmanager
+    def span(self, trace: Trace | None, name: str, host: str | None = None) -> Iterator[Span | None]:
+        if trace is None:
+            yield None
+            return
+
+        span = Span(name=name, start=trace.elapsed(), host=host)
+        trace.spans.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.duration = trace.elapsed() - span.start
+            self._observe(name, span.duration)
+
+    def http_trace(self, span: Span | None, trace: Trace | None, wrapped: HTTPTrace) -> HTTPTrace:
+        # The httpcore trace extension for a request, which records its phases under `span` as well as calling `wrapped`
+        if span is None or trace is None:
+            return wrapped
+
+        children: dict[str, Span] = {}
+
+        async def on_event(event_name: str, info: dict) -> None:
+            await wrapped(event_name, info)
+
+            name, _, state = event_name.rpartition(".")
+            phase = _HTTP_PHASES.get(name.rpartition(".")[2])
+            if phase is None:
+                return
+
+            if state == "started":
+                child = children[phase] = Span(name=phase, start=trace.elapsed())
+                span.children.append(child)
+            elif phase in children:
+                child = children.pop(phase)
+                child.duration = trace.elapsed() - child.start
+                if state == "failed":
+                    child.error = repr(info.get("exception"))
+                self._observe(phase, child.duration)
+
+        return on_event
@@ -1,13 +1,21 @@
+import asyncio
+import datetime
+import functools
 from dataclasses import dataclass, field
-from typing import Iterable
-from xml.etree.ElementTree import Element, tostring
+from typing import Any, AsyncIterator, Coroutine, Iterable, TypeVar
 
 
+from dlhdhr import config
 from dlhdhr.dlhd import DLHDChannel
+from dlhdhr.dlhd.channels import ChannelRegistry, get_registry
 from dlhdhr.epg.zap2it import Zap2it
 from dlhdhr.epg.program import Program
 from dlhdhr.epg.zaptv import ZapTV
 from dlhdhr.epg.epgsky import EPGSky
+from dlhdhr.epg.provider import EPGProvider
+from dlhdhr.epg.snapshot import EPGSnapshot
+
+T = TypeVar("T")
 
 
 @dataclass()
@@ -15,16 +23,82 @@ class EPG:
     epgsky: EPGSky = field(default_factory=EPGSky)
     zap2it: Zap2it = field(default_factory=Zap2it)
     zaptv: ZapTV = field(default_factory=ZapTV)
+    _tasks: set[asyncio.Task] = field(default_factory=set)
 
-    async def get_channel_programs(self, channel: DLHDChannel) -> list[Program]:
+    def _get_provider(self, channel: DLHDChannel) -> EPGProvider | None:
         if channel.country_code == "us":
-            return await self.zap2it.get_channel_programs(channel)
+            return self.zap2it
         elif channel.country_code == "uk":
             if channel.epgsky_id:
-                return await self.epgsky.get_channel_programs(channel)
-            return await self.zaptv.get_channel_programs(channel)
+                return self.epgsky
+            return self.zaptv
+        return None
+
+    async def get_channel_programs(
+        self, channel: DLHDChannel, start: datetime.datetime | None = None, end: datetime.datetime | None = None
+    ) -> list[Program]:
+        provider = self._get_provider(channel)
+        if provider is None:
+            return []
+        return await provider.get_channel_programs(channel, start=start, end=end)
+
+    def _create_task(self, coro: Coroutine[Any, Any, T]) -> asyncio.Task[T]:
+        # Tasks outlive the request which started them if it gives up waiting on them
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    @property
+    def providers(self) -> dict[str, EPGProvider]:
+        return {provider.NAME: provider for provider in (self.epgsky, self.zap2it, self.zaptv)}
+
+    def _get_providers(self, channels: ChannelRegistry) -> list[EPGProvider]:
+        providers = []
+        for channel in channels:
+            provider = self._get_provider(channel)
+            if channel.xmltv_id and provider is not None and provider not in providers:
+                providers.append(provider)
+        return providers
+
+    def start(self) -> None:
+        # Refresh every provider in the background, requests only ever read their latest listings
+        snapshot = EPGSnapshot(config.EPG_SNAPSHOT_PATH) if config.EPG_SNAPSHOT_PATH else None
+        for provider in self.providers.values():
+            provider.snapshot = snapshot
+            self._create_task(provider.run(functools.partial(self._is_needed, provider)))
+
+    def stop(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
 
-        return []
+    def _is_needed(self, provider: EPGProvider) -> bool:
+        return provider in self._get_providers(get_registry())
+
+    def status(self) -> dict[str, dict[str, Any]]:
+        return {name: provider.status() for name, provider in self.providers.items()}
+
+    async def get_version(self, channels: ChannelRegistry, deadline: float | None = None) -> tuple[int, ...]:
+        # Return a version for the guide of `channels`, which changes whenever the channels or any
+        # of their listings change. Right after startup, this waits (until `deadline` at most) for
+        # the providers' first listings to come in
+        providers = self._get_providers(channels)
+        for provider in providers:
+            provider._cleanup_listings()
+
+        loading = [self._create_task(p.wait_loaded()) for p in providers if not p.loaded]
+        if loading:
+            loop = asyncio.get_running_loop()
+            if deadline is None:
+                deadline = loop.time() + config.EPG_DEADLINE
+            await asyncio.wait(loading, timeout=max(0, deadline - loop.time()))
+
+        return (channels.version, self.epgsky.version, self.zap2it.version, self.zaptv.version)
 
     async def get_channel_icon_from_epg(self, channel: DLHDChannel) -> str | None:
         if channel.country_code == "us":
@@ -34,18 +108,43 @@ class EPG:
                 return self.epgsky.get_channel_icon(channel)
         return None
 
-    async def generate_xmltv(self, channels: Iterable[DLHDChannel]) -> bytes:
-        tv = Element("tv", attrib={"generator-info-name": "dlhdhr"})
-
-        channels = [c for c in channels if c.xmltv_id]
+    async def stream_xmltv(
+        self,
+        channels: Iterable[DLHDChannel],
+        missing: list[DLHDChannel] | None = None,
+        start: datetime.datetime | None = None,
+        end: datetime.datetime | None = None,
+    ) -> AsyncIterator[bytes]:
+        # Render the document one channel at a time, rather than building the whole tree up front.
+        # Only programmes airing between `start` and `end` are included, if given.
+        #
+        # Channels whose provider hasn't managed to fetch any listings yet are left without
+        # programmes, marked with a comment and appended to `missing`
+        yield b'<tv generator-info-name="dlhdhr">'
 
         for channel in channels:
-            tv.append(channel.to_xmltv(thumbnail=await self.get_channel_icon_from_epg(channel)))
+            if not channel.xmltv_id:
+                continue
+
+            provider = self._get_provider(channel)
+            if provider is not None and provider.age is None:
+                if missing is not None:
+                    missing.append(channel)
+                reason = "are still loading" if not provider.loaded else "failed to load"
+                yield channel.xmltv_fragment()
+                yield f"<!-- dlhdhr: listings for channel {channel.number} {reason} -->".encode()
+                continue
+
+            # Both the channel and its programmes are only serialized the first time they are rendered
+            chunks = [channel.xmltv_fragment(thumbnail=await self.get_channel_icon_from_epg(channel))]
+            for program in await self.get_channel_programs(channel, start=start, end=end):
+                chunks.append(program.xmltv_fragment(channel))
+            yield b"".join(chunks)
 
-            programs = await self.get_channel_programs(channel)
+            # Rendering a whole guide takes seconds, let everything else (like the tuners) run between channels
+            await asyncio.sleep(0)
 
-            for program in programs:
-                node = program.to_xmltv(channel)
-                if node:
-                    tv.append(node)
-        return tostring(tv)
+        yield b"</tv>"
+
+    async def generate_xmltv(self, channels: Iterable[DLHDChannel]) -> bytes:
+        return b"".join([chunk async for chunk in self.stream_xmltv(channels)])
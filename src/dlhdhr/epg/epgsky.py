@@ -1,19 +1,20 @@
+import asyncio
 import datetime
-from dataclasses import dataclass, field
-import time
+from dataclasses import dataclass
+from typing import Any
 
 import httpx
 
 from dlhdhr import config
 from dlhdhr.dlhd.channels import DLHDChannel, get_channels
 from dlhdhr.epg.program import Program
+from dlhdhr.epg.provider import EPGProvider
 
 
 @dataclass()
-class EPGSky:
+class EPGSky(EPGProvider):
+    NAME = "epgsky"
     _BASE_URL = "https://awk.epgsky.com/hawk/linear"
-    _listings: dict[str, Program] = field(default_factory=dict)
-    _last_fetch: float = 0
 
     def _get_client(self) -> httpx.AsyncClient:
         return httpx.AsyncClient(
@@ -29,84 +30,70 @@ class EPGSky:
             },
         )
 
-    def _cleanup_listings(self) -> None:
-        now = datetime.datetime.now(datetime.UTC)
-        cutoff = now - datetime.timedelta(hours=3)
+    @property
+    def refresh_delay(self) -> float:
+        return config.EPGSKY_REFRESH_DELAY
 
-        updated: dict[str, list[Program]] = {}
-        for epgsky_id, programs in self._listings.items():
-            updated_programs = [p for p in programs if p.end_time > cutoff]
-            if updated_programs:
-                updated[epgsky_id] = updated_programs
-        self._listings = updated
+    async def _fetch_schedule(
+        self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, date: str, services: list[str]
+    ) -> dict[str, Any]:
+        async with semaphore:
+            res = await client.get(f"/schedule/{date}/{','.join(services)}")
+            res.raise_for_status()
+            return res.json()
 
     async def _fetch_listings(self) -> dict[str, list[Program]]:
+        # Fetch the schedules 20 channels at a time, up to `concurrency` requests at once
         listings: dict[str, list[Program]] = {}
         now = datetime.datetime.now(datetime.UTC)
         cutoff = now - datetime.timedelta(hours=3)
+        channels: list[str] = [c.epgsky_id for c in get_channels() if c.epgsky_id]
+        date = now.strftime("%Y%m%d")
+        semaphore = asyncio.Semaphore(self.concurrency)
         async with self._get_client() as client:
-            channels: list[str] = [c.epgsky_id for c in get_channels() if c.epgsky_id]
-            date = now.strftime("%Y%m%d")
-            for i in range(0, len(channels), 20):
-                services = channels[i : i + 20]
-
-                res = await client.get(f"/schedule/{date}/{','.join(services)}")
-                res.raise_for_status()
-
-                data = res.json()
-                for channel in data["schedule"]:
-                    programs = []
-                    for event in channel["events"]:
-                        start_time = datetime.datetime.fromtimestamp(event["st"], datetime.UTC)
-                        end_time = start_time + datetime.timedelta(seconds=event["d"])
-                        if end_time < cutoff:
-                            continue
-
-                        programs.append(
-                            Program(
-                                start_time=start_time,
-                                end_time=end_time,
-                                title=event["t"],
-                                subtitle=None,
-                                description=event.get("sy") or "",
-                                season=event.get("seasonnumber") or None,
-                                episode=event.get("episodenumber") or None,
-                                tags=[],
-                                release_year=None,
-                                thumbnail=None,
-                                rating=None,
-                            )
+            schedules = await self._gather(
+                [
+                    self._fetch_schedule(client, semaphore, date, channels[i : i + 20])
+                    for i in range(0, len(channels), 20)
+                ]
+            )
+
+        for data in schedules:
+            for channel in data["schedule"]:
+                programs = []
+                for event in channel["events"]:
+                    start_time = datetime.datetime.fromtimestamp(event["st"], datetime.UTC)
+                    end_time = start_time + datetime.timedelta(seconds=event["d"])
+                    if end_time < cutoff:
+                        continue
+
+                    programs.append(
+                        Program.create(
+                            start_time=start_time,
+                            end_time=end_time,
+                            title=event["t"],
+                            subtitle=None,
+                            description=event.get("sy") or "",
+                            season=event.get("seasonnumber") or None,
+                            episode=event.get("episodenumber") or None,
+                            tags=[],
+                            release_year=None,
+                            thumbnail=None,
+                            rating=None,
                         )
+                    )
 
-                    listings[channel["sid"]] = sorted(programs, key=lambda p: p.start_time)
+                listings[channel["sid"]] = sorted(programs, key=lambda p: p.start)
 
         return listings
 
-    async def _refresh_listings(self) -> dict[str, list[Program]]:
-        self._cleanup_listings()
-
-        now = time.time()
-        if self._listings and now - self._last_fetch > config.EPGSKY_REFRESH_DELAY:
-            return self._listings
-
-        programs = await self._fetch_listings()
-        for code, programs in programs.items():
-            if code in self._listings:
-                self._listings[code].extend(programs)
-            else:
-                self._listings[code] = programs
-        return self._listings
-
-    async def get_channel_programs(self, channel: DLHDChannel) -> list[Program]:
+    async def get_channel_programs(
+        self, channel: DLHDChannel, start: datetime.datetime | None = None, end: datetime.datetime | None = None
+    ) -> list[Program]:
         if not channel.epgsky_id:
             return []
 
-        await self._refresh_listings()
-
-        if channel.epgsky_id not in self._listings:
-            return []
-
-        return self._listings[channel.epgsky_id]
+        return self.get_listings(channel.epgsky_id, start=start, end=end)
 
     def get_channel_icon(self, channel: DLHDChannel) -> str | None:
         if not channel.epgsky_id:
@@ -1,23 +1,54 @@
 import datetime
 from dataclasses import dataclass, field
-from xml.etree.ElementTree import Element, SubElement
+import sys
+import time
+from typing import Iterable
+from xml.etree.ElementTree import Element, SubElement, tostring
 
 from dlhdhr.dlhd import DLHDChannel
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Rating:
     system: str
     value: str
 
 
-@dataclass(frozen=True)
+# A guide holds thousands of programmes, which share a handful of distinct tag lists, ratings and time zones
+_tags: dict[tuple[str, ...], tuple[str, ...]] = {}
+_ratings: dict[tuple[str, str], Rating] = {}
+_timezones: dict[int, datetime.timezone] = {}
+
+
+def _intern(value: str | None) -> str | None:
+    return sys.intern(value) if value else value
+
+
+def _format_time(timestamp: int, utc_offset: int) -> str:
+    # The same as `strftime("%Y%m%d%H%M%S %z")` on an aware datetime, without creating one
+    sign = "-" if utc_offset < 0 else "+"
+    hours, minutes = divmod(abs(utc_offset) // 60, 60)
+    return f"{time.strftime('%Y%m%d%H%M%S', time.gmtime(timestamp + utc_offset))} {sign}{hours:02}{minutes:02}"
+
+
+@dataclass(frozen=True, slots=True)
 class Program:
-    start_time: datetime.datetime
-    end_time: datetime.datetime
+    """A single airing of a programme.
+
+    Times are kept as epoch seconds (plus the UTC offset they were given in)
+    rather than datetimes, and repeated strings, tag lists and ratings are
+    shared between programmes, so a multi-day guide stays small. Use `create`
+    to build one from datetimes.
+
+    A programme never changes once fetched, so its serialized `<programme>`
+    node is only rendered once per channel, by `xmltv_fragment`.
+    """
+
+    start: int
+    end: int
     title: str
     description: str
-    tags: list[str] = field(default_factory=list)
+    tags: tuple[str, ...] = ()
     subtitle: str | None = None
     thumbnail: str | None = None
     season: int | None = None
@@ -25,14 +56,84 @@ class Program:
     rating: Rating | None = None
     release_year: str | None = None
     dd_progid: str | None = None
+    utc_offset: int = 0
+    # Serialized `<programme>` nodes, by channel number
+    _xmltv: dict[str, bytes] | None = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def create(
+        cls,
+        start_time: datetime.datetime,
+        end_time: datetime.datetime,
+        title: str,
+        description: str,
+        tags: Iterable[str] = (),
+        subtitle: str | None = None,
+        thumbnail: str | None = None,
+        season: int | None = None,
+        episode: int | None = None,
+        rating: Rating | None = None,
+        release_year: str | None = None,
+        dd_progid: str | None = None,
+    ) -> "Program":
+        tags = tuple(sys.intern(tag) for tag in tags)
+        tags = _tags.setdefault(tags, tags)
+        if rating is not None:
+            rating = _ratings.setdefault((rating.system, rating.value), rating)
+
+        offset = start_time.utcoffset()
+        return cls(
+            start=int(start_time.timestamp()),
+            end=int(end_time.timestamp()),
+            title=_intern(title) or "",
+            # Descriptions are mostly unique, so aren't worth interning
+            description=description,
+            tags=tags,
+            subtitle=_intern(subtitle),
+            thumbnail=_intern(thumbnail),
+            season=season,
+            episode=episode,
+            rating=rating,
+            release_year=_intern(release_year),
+            dd_progid=dd_progid,
+            utc_offset=int(offset.total_seconds()) if offset else 0,
+        )
+
+    @property
+    def timezone(self) -> datetime.timezone:
+        tz = _timezones.get(self.utc_offset)
+        if tz is None:
+            tz = _timezones[self.utc_offset] = datetime.timezone(datetime.timedelta(seconds=self.utc_offset))
+        return tz
+
+    @property
+    def start_time(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.start, self.timezone)
+
+    @property
+    def end_time(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.end, self.timezone)
 
     @property
     def duration_minutes(self) -> int:
-        return int((self.end_time - self.start_time).total_seconds() / 60)
+        return (self.end - self.start) // 60
+
+    def xmltv_fragment(self, channel: DLHDChannel) -> bytes:
+        fragments = self._xmltv
+        if fragments is None:
+            # Most programmes are only ever rendered for one channel, so the dict is only created when needed
+            fragments = {}
+            object.__setattr__(self, "_xmltv", fragments)
+
+        fragment = fragments.get(channel.number)
+        if fragment is None:
+            node = self.to_xmltv(channel)
+            fragment = fragments[channel.number] = tostring(node) if node is not None else b""
+        return fragment
 
     def to_xmltv(self, channel: DLHDChannel) -> Element | None:
-        start_time = self.start_time.strftime("%Y%m%d%H%M%S %z")
-        end_time = self.end_time.strftime("%Y%m%d%H%M%S %z")
+        start_time = _format_time(self.start, self.utc_offset)
+        end_time = _format_time(self.end, self.utc_offset)
 
         programme = Element("programme", attrib={"start": start_time, "stop": end_time, "channel": str(channel.number)})
         if self.title:
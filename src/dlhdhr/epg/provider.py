@@ -0,0 +1,220 @@
+import asyncio
+import datetime
+from dataclasses import dataclass, field
+import random
+import time
+from typing import Any, Callable, Coroutine, TypeVar
+
+from dlhdhr import config
+from dlhdhr.dlhd.channels import DLHDChannel
+from dlhdhr.epg.program import Program
+from dlhdhr.epg.snapshot import EPGSnapshot
+from dlhdhr.epg.store import ProgramStore
+
+T = TypeVar("T")
+
+
+@dataclass()
+class EPGProvider:
+    """Base class for the EPG listings providers.
+
+    Listings are fetched in the background by `run`, every `refresh_delay`
+    seconds, and readers only ever see the last snapshot which was fetched
+    successfully. Failed fetches are retried with an exponential backoff.
+    """
+
+    _listings: dict[str, ProgramStore] = field(default_factory=dict)
+    _last_fetch: float = 0
+    _last_duration: float = 0
+    _last_error: Exception | None = None
+    _failures: int = 0
+    # Bumped every time the listings change
+    version: int = 0
+    _refresh_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    _loaded: asyncio.Event = field(default_factory=asyncio.Event)
+    # Where to save the listings after every refresh, and load them from at startup
+    snapshot: EPGSnapshot | None = None
+
+    # Identifies the provider's listings in the snapshot
+    NAME = ""
+
+    @property
+    def refresh_delay(self) -> float:
+        raise NotImplementedError()
+
+    @property
+    def concurrency(self) -> int:
+        # How many upstream requests a refresh may have in flight at once
+        return config.EPG_PROVIDER_CONCURRENCY
+
+    async def _gather(self, coros: list[Coroutine[Any, Any, T]]) -> list[T]:
+        # Run all of `coros` at once. If any of them fails the rest are cancelled, rather than
+        # left running against a client which is being closed, and its exception is raised
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tasks: list[asyncio.Task[T]] = [tg.create_task(coro) for coro in coros]
+        except ExceptionGroup as e:
+            raise e.exceptions[0] from None
+        return [task.result() for task in tasks]
+
+    async def _fetch_listings(self) -> dict[str, list[Program]]:
+        raise NotImplementedError()
+
+    async def get_channel_programs(
+        self, channel: DLHDChannel, start: datetime.datetime | None = None, end: datetime.datetime | None = None
+    ) -> list[Program]:
+        raise NotImplementedError()
+
+    def _get_state(self) -> dict[str, Any]:
+        # Anything besides the listings which should be saved in the snapshot
+        return {}
+
+    def _set_state(self, state: dict[str, Any]) -> None:
+        pass
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded.is_set()
+
+    @property
+    def age(self) -> float | None:
+        # Seconds since the listings were last fetched successfully
+        if not self._last_fetch:
+            return None
+        return time.time() - self._last_fetch
+
+    @property
+    def is_stale(self) -> bool:
+        # Stale once we have missed a whole refresh
+        age = self.age
+        return age is None or age > self.refresh_delay * 2
+
+    @property
+    def last_duration(self) -> float:
+        return self._last_duration
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "last_refresh": self._last_fetch or None,
+            "age": self.age,
+            "stale": self.is_stale,
+            "last_duration": self._last_duration,
+            "failures": self._failures,
+            "last_error": repr(self._last_error) if self._last_error else None,
+            "version": self.version,
+            "channels": len(self._listings),
+        }
+
+    def _cleanup_listings(self) -> None:
+        now = datetime.datetime.now(datetime.UTC)
+        cutoff = now - datetime.timedelta(hours=3)
+
+        removed = 0
+        for store in self._listings.values():
+            removed += store.prune(cutoff)
+        if removed:
+            self._listings = {key: store for key, store in self._listings.items() if store}
+            self.version += 1
+
+    async def wait_loaded(self) -> None:
+        # Wait for the first refresh to finish (successfully or not)
+        await self._loaded.wait()
+
+    async def refresh(self) -> None:
+        async with self._refresh_lock:
+            started = time.monotonic()
+            try:
+                fetched = await self._fetch_listings()
+            except Exception as e:
+                self._failures += 1
+                self._last_error = e
+                raise
+            finally:
+                self._last_duration = time.monotonic() - started
+                self._loaded.set()
+
+            # Stores replace their lists rather than changing them, so readers only ever see complete snapshots
+            listings = dict(self._listings)
+            for key, programs in fetched.items():
+                store = listings.get(key)
+                if store is None:
+                    listings[key] = ProgramStore(programs)
+                else:
+                    store.merge(programs)
+            self._listings = listings
+            self._cleanup_listings()
+            self._last_fetch = time.time()
+            self._failures = 0
+            self._last_error = None
+            self.version += 1
+
+            await self._save_snapshot()
+
+    async def _save_snapshot(self) -> None:
+        if self.snapshot is None:
+            return
+
+        listings = [(key, store.programs) for key, store in self._listings.items()]
+        try:
+            await asyncio.to_thread(self.snapshot.save, self.NAME, self._last_fetch, listings, self._get_state())
+        except Exception as e:
+            if config.DEBUG:
+                print(f"{type(self).__name__}: failed to save listings snapshot: {e!r}")
+
+    async def load_snapshot(self) -> None:
+        # Start out with the listings saved by the last run (if any), until we have fetched our own
+        if self.snapshot is None:
+            return
+
+        try:
+            saved = await asyncio.to_thread(self.snapshot.load, self.NAME)
+        except Exception as e:
+            if config.DEBUG:
+                print(f"{type(self).__name__}: failed to load listings snapshot: {e!r}")
+            return
+        if saved is None or self._last_fetch:
+            return
+
+        fetched_at, listings, state = saved
+        self._listings = {key: ProgramStore(programs) for key, programs in listings.items()}
+        self._set_state(state)
+        self._last_fetch = fetched_at
+        self._cleanup_listings()
+        self.version += 1
+        self._loaded.set()
+
+    async def run(self, is_needed: Callable[[], bool]) -> None:
+        # Refresh the listings forever, while `is_needed()` says any of our channels are being served
+        await self.load_snapshot()
+
+        # Listings loaded from the snapshot only need refreshing once they are due
+        age = self.age
+        if age is not None and age < self.refresh_delay:
+            await asyncio.sleep(self.refresh_delay - age)
+
+        while True:
+            if not is_needed():
+                await asyncio.sleep(config.EPG_RETRY_DELAY)
+                continue
+
+            try:
+                await self.refresh()
+                delay = self.refresh_delay
+            except Exception as e:
+                if config.DEBUG:
+                    print(f"{type(self).__name__}: failed to refresh listings ({self._failures}): {e!r}")
+                delay = min(self.refresh_delay, config.EPG_RETRY_DELAY * 2 ** (self._failures - 1))
+
+            # Spread the refreshes out a little, rather than always hitting upstream on the same schedule
+            await asyncio.sleep(delay * random.uniform(1 - config.EPG_REFRESH_JITTER, 1 + config.EPG_REFRESH_JITTER))
+
+    def get_listings(
+        self, key: str, start: datetime.datetime | None = None, end: datetime.datetime | None = None
+    ) -> list[Program]:
+        store = self._listings.get(key)
+        if store is None:
+            return []
+        if start is None and end is None:
+            return store.programs
+        return store.between(start, end)
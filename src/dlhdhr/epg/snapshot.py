@@ -0,0 +1,151 @@
+import contextlib
+import datetime
+import json
+import sqlite3
+from typing import Any, Iterable, Iterator
+
+from dlhdhr.epg.program import Program, Rating
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS providers (
+    name TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS programs (
+    provider TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    utc_offset INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    subtitle TEXT,
+    thumbnail TEXT,
+    season,
+    episode,
+    rating_system TEXT,
+    rating_value TEXT,
+    release_year TEXT,
+    dd_progid TEXT
+);
+CREATE INDEX IF NOT EXISTS programs_provider ON programs (provider);
+"""
+
+_COLUMNS = (
+    "provider, channel, start, end, utc_offset, title, description, tags, subtitle, thumbnail, season, episode, "
+    "rating_system, rating_value, release_year, dd_progid"
+)
+
+
+def _to_row(provider: str, channel: str, program: Program) -> tuple:
+    return (
+        provider,
+        channel,
+        program.start,
+        program.end,
+        program.utc_offset,
+        program.title,
+        program.description,
+        json.dumps(program.tags),
+        program.subtitle,
+        program.thumbnail,
+        program.season,
+        program.episode,
+        program.rating.system if program.rating else None,
+        program.rating.value if program.rating else None,
+        program.release_year,
+        program.dd_progid,
+    )
+
+
+def _from_row(row: tuple) -> tuple[str, Program]:
+    (
+        _provider,
+        channel,
+        start,
+        end,
+        utc_offset,
+        title,
+        description,
+        tags,
+        subtitle,
+        thumbnail,
+        season,
+        episode,
+        rating_system,
+        rating_value,
+        release_year,
+        dd_progid,
+    ) = row
+
+    # Go through `create` so strings, tags and ratings are shared just like freshly fetched programmes
+    tz = datetime.timezone(datetime.timedelta(seconds=utc_offset))
+    return channel, Program.create(
+        start_time=datetime.datetime.fromtimestamp(start, tz),
+        end_time=datetime.datetime.fromtimestamp(end, tz),
+        title=title,
+        description=description,
+        tags=json.loads(tags),
+        subtitle=subtitle,
+        thumbnail=thumbnail,
+        season=season,
+        episode=episode,
+        rating=Rating(system=rating_system, value=rating_value) if rating_system is not None else None,
+        release_year=release_year,
+        dd_progid=dd_progid,
+    )
+
+
+class EPGSnapshot:
+    """SQLite file holding the last listings fetched by each provider, so a restart doesn't need to refetch them.
+
+    The methods block, and are meant to be called with `asyncio.to_thread`.
+    Every call uses its own connection, so they can run from any thread.
+    """
+
+    _path: str
+
+    def __init__(self, path: str):
+        self._path = path
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self._path)
+        try:
+            conn.executescript(_SCHEMA)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def save(
+        self, provider: str, fetched_at: float, listings: Iterable[tuple[str, Iterable[Program]]], state: dict[str, Any]
+    ) -> None:
+        # Replace everything saved for `provider` in a single transaction
+        with self._connect() as conn:
+            conn.execute("DELETE FROM programs WHERE provider = ?", (provider,))
+            conn.executemany(
+                f"INSERT INTO programs ({_COLUMNS}) VALUES ({', '.join('?' * 16)})",
+                (_to_row(provider, channel, program) for channel, programs in listings for program in programs),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO providers (name, fetched_at, state) VALUES (?, ?, ?)",
+                (provider, fetched_at, json.dumps(state)),
+            )
+
+    def load(self, provider: str) -> tuple[float, dict[str, list[Program]], dict[str, Any]] | None:
+        # Returns when the listings were fetched, the listings, and the provider's extra state
+        with self._connect() as conn:
+            row = conn.execute("SELECT fetched_at, state FROM providers WHERE name = ?", (provider,)).fetchone()
+            if row is None:
+                return None
+            fetched_at, state = row
+
+            listings: dict[str, list[Program]] = {}
+            for program_row in conn.execute(f"SELECT {_COLUMNS} FROM programs WHERE provider = ?", (provider,)):
+                channel, program = _from_row(program_row)
+                listings.setdefault(channel, []).append(program)
+
+        return fetched_at, listings, json.loads(state)
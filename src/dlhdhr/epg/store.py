@@ -0,0 +1,83 @@
+import bisect
+import datetime
+from typing import Iterable, Iterator
+
+from dlhdhr.epg.program import Program
+
+
+class ProgramStore:
+    """A channel's programmes, kept sorted by start time and unique by (start, end) time.
+
+    Finding the programmes airing in a time window, and dropping the ones which
+    have ended, are both a bisect over the start times. Updates replace the
+    lists rather than changing them in place, so anyone holding on to the
+    result of an earlier query isn't affected.
+    """
+
+    _programs: list[Program]
+    _starts: list[int]
+    # The longest programme we have (in seconds), so we know how far back from a time
+    # to look for programmes still airing
+    _max_duration: int
+
+    def __init__(self, programs: Iterable[Program] = ()):
+        self._programs = []
+        self._starts = []
+        self._max_duration = 0
+        self.merge(programs)
+
+    def __len__(self) -> int:
+        return len(self._programs)
+
+    def __iter__(self) -> Iterator[Program]:
+        return iter(self._programs)
+
+    @property
+    def programs(self) -> list[Program]:
+        return self._programs
+
+    def merge(self, programs: Iterable[Program]) -> None:
+        # Programmes with the same start and end time as an existing one replace it. Unless nothing
+        # about it changed, then we keep the one we have, along with its serialized XMLTV fragments
+        merged = {(p.start, p.end): p for p in self._programs}
+        for program in programs:
+            key = (program.start, program.end)
+            if merged.get(key) != program:
+                merged[key] = program
+
+        self._programs = sorted(merged.values(), key=lambda p: p.start)
+        self._starts = [p.start for p in self._programs]
+        self._max_duration = max((p.end - p.start for p in self._programs), default=0)
+
+    def prune(self, cutoff: datetime.datetime) -> int:
+        # Drop every programme which ended at or before `cutoff`, returns how many were dropped
+        if not self._programs:
+            return 0
+        timestamp = int(cutoff.timestamp())
+
+        # Everything starting before this has certainly ended, everything after it until the cutoff might have
+        ended = bisect.bisect_left(self._starts, timestamp - self._max_duration)
+        maybe_ended = bisect.bisect_left(self._starts, timestamp)
+        if ended == maybe_ended == 0:
+            return 0
+
+        kept = [p for p in self._programs[ended:maybe_ended] if p.end > timestamp]
+        removed = maybe_ended - len(kept)
+        if removed:
+            self._programs = kept + self._programs[maybe_ended:]
+            self._starts = [p.start for p in kept] + self._starts[maybe_ended:]
+        return removed
+
+    def between(self, start: datetime.datetime | None, end: datetime.datetime | None) -> list[Program]:
+        # Every programme airing at any point from `start` until `end` (either can be left open)
+        lo = 0
+        if start is not None:
+            lo = bisect.bisect_right(self._starts, int(start.timestamp()) - self._max_duration)
+        hi = len(self._programs)
+        if end is not None:
+            hi = bisect.bisect_left(self._starts, int(end.timestamp()), lo=lo)
+
+        programs = self._programs[lo:hi]
+        if start is not None:
+            programs = [p for p in programs if p.end > start.timestamp()]
+        return programs
@@ -1,20 +1,27 @@
+import asyncio
 import datetime
 from dataclasses import dataclass, field
 import time
+from typing import Any
 
 import httpx
 
 from dlhdhr import config
+from dlhdhr.config import Zap2itLineup
 from dlhdhr.dlhd.channels import DLHDChannel
 from dlhdhr.epg.program import Program
+from dlhdhr.epg.provider import EPGProvider
 from dlhdhr.epg.program import Rating
 
 
 @dataclass()
-class Zap2it:
+class Zap2it(EPGProvider):
+    NAME = "zap2it"
     _BASE_URL = "https://tvlistings.zap2it.com/api/"
-    _listings: dict[str, Program] = field(default_factory=dict)
-    _last_fetch: float = 0
+    # How many hours each grid request covers
+    GRID_HOURS = 6
+    # Seconds to wait before retrying a failed grid request, doubling after every attempt
+    RETRY_DELAY = 0.5
     _channel_icons: dict[str, str] = field(default_factory=dict)
 
     def _get_client(self) -> httpx.AsyncClient:
@@ -30,137 +37,123 @@ class Zap2it:
             },
         )
 
-    def _cleanup_listings(self) -> None:
-        now = datetime.datetime.now(datetime.UTC)
-        cutoff = now - datetime.timedelta(hours=3)
+    def _get_state(self) -> dict[str, Any]:
+        return {"channel_icons": self._channel_icons}
 
-        updated: dict[str, list[Program]] = {}
-        for call_sign, programs in self._listings.items():
-            updated_programs = [p for p in programs if p.end_time > cutoff]
-            if updated_programs:
-                updated[call_sign] = updated_programs
-        self._listings = updated
+    def _set_state(self, state: dict[str, Any]) -> None:
+        self._channel_icons.update(state.get("channel_icons") or {})
 
-    async def _fetch_listings(self, lineup_id: str, headend_id: str, postal_code: str) -> dict[str, list[Program]]:
+    @property
+    def refresh_delay(self) -> float:
+        return config.ZAP2IT_REFRESH_DELAY
+
+    @property
+    def concurrency(self) -> int:
+        return config.ZAP2IT_CONCURRENCY
+
+    async def _fetch_grid(
+        self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, lineup: Zap2itLineup, start: int
+    ) -> dict[str, Any]:
         params = {
-            "lineupId": lineup_id,
-            "timespan": "6",
-            "headendId": headend_id,
+            "lineupId": lineup.lineup_id,
+            "timespan": str(self.GRID_HOURS),
+            "headendId": lineup.headend_id,
             "country": "USA",
             "timezone": "",
             "device": "X",
-            "postalCode": postal_code,
+            "postalCode": lineup.postal_code,
             "isOverride": "true",
-            "time": str(int(time.time())),
+            "time": str(start),
             "pref": "16,256",
             "userId": "-",
             "aid": "gapzap",
             "languagecode": "en-us",
         }
 
-        listings: dict[str, list[Program]] = {}
-        now = datetime.datetime.now(datetime.UTC)
-        cutoff = now - datetime.timedelta(hours=3)
-        async with self._get_client() as client:
-            channels = set()
-            events = {}
-
-            # Fetch up to 18 hours into the future
-            for i in range(3):
-                params["time"] = str(int(time.time()) + (21600 * i))
-                res = await client.get("/grid", params=params)
-                res.raise_for_status()
-
-                data = res.json()
-                for ch_data in data["channels"]:
-                    call_sign = ch_data["callSign"]
-                    channels.add(call_sign)
-                    if call_sign not in events:
-                        events[call_sign] = {}
-
-                    if ch_data.get("thumbnail"):
-                        thumbnail = ch_data["thumbnail"]
-                        if thumbnail.startswith("//"):
-                            thumbnail = f"https:{thumbnail}"
-                        self._channel_icons[call_sign] = thumbnail
-
-                    for evt in ch_data["events"]:
-                        key = (evt["startTime"], evt["endTime"])
-                        if key not in events[call_sign]:
-                            events[call_sign][key] = evt
-
-            for call_sign in channels:
-                programs = []
-                for evt_data in events[call_sign].values():
-                    end_time = datetime.datetime.fromisoformat(evt_data["endTime"])
-                    if end_time < cutoff:
-                        continue
-
-                    rating = None
-                    if evt_data["rating"]:
-                        rating = Rating(system="MPAA", value=evt_data["rating"])
-
-                    programs.append(
-                        Program(
-                            start_time=datetime.datetime.fromisoformat(evt_data["startTime"]),
-                            end_time=end_time,
-                            title=evt_data["program"]["title"],
-                            subtitle=evt_data["program"].get("episodeTitle") or None,
-                            description=evt_data["program"]["shortDesc"],
-                            season=evt_data["program"]["season"] or None,
-                            episode=evt_data["program"]["episode"] or None,
-                            dd_progid=evt_data["program"].get("tmsId"),
-                            tags=evt_data["tags"],
-                            release_year=evt_data["program"]["releaseYear"],
-                            thumbnail=f"https://zap2it.tmsimg.com/assets/{evt_data['thumbnail']}.jpg?w=165",
-                            rating=rating,
-                        )
-                    )
-
-                listings[call_sign] = sorted(programs, key=lambda p: p.start_time)
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    res = await client.get("/grid", params=params)
+                    res.raise_for_status()
+                    return res.json()
+            except httpx.HTTPError as e:
+                # Retry timeouts, connection errors and server errors, but not bad requests
+                retryable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500
+                if not retryable or attempt >= config.ZAP2IT_RETRIES:
+                    raise
+                attempt += 1
+                await asyncio.sleep(self.RETRY_DELAY * 2 ** (attempt - 1))
+
+    def _parse_program(self, evt_data: dict[str, Any]) -> Program:
+        rating = None
+        if evt_data["rating"]:
+            rating = Rating(system="MPAA", value=evt_data["rating"])
+
+        return Program.create(
+            start_time=datetime.datetime.fromisoformat(evt_data["startTime"]),
+            end_time=datetime.datetime.fromisoformat(evt_data["endTime"]),
+            title=evt_data["program"]["title"],
+            subtitle=evt_data["program"].get("episodeTitle") or None,
+            description=evt_data["program"]["shortDesc"],
+            season=evt_data["program"]["season"] or None,
+            episode=evt_data["program"]["episode"] or None,
+            dd_progid=evt_data["program"].get("tmsId"),
+            tags=evt_data["tags"],
+            release_year=evt_data["program"]["releaseYear"],
+            thumbnail=f"https://zap2it.tmsimg.com/assets/{evt_data['thumbnail']}.jpg?w=165",
+            rating=rating,
+        )
 
+    async def _fetch_listings(self) -> dict[str, list[Program]]:
+        # Fetch every grid page of every lineup at once (up to `concurrency` requests at a time),
+        # so adding lineups doesn't make refreshing proportionally slower
+        now = int(time.time())
+        pages = -(-config.ZAP2IT_GRID_HOURS // self.GRID_HOURS)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._get_client() as client:
+            # The first page to fail cancels the rest, before the client is closed
+            grids = await self._gather(
+                [
+                    self._fetch_grid(client, semaphore, lineup, now + self.GRID_HOURS * 3600 * i)
+                    for lineup in config.ZAP2IT_LINEUPS
+                    for i in range(pages)
+                ]
+            )
+
+        # National channels show up in every lineup, and programmes can span two grid pages
+        events: dict[str, dict[tuple[str, str], dict[str, Any]]] = {}
+        for data in grids:
+            for ch_data in data["channels"]:
+                call_sign = ch_data["callSign"]
+                channel_events = events.setdefault(call_sign, {})
+
+                if ch_data.get("thumbnail"):
+                    thumbnail = ch_data["thumbnail"]
+                    if thumbnail.startswith("//"):
+                        thumbnail = f"https:{thumbnail}"
+                    self._channel_icons[call_sign] = thumbnail
+
+                for evt in ch_data["events"]:
+                    channel_events.setdefault((evt["startTime"], evt["endTime"]), evt)
+
+        cutoff = int(time.time()) - 3 * 60 * 60
+        listings: dict[str, list[Program]] = {}
+        for call_sign, channel_events in events.items():
+            programs = [self._parse_program(evt_data) for evt_data in channel_events.values()]
+            listings[call_sign] = sorted((p for p in programs if p.end >= cutoff), key=lambda p: p.start)
         return listings
 
-    async def _refresh_listings(self) -> dict[str, list[Program]]:
-        self._cleanup_listings()
-
-        now = time.time()
-        if self._listings and now - self._last_fetch > config.ZAP2IT_REFRESH_DELAY:
-            return self._listings
-
-        east_coast_programs = await self._fetch_listings(
-            lineup_id="USA-NY31519-DEFAULT", headend_id="NY31519", postal_code="10001"
-        )
-        for call_sign, programs in east_coast_programs.items():
-            if call_sign in self._listings:
-                self._listings[call_sign].extend(programs)
-            else:
-                self._listings[call_sign] = programs
-
-        west_coast_programs = await self._fetch_listings(
-            lineup_id="USA-CA66511-DEFAULT", headend_id="CA66511", postal_code="90001"
-        )
-        for call_sign, programs in west_coast_programs.items():
-            if call_sign in self._listings:
-                self._listings[call_sign].extend(programs)
-            else:
-                self._listings[call_sign] = programs
-        return self._listings
-
-    async def get_channel_programs(self, channel: DLHDChannel) -> list[Program]:
+    async def get_channel_programs(
+        self, channel: DLHDChannel, start: datetime.datetime | None = None, end: datetime.datetime | None = None
+    ) -> list[Program]:
         if not channel.call_sign:
             return []
 
-        await self._refresh_listings()
-
-        if channel.call_sign not in self._listings:
-            return []
-
-        return self._listings[channel.call_sign]
+        return self.get_listings(channel.call_sign, start=start, end=end)
 
     async def get_channel_icon(self, channel: DLHDChannel) -> str | None:
         if not channel.call_sign:
             return None
 
-        await self._refresh_listings()
         return self._channel_icons.get(channel.call_sign)
@@ -1,19 +1,18 @@
 import datetime
-from dataclasses import dataclass, field
-import time
+from dataclasses import dataclass
 
 import httpx
 
 from dlhdhr import config
 from dlhdhr.dlhd.channels import DLHDChannel
 from dlhdhr.epg.program import Program
+from dlhdhr.epg.provider import EPGProvider
 
 
 @dataclass()
-class ZapTV:
+class ZapTV(EPGProvider):
+    NAME = "zaptv"
     _BASE_URL = "https://www.zaptv.co.uk/api/"
-    _listings: dict[str, Program] = field(default_factory=dict)
-    _last_fetch: float = 0
 
     def _get_client(self) -> httpx.AsyncClient:
         return httpx.AsyncClient(
@@ -28,16 +27,9 @@ class ZapTV:
             },
         )
 
-    def _cleanup_listings(self) -> None:
-        now = datetime.datetime.now(datetime.UTC)
-        cutoff = now - datetime.timedelta(hours=3)
-
-        updated: dict[str, list[Program]] = {}
-        for call_sign, programs in self._listings.items():
-            updated_programs = [p for p in programs if p.end_time > cutoff]
-            if updated_programs:
-                updated[call_sign] = updated_programs
-        self._listings = updated
+    @property
+    def refresh_delay(self) -> float:
+        return config.ZAPTV_REFRESH_DELAY
 
     async def _fetch_listings(self) -> dict[str, list[Program]]:
         listings: dict[str, list[Program]] = {}
@@ -91,7 +83,7 @@ class ZapTV:
                         thumbnail = f"https:{thumbnail}"
 
                     programs.append(
-                        Program(
+                        Program.create(
                             start_time=datetime.datetime.fromisoformat(evt_data["startsAt"]),
                             end_time=end_time,
                             title=evt_data["title"],
@@ -106,32 +98,14 @@ class ZapTV:
                         )
                     )
 
-                listings[code] = sorted(programs, key=lambda p: p.start_time)
+                listings[code] = sorted(programs, key=lambda p: p.start)
 
         return listings
 
-    async def _refresh_listings(self) -> dict[str, list[Program]]:
-        self._cleanup_listings()
-
-        now = time.time()
-        if self._listings and now - self._last_fetch > config.ZAPTV_REFRESH_DELAY:
-            return self._listings
-
-        programs = await self._fetch_listings()
-        for code, programs in programs.items():
-            if code in self._listings:
-                self._listings[code].extend(programs)
-            else:
-                self._listings[code] = programs
-        return self._listings
-
-    async def get_channel_programs(self, channel: DLHDChannel) -> list[Program]:
+    async def get_channel_programs(
+        self, channel: DLHDChannel, start: datetime.datetime | None = None, end: datetime.datetime | None = None
+    ) -> list[Program]:
         if not channel.call_sign:
             return []
 
-        await self._refresh_listings()
-
-        if channel.call_sign not in self._listings:
-            return []
-
-        return self._listings[channel.call_sign]
+        return self.get_listings(channel.call_sign, start=start, end=end)
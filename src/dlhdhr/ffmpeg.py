@@ -1,6 +1,7 @@
 import asyncio
 
 from dlhdhr import config
+from dlhdhr.mpegts import TS_PACKET_SIZE
 
 
 class FFMpegNotStartedError(Exception):
@@ -8,6 +9,9 @@ class FFMpegNotStartedError(Exception):
 
 
 class FFMpegProcess:
+    # Always read whole TS packets
+    READ_SIZE: int = max(1, config.FFMPEG_READ_SIZE // TS_PACKET_SIZE) * TS_PACKET_SIZE
+
     _ffmpeg_command: str
     _started: bool = False
     _process: asyncio.subprocess.Process | None = None
@@ -37,6 +41,8 @@ class FFMpegProcess:
                 "18",
                 "-preset",
                 "ultrafast",
+                "-flush_packets",
+                "0",
                 "-f",
                 "mpegts",
                 "-loglevel",
@@ -59,9 +65,17 @@ class FFMpegProcess:
         if not self._process.stdout:
             raise FFMpegNotStartedError()
 
-        b = await self._process.stdout.read(512)
+        b = await self._process.stdout.read(self.READ_SIZE)
         if not b:
             raise StopAsyncIteration
+
+        # Read the rest of any partial packet so we only ever return whole TS packets
+        partial = len(b) % TS_PACKET_SIZE
+        if partial:
+            try:
+                b += await self._process.stdout.readexactly(TS_PACKET_SIZE - partial)
+            except asyncio.IncompleteReadError as e:
+                b += e.partial
         return b
 
     async def _start(self) -> None:
@@ -0,0 +1,204 @@
+import asyncio
+
+import m3u8
+
+from dlhdhr import config
+from dlhdhr.dlhd import DLHDChannel, DLHDClient
+from dlhdhr.ffmpeg import FFMpegProcess
+from dlhdhr.mpegts import TS_PACKET_SIZE, ContinuityCounters, find_sync
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    HAS_CRYPTOGRAPHY = True
+except ImportError:
+    HAS_CRYPTOGRAPHY = False
+
+# AES-128 segments are encrypted in 16 byte blocks, which is also the size of their IV
+_AES_BLOCK_SIZE = 16
+
+
+class HLSStreamNotStartedError(Exception):
+    pass
+
+
+class HLSStreamError(Exception):
+    pass
+
+
+class HLSStream:
+    """Native replacement for `FFMpegProcess` which remuxes a channel's HLS playlist in-process.
+
+    A background task follows the channel's media playlist, downloading and
+    decrypting every new segment in order and fixing up the continuity counters
+    so the segments join into one continuous MPEG-TS stream. Iterating over the
+    stream returns `READ_SIZE` chunks, paced out over each segment's duration
+    (like `ffmpeg -re`) unless we have fallen behind.
+    """
+
+    READ_SIZE: int = FFMpegProcess.READ_SIZE
+    # How many segments back from the live edge to start streaming from
+    LIVE_EDGE_SEGMENTS: int = 3
+    # How many times in a row we can fail to fetch the playlist or a segment before giving up
+    MAX_FAILURES: int = 5
+
+    _dlhd: DLHDClient
+    _channel: DLHDChannel
+    _queue: asyncio.Queue[tuple[bytearray, float] | None]
+    _fetch_task: asyncio.Task | None = None
+    _counters: ContinuityCounters
+    _segment: memoryview
+    _offset: int = 0
+    _interval: float = 0
+    _next_chunk: float = 0
+
+    def __init__(self, dlhd: DLHDClient, channel: DLHDChannel):
+        self._dlhd = dlhd
+        self._channel = channel
+        self._queue = asyncio.Queue()
+        self._counters = ContinuityCounters()
+        self._segment = memoryview(b"")
+
+    @property
+    def started(self) -> bool:
+        return self._fetch_task is not None
+
+    def __aiter__(self) -> "HLSStream":
+        return self
+
+    async def __anext__(self) -> bytes:
+        if not self.started:
+            raise HLSStreamNotStartedError()
+
+        loop = asyncio.get_running_loop()
+        while self._offset >= len(self._segment):
+            item = await self._queue.get()
+            if item is None:
+                raise StopAsyncIteration
+
+            data, duration = item
+            self._segment = memoryview(data)
+            self._offset = 0
+            chunks = -(-len(data) // self.READ_SIZE)
+            self._interval = duration / chunks if chunks else 0
+            self._next_chunk = max(self._next_chunk, loop.time())
+
+        # Pace the chunks out over the segment duration, unless there are more segments
+        # already waiting, in which case we are behind and should catch up
+        if self._queue.empty():
+            delay = self._next_chunk - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_chunk += self._interval
+        else:
+            self._next_chunk = loop.time()
+
+        chunk = bytes(self._segment[self._offset : self._offset + self.READ_SIZE])
+        self._offset += len(chunk)
+        return chunk
+
+    async def _fetch(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_sequence: int | None = None
+        failures = 0
+        try:
+            while True:
+                started = loop.time()
+                try:
+                    playlist = await self._dlhd.get_channel_media_playlist(self._channel)
+                    first_sequence = playlist.media_sequence or 0
+                    if next_sequence is None:
+                        next_sequence = first_sequence + max(0, len(playlist.segments) - self.LIVE_EDGE_SEGMENTS)
+                    elif next_sequence < first_sequence:
+                        # We fell behind the playlist window, skip ahead to the oldest segment still available
+                        next_sequence = first_sequence
+
+                    new_segments = 0
+                    for sequence, segment in enumerate(playlist.segments, start=first_sequence):
+                        if sequence < next_sequence:
+                            continue
+
+                        data = await self._fetch_segment(sequence, segment)
+                        if data:
+                            self._queue.put_nowait((data, segment.duration or 0))
+                        next_sequence = sequence + 1
+                        new_segments += 1
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    if config.DEBUG:
+                        print(f"HLSStream: error fetching {self._channel} ({failures}/{self.MAX_FAILURES}): {e!r}")
+                    if failures >= self.MAX_FAILURES:
+                        return
+                    await asyncio.sleep(failures)
+                    continue
+
+                # Wait the target duration before reloading the playlist, or half of it
+                # if the playlist hasn't changed yet (RFC 8216 section 6.3.4)
+                target_duration = playlist.target_duration or 6
+                wait = target_duration if new_segments else target_duration / 2
+                await asyncio.sleep(max(0, started + wait - loop.time()))
+        finally:
+            self._queue.put_nowait(None)
+
+    async def _fetch_segment(self, sequence: int, segment: m3u8.Segment) -> bytearray:
+        data = await self._dlhd.get_segment(self._channel, segment.absolute_uri)
+
+        key = segment.key
+        if key and key.method == "AES-128":
+            data = await self._decrypt(data, key, sequence)
+        elif key and key.method and key.method != "NONE":
+            msg = f"Unsupported segment encryption method {key.method!r}"
+            raise HLSStreamError(msg)
+
+        # Only pass along whole, aligned TS packets
+        start = find_sync(data)
+        if start == -1:
+            return bytearray()
+        end = len(data) - ((len(data) - start) % TS_PACKET_SIZE)
+        packets = bytearray(memoryview(data)[start:end])
+
+        self._counters.fix(packets)
+        return packets
+
+    async def _decrypt(self, data: bytes, key: m3u8.Key, sequence: int) -> bytes:
+        if not HAS_CRYPTOGRAPHY:
+            msg = "The native tuner engine requires the `cryptography` package, pip install dlhdhr[native]"
+            raise HLSStreamError(msg)
+
+        # DLHDClient caches keys, so this only hits upstream when the key rotates
+        key_data = await self._dlhd.get_channel_key(self._channel, str(key.absolute_uri))
+
+        if key.iv:
+            iv_hex = key.iv[2:] if key.iv.lower().startswith("0x") else key.iv
+            iv = bytes.fromhex(iv_hex).rjust(_AES_BLOCK_SIZE, b"\x00")
+        else:
+            # Without an explicit IV the media sequence number is used
+            iv = sequence.to_bytes(_AES_BLOCK_SIZE, "big")
+
+        decryptor = Cipher(algorithms.AES(key_data), modes.CBC(iv)).decryptor()
+        data = decryptor.update(data) + decryptor.finalize()
+
+        # Strip the PKCS7 padding
+        padding = data[-1] if data else 0
+        if 0 < padding <= _AES_BLOCK_SIZE:
+            data = data[:-padding]
+        return data
+
+    async def _start(self) -> None:
+        if not self._fetch_task:
+            self._fetch_task = asyncio.create_task(self._fetch())
+
+    def _stop(self) -> None:
+        if self._fetch_task:
+            self._fetch_task.cancel()
+
+    async def __aenter__(self) -> "HLSStream":
+        await self._start()
+        return self
+
+    async def __aexit__(self, _exc_type, _exc_value, _traceback) -> None:
+        self._stop()
+
+    def __repr__(self) -> str:
+        return f"HLSStream<started={self.started}, channel={self._channel}>"
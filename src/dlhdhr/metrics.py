@@ -0,0 +1,258 @@
+import bisect
+from typing import TYPE_CHECKING, Iterable, Protocol
+
+if TYPE_CHECKING:
+    from dlhdhr.dlhd import DLHDClient
+    from dlhdhr.epg import EPG
+    from dlhdhr.tuner import TunerManager
+
+# Upstream requests take anywhere from a few milliseconds (a cached connection) to the client timeout
+LATENCY_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = dict[str, str]
+
+
+class CacheStats(Protocol):
+    # Any of the caches in dlhdhr.cache, which count their own hits and misses
+    @property
+    def hits(self) -> int: ...
+
+    @property
+    def misses(self) -> int: ...
+
+
+class Histogram:
+    """Counts of observed values by bucket, along with their sum, as a Prometheus histogram.
+
+    Observing a value is a bisect and a couple of additions, cheap enough for every request.
+    """
+
+    buckets: tuple[float, ...]
+    counts: list[int]
+    sum: float = 0
+    count: int = 0
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket, plus the values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class MetricsWriter:
+    """Builds a Prometheus text exposition (format 0.0.4) document."""
+
+    _lines: list[str]
+
+    def __init__(self):
+        self._lines = []
+
+    def add(self, name: str, kind: str, description: str, samples: Iterable[tuple[Labels, float]]) -> None:
+        self._lines.append(f"# HELP {name} {description}")
+        self._lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self._lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    def add_histogram(self, name: str, description: str, histograms: Iterable[tuple[Labels, Histogram]]) -> None:
+        self._lines.append(f"# HELP {name} {description}")
+        self._lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            total = 0
+            for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts, strict=True):
+                total += count
+                self._lines.append(f"{name}_bucket{_format_labels({**labels, 'le': str(bound)})} {total}")
+            self._lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            self._lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+    def render(self) -> bytes:
+        return ("\n".join(self._lines) + "\n").encode()
+
+
+def _add_tuner_metrics(writer: MetricsWriter, tuners: "TunerManager") -> None:
+    all_tuners = tuners.tuners
+    writer.add("dlhdhr_tuners_max", "gauge", "How many tuners can be claimed at once.", [({}, tuners.max_tuners)])
+    writer.add(
+        "dlhdhr_tuner_active",
+        "gauge",
+        "Tuners which are streaming, by channel and whether they are on standby.",
+        [({"channel": t.channel.number, "standby": str(t.standby).lower()}, 1) for t in all_tuners if t.running],
+    )
+    writer.add(
+        "dlhdhr_tuner_listeners",
+        "gauge",
+        "Listeners connected to each tuner.",
+        [({"channel": t.channel.number}, t.num_listeners) for t in all_tuners],
+    )
+    writer.add(
+        "dlhdhr_tuner_uptime_seconds",
+        "gauge",
+        "Seconds since each tuner's source (ffmpeg process or native HLS stream) was started.",
+        [({"channel": t.channel.number, "engine": t.engine}, t.uptime) for t in all_tuners if t.running],
+    )
+    writer.add(
+        "dlhdhr_tuner_listener_queue_chunks",
+        "gauge",
+        "Chunks waiting to be sent to the furthest behind listener of each tuner.",
+        [
+            ({"channel": t.channel.number}, max((listener.queued for listener in t.listeners), default=0))
+            for t in all_tuners
+        ],
+    )
+    writer.add(
+        "dlhdhr_tuner_listener_lag_bytes",
+        "gauge",
+        "Bytes behind the live edge of the furthest behind listener of each tuner.",
+        [
+            ({"channel": t.channel.number}, max((listener.lag for listener in t.listeners), default=0))
+            for t in all_tuners
+        ],
+    )
+
+    stats = tuners.stats
+    writer.add(
+        "dlhdhr_tuner_source_starts_total",
+        "counter",
+        "Times a tuner's source was started for each channel, anything above 1 is a restart.",
+        [({"channel": number}, s.starts) for number, s in stats.items()],
+    )
+    writer.add(
+        "dlhdhr_tuner_received_bytes_total",
+        "counter",
+        "Bytes read from the tuners' sources for each channel.",
+        [({"channel": number}, s.bytes_in) for number, s in stats.items()],
+    )
+    writer.add(
+        "dlhdhr_tuner_sent_bytes_total",
+        "counter",
+        "Bytes sent to listeners for each channel.",
+        [({"channel": number}, s.bytes_out) for number, s in stats.items()],
+    )
+    writer.add(
+        "dlhdhr_listener_lag_actions_total",
+        "counter",
+        "Times each slow listener policy has been applied.",
+        [({"policy": policy}, count) for policy, count in tuners.lag_actions.items()],
+    )
+
+
+def _add_upstream_metrics(writer: MetricsWriter, dlhd: "DLHDClient") -> None:
+    upstream = dlhd.upstream_stats
+    writer.add(
+        "dlhdhr_upstream_responses_total",
+        "counter",
+        "Responses from each upstream host, by status code.",
+        [
+            ({"host": host, "status": status}, count)
+            for host, s in upstream.items()
+            for status, count in s.responses.items()
+        ],
+    )
+    writer.add(
+        "dlhdhr_upstream_errors_total",
+        "counter",
+        "Upstream requests which failed without a response (connection errors, timeouts).",
+        [({"host": host}, s.errors) for host, s in upstream.items()],
+    )
+    writer.add_histogram(
+        "dlhdhr_upstream_latency_seconds",
+        "Seconds until the response headers were received from each upstream host.",
+        [({"host": host}, s.latency) for host, s in upstream.items()],
+    )
+
+    writer.add_histogram(
+        "dlhdhr_upstream_phase_seconds",
+        "Seconds taken by each phase of the sampled upstream traces (see /debug/traces.json).",
+        [({"phase": phase}, histogram) for phase, histogram in dlhd.tracer.phases.items()],
+    )
+
+    pools = dlhd.pool_stats
+    writer.add(
+        "dlhdhr_upstream_connections_total",
+        "counter",
+        "Connections opened to each upstream host.",
+        [({"host": host}, s.connections) for host, s in pools.items()],
+    )
+    writer.add(
+        "dlhdhr_upstream_connection_reuses_total",
+        "counter",
+        "Requests sent to each upstream host on an already open (keep-alive) connection.",
+        [({"host": host}, s.hits) for host, s in pools.items()],
+    )
+
+    caches: dict[str, CacheStats] = {
+        "segments": dlhd.segment_cache,
+        "sources": dlhd.source_cache,
+        "keys": dlhd.key_cache,
+    }
+    writer.add(
+        "dlhdhr_cache_hits_total",
+        "counter",
+        "Lookups served from each cache, the hit ratio is hits / (hits + misses).",
+        [({"cache": name}, cache.hits) for name, cache in caches.items()],
+    )
+    writer.add(
+        "dlhdhr_cache_misses_total",
+        "counter",
+        "Lookups which missed each cache.",
+        [({"cache": name}, cache.misses) for name, cache in caches.items()],
+    )
+    writer.add(
+        "dlhdhr_segment_cache_prefetches_total",
+        "counter",
+        "Segments downloaded into the segment cache ahead of being requested.",
+        [({}, dlhd.segment_cache.prefetches)],
+    )
+    writer.add(
+        "dlhdhr_segment_cache_bytes", "gauge", "Bytes held by the segment cache.", [({}, dlhd.segment_cache.size)]
+    )
+
+
+def _add_epg_metrics(writer: MetricsWriter, epg: "EPG") -> None:
+    statuses = epg.status()
+    writer.add(
+        "dlhdhr_epg_refresh_age_seconds",
+        "gauge",
+        "Seconds since each EPG provider's listings were last fetched successfully.",
+        [({"provider": name}, s["age"]) for name, s in statuses.items() if s["age"] is not None],
+    )
+    writer.add(
+        "dlhdhr_epg_refresh_duration_seconds",
+        "gauge",
+        "How long each EPG provider's last refresh took.",
+        [({"provider": name}, s["last_duration"]) for name, s in statuses.items()],
+    )
+    writer.add(
+        "dlhdhr_epg_refresh_failures",
+        "gauge",
+        "Failed refreshes in a row for each EPG provider.",
+        [({"provider": name}, s["failures"]) for name, s in statuses.items()],
+    )
+    writer.add(
+        "dlhdhr_epg_channels",
+        "gauge",
+        "Channels each EPG provider has listings for.",
+        [({"provider": name}, s["channels"]) for name, s in statuses.items()],
+    )
+
+
+def render_metrics(dlhd: "DLHDClient", tuners: "TunerManager", epg: "EPG") -> bytes:
+    # Everything is read from counters kept as things happen, so rendering doesn't touch any streams
+    writer = MetricsWriter()
+    _add_tuner_metrics(writer, tuners)
+    _add_upstream_metrics(writer, dlhd)
+    _add_epg_metrics(writer, epg)
+    return writer.render()
@@ -0,0 +1,159 @@
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+NULL_PID = 0x1FFF
+
+# adaptation_field_control, for packets with both an adaptation field and a payload
+_ADAPTATION_AND_PAYLOAD = 0x30
+# PES stream ids of video streams
+_VIDEO_STREAM_IDS = range(0xE0, 0xF0)
+
+
+def is_keyframe_packet(data: bytes, offset: int = 0) -> bool:
+    # A video keyframe starts a new PES packet (payload_unit_start_indicator)
+    # and has the random_access_indicator set in the adaptation field
+    if data[offset] != TS_SYNC_BYTE or not data[offset + 1] & 0x40:
+        return False
+
+    # adaptation_field_control must signal both an adaptation field and a payload
+    if data[offset + 3] & _ADAPTATION_AND_PAYLOAD != _ADAPTATION_AND_PAYLOAD:
+        return False
+
+    adaptation_length = data[offset + 4]
+    if not adaptation_length or not data[offset + 5] & 0x40:
+        return False
+
+    # Audio packets can also be flagged as random access points, only count video PES streams
+    pes = offset + 5 + adaptation_length
+    if pes + 4 > offset + TS_PACKET_SIZE:
+        return False
+    return data[pes : pes + 3] == b"\x00\x00\x01" and data[pes + 3] in _VIDEO_STREAM_IDS
+
+
+def find_keyframe(data: bytes) -> int:
+    # Returns the offset of the first video keyframe packet in `data`, or -1
+    for offset in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        if is_keyframe_packet(data, offset):
+            return offset
+    return -1
+
+
+def _payload_offset(data: bytes, offset: int) -> int:
+    # Skip the 4 byte header and the adaptation field (if there is one)
+    if data[offset + 3] & 0x20:
+        return offset + 5 + data[offset + 4]
+    return offset + 4
+
+
+def _find_section_packets(data: bytes, pid: int) -> list[int]:
+    # Find the offsets of every packet starting a new section for `pid`
+    header = bytes([TS_SYNC_BYTE, 0x40 | (pid >> 8), pid & 0xFF])
+    offsets = []
+    offset = data.find(header)
+    while offset != -1:
+        if offset % TS_PACKET_SIZE == 0 and offset + TS_PACKET_SIZE <= len(data):
+            offsets.append(offset)
+        offset = data.find(header, offset + 1)
+    return offsets
+
+
+class ProgramTables:
+    """Keeps track of the most recent PAT and PMT packets seen in a TS stream.
+
+    New clients joining mid-stream need these before they are able to decode
+    anything, so we can send them first instead of waiting for the next time
+    the muxer repeats them.
+    """
+
+    PAT_PID = 0x0000
+
+    pat: bytes | None = None
+    pmt: bytes | None = None
+    _pmt_pid: int | None = None
+
+    @property
+    def packets(self) -> bytes:
+        if self.pat is None or self.pmt is None:
+            return b""
+        return self.pat + self.pmt
+
+    def update(self, data: bytes) -> None:
+        # `data` is expected to be TS packet aligned
+        pat_offsets = _find_section_packets(data, self.PAT_PID)
+        if pat_offsets:
+            offset = pat_offsets[-1]
+            pmt_pid = self._parse_pmt_pid(data, offset)
+            if pmt_pid is not None:
+                if pmt_pid != self._pmt_pid:
+                    self.pmt = None
+                self._pmt_pid = pmt_pid
+                self.pat = data[offset : offset + TS_PACKET_SIZE]
+
+        if self._pmt_pid is not None:
+            pmt_offsets = _find_section_packets(data, self._pmt_pid)
+            if pmt_offsets:
+                offset = pmt_offsets[-1]
+                self.pmt = data[offset : offset + TS_PACKET_SIZE]
+
+    def _parse_pmt_pid(self, data: bytes, offset: int) -> int | None:
+        end = offset + TS_PACKET_SIZE
+        payload = _payload_offset(data, offset)
+        if payload >= end:
+            return None
+
+        # pointer_field, then the PAT section itself
+        section = payload + 1 + data[payload]
+        if section + 8 > end or data[section] != 0x00:
+            return None
+
+        section_length = ((data[section + 1] & 0x0F) << 8) | data[section + 2]
+        # Program loop runs from after the 8 byte section header until the 4 byte CRC
+        programs_end = min(section + 3 + section_length - 4, end)
+        for program in range(section + 8, programs_end - 3, 4):
+            program_number = (data[program] << 8) | data[program + 1]
+            # Program number 0 points to the network PID, not a PMT
+            if program_number:
+                return ((data[program + 2] & 0x1F) << 8) | data[program + 3]
+        return None
+
+
+def find_sync(data: bytes) -> int:
+    # Find the first offset where packets look properly aligned (two sync bytes a packet apart), or -1
+    offset = data.find(TS_SYNC_BYTE)
+    while offset != -1:
+        if offset + TS_PACKET_SIZE >= len(data) or data[offset + TS_PACKET_SIZE] == TS_SYNC_BYTE:
+            return offset
+        offset = data.find(TS_SYNC_BYTE, offset + 1)
+    return -1
+
+
+class ContinuityCounters:
+    """Rewrites the continuity counter of every packet so each PID counts up without gaps.
+
+    Joining independently muxed HLS segments back to back makes the counters jump
+    at every segment boundary, which players report (and sometimes handle) as
+    packet loss.
+    """
+
+    _counters: dict[int, int]
+
+    def __init__(self):
+        self._counters = {}
+
+    def fix(self, data: bytearray) -> None:
+        # `data` is expected to be TS packet aligned, and is modified in place
+        counters = self._counters
+        for offset in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+            if data[offset] != TS_SYNC_BYTE:
+                continue
+
+            # The counter only increments for packets which carry a payload
+            flags = data[offset + 3]
+            if not flags & 0x10:
+                continue
+
+            pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+            if pid == NULL_PID:
+                continue
+            counter = (counters.get(pid, (flags & 0x0F) - 1) + 1) & 0x0F
+            counters[pid] = counter
+            data[offset + 3] = (flags & 0xF0) | counter
@@ -0,0 +1,247 @@
+import asyncio
+from dataclasses import dataclass
+import email.utils
+import gzip
+import hashlib
+import time
+from typing import AsyncIterator, Callable, Generic, Hashable, TypeVar
+
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from dlhdhr.cache import CachedStream
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+K = TypeVar("K", bound=Hashable)
+
+# Bodies are only compressed once per rendering (in a worker thread), but some (the guide) are
+# several megabytes, so stick to levels which don't take long
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Appended to the ETag of each encoding of a body
+_ETAG_SUFFIXES = {"gzip": "gz", "br": "br"}
+
+
+def accepts_encoding(request: Request, encoding: str) -> bool:
+    for value in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = value.partition(";")
+        if name.strip().lower() != encoding:
+            continue
+
+        # An explicit `q=0` means the client does not want this encoding
+        for param in params.split(";"):
+            key, _, quality = param.strip().partition("=")
+            if key == "q":
+                try:
+                    return float(quality) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+@dataclass(frozen=True)
+class CachedBody:
+    """A pre-rendered response body, along with its compressed versions and validators.
+
+    The brotli version is only available when the `brotli` package is installed.
+    """
+
+    content: bytes
+    gzip_content: bytes
+    br_content: bytes | None
+    media_type: str
+    etag: str
+    last_modified: float
+
+    @classmethod
+    def build(cls, content: bytes, media_type: str, previous: "CachedBody | None" = None) -> "CachedBody":
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+
+        # Re-rendering the exact same content shouldn't look like a change to clients
+        last_modified = time.time()
+        if previous is not None and previous.etag == etag:
+            last_modified = previous.last_modified
+
+        return cls(
+            content=content,
+            gzip_content=gzip.compress(content, compresslevel=GZIP_LEVEL),
+            br_content=brotli.compress(content, quality=BROTLI_QUALITY) if brotli is not None else None,
+            media_type=media_type,
+            etag=etag,
+            last_modified=last_modified,
+        )
+
+    def get_etag(self, encoding: str | None) -> str:
+        # Each encoding of the body is a representation of its own, and needs its own strong ETag
+        if encoding is None:
+            return self.etag
+        return f'{self.etag[:-1]}-{_ETAG_SUFFIXES[encoding]}"'
+
+    def get_headers(self, encoding: str | None) -> dict[str, str]:
+        return {
+            "ETag": self.get_etag(encoding),
+            "Last-Modified": email.utils.formatdate(self.last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+
+    def get_encoding(self, request: Request) -> str | None:
+        if self.br_content is not None and accepts_encoding(request, "br"):
+            return "br"
+        if accepts_encoding(request, "gzip"):
+            return "gzip"
+        return None
+
+    def is_not_modified(self, request: Request, encoding: str | None = None) -> bool:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110 section 13.1.3)
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            etags = [etag.strip().removeprefix("W/") for etag in if_none_match.split(",")]
+            return "*" in etags or self.get_etag(encoding) in etags
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return int(self.last_modified) <= since.timestamp()
+        return False
+
+    def response(self, request: Request) -> Response:
+        encoding = self.get_encoding(request)
+        headers = self.get_headers(encoding)
+        if self.is_not_modified(request, encoding):
+            return Response(status_code=304, headers=headers)
+
+        if encoding == "br" and self.br_content is not None:
+            headers["Content-Encoding"] = "br"
+            return Response(self.br_content, media_type=self.media_type, headers=headers)
+        if encoding == "gzip":
+            headers["Content-Encoding"] = "gzip"
+            return Response(self.gzip_content, media_type=self.media_type, headers=headers)
+        return Response(self.content, media_type=self.media_type, headers=headers)
+
+
+class BodyCache(Generic[K]):
+    """Keeps the renderings of small documents, each only rendered once per key.
+
+    Meant for documents which only change with the channel lineup, but also
+    depend on things like the URL they were requested from, so a few keys
+    are kept at once. The least recently rendered is dropped beyond `size`.
+    """
+
+    _media_type: str
+    _size: int
+    _bodies: dict[K, CachedBody]
+    _latest: CachedBody | None = None
+
+    def __init__(self, media_type: str, size: int = 8):
+        self._media_type = media_type
+        self._size = size
+        self._bodies = {}
+
+    async def get(self, key: K, render: Callable[[], bytes]) -> CachedBody:
+        body = self._bodies.get(key)
+        if body is None:
+            # Compressing happens off the event loop, a request for the same key meanwhile builds its own copy
+            body = await asyncio.to_thread(CachedBody.build, render(), self._media_type, previous=self._latest)
+            self._bodies[key] = self._latest = body
+            while len(self._bodies) > self._size:
+                del self._bodies[next(iter(self._bodies))]
+        return body
+
+    async def response(self, request: Request, key: K, render: Callable[[], bytes]) -> Response:
+        return (await self.get(key, render)).response(request)
+
+
+class DocumentCache(Generic[K]):
+    """Keeps the latest rendering of a generated document, which is only rebuilt when its key changes.
+
+    While a new rendering is being generated, every request for it streams the
+    chunks as they are produced (sharing a single generation), and once it is
+    complete it is kept as a `CachedBody` to serve conditional requests.
+    Renderings which came out incomplete are only kept for `incomplete_ttl`
+    seconds before being generated again.
+    """
+
+    _media_type: str
+    _incomplete_ttl: float
+    _key: K | None = None
+    _body: CachedBody | None = None
+    _expires: float | None = None
+    _rendering: dict[K, CachedStream]
+    _tasks: set[asyncio.Task]
+
+    def __init__(self, media_type: str, incomplete_ttl: float = 0):
+        self._media_type = media_type
+        self._incomplete_ttl = incomplete_ttl
+        self._rendering = {}
+        self._tasks = set()
+
+    def get(self, key: K) -> CachedBody | None:
+        if self._body is None or self._key != key:
+            return None
+        if self._expires is not None and time.monotonic() >= self._expires:
+            return None
+        return self._body
+
+    async def _render(
+        self,
+        key: K,
+        stream: CachedStream,
+        generate: Callable[[], AsyncIterator[bytes]],
+        is_complete: Callable[[], bool] | None,
+    ) -> None:
+        chunks: list[bytes] = []
+        try:
+            async for chunk in generate():
+                chunks.append(chunk)
+                stream.append(chunk)
+        except BaseException as e:
+            stream.finish(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            stream.finish()
+            # Incomplete documents are only kept for a little while, after which the next request tries again
+            expires = None
+            if is_complete is not None and not is_complete():
+                if self._incomplete_ttl <= 0:
+                    return
+                expires = time.monotonic() + self._incomplete_ttl
+            body = await asyncio.to_thread(CachedBody.build, b"".join(chunks), self._media_type, previous=self._body)
+            self._key = key
+            self._body = body
+            self._expires = expires
+        finally:
+            self._rendering.pop(key, None)
+
+    def render(
+        self, key: K, generate: Callable[[], AsyncIterator[bytes]], is_complete: Callable[[], bool] | None = None
+    ) -> CachedStream:
+        stream = self._rendering.get(key)
+        if stream is None:
+            stream = self._rendering[key] = CachedStream(expires=float("inf"))
+            task = asyncio.create_task(self._render(key, stream, generate, is_complete))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return stream
+
+    def response(
+        self,
+        request: Request,
+        key: K,
+        generate: Callable[[], AsyncIterator[bytes]],
+        is_complete: Callable[[], bool] | None = None,
+    ) -> Response:
+        body = self.get(key)
+        if body is not None:
+            return body.response(request)
+        return StreamingResponse(self.render(key, generate, is_complete), media_type=self._media_type)
@@ -0,0 +1,135 @@
+import asyncio
+
+
+class RingBuffer:
+    """Fixed size buffer of chunks shared between a single writer and many readers.
+
+    Every chunk written gets a monotonically increasing sequence number, readers
+    keep track of their own position (cursor) and read the chunks directly out of
+    the buffer. Writing is O(1) regardless of the number of readers, and once the
+    buffer is full (either `size` chunks, or `max_bytes` bytes) the oldest chunks
+    are dropped.
+
+    The buffer also remembers the byte offset of each chunk in the stream, and
+    which chunks start with a keyframe, so readers can measure how far behind
+    they are and where they can safely resume from.
+    """
+
+    _slots: list[bytes | None]
+    _offsets: list[int]
+    _keyframes: list[bool]
+    _size: int
+    _max_bytes: int | None
+    _head: int = 0
+    _tail: int = 0
+    _bytes_written: int = 0
+    _last_keyframe: int | None = None
+    _closed: bool = False
+    _waiter: asyncio.Future | None = None
+
+    def __init__(self, size: int, max_bytes: int | None = None):
+        if size < 1:
+            msg = "RingBuffer size must be at least 1"
+            raise ValueError(msg)
+
+        self._size = size
+        self._max_bytes = max_bytes
+        self._slots = [None] * size
+        self._offsets = [0] * size
+        self._keyframes = [False] * size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def head(self) -> int:
+        # The sequence number of the next chunk to be written
+        return self._head
+
+    @property
+    def tail(self) -> int:
+        # The sequence number of the oldest chunk still available
+        return self._tail
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def bytes_written(self) -> int:
+        return self._bytes_written
+
+    @property
+    def last_keyframe(self) -> int | None:
+        # The sequence number of the newest chunk which starts with a keyframe, if it is still in the buffer
+        if self._last_keyframe is None or self._last_keyframe < self.tail:
+            return None
+        return self._last_keyframe
+
+    def write(self, chunk: bytes, *, keyframe: bool = False) -> None:
+        if self._closed:
+            return
+
+        slot = self._head % self._size
+        self._slots[slot] = chunk
+        self._offsets[slot] = self._bytes_written
+        self._keyframes[slot] = keyframe
+        if keyframe:
+            self._last_keyframe = self._head
+
+        self._bytes_written += len(chunk)
+        self._head += 1
+        self._tail = max(self._tail, self._head - self._size)
+        if self._max_bytes is not None:
+            # Drop the oldest chunks until we are back under the byte limit
+            while (
+                self._tail < self._head - 1
+                and self._bytes_written - self._offsets[self._tail % self._size] > self._max_bytes
+            ):
+                self._slots[self._tail % self._size] = None
+                self._tail += 1
+        self._wakeup()
+
+    def get(self, seq: int) -> bytes:
+        chunk = self._slots[seq % self._size] if self.tail <= seq < self._head else None
+        if chunk is None:
+            msg = f"sequence {seq} is not in the buffer"
+            raise IndexError(msg)
+        return chunk
+
+    def offset(self, seq: int) -> int:
+        # The stream byte offset of chunk `seq`, `head` maps to the total number of bytes written
+        if seq == self._head:
+            return self._bytes_written
+        if seq < self.tail or seq > self._head:
+            msg = f"sequence {seq} is not in the buffer"
+            raise IndexError(msg)
+        return self._offsets[seq % self._size]
+
+    def is_keyframe(self, seq: int) -> bool:
+        if seq < self.tail or seq >= self._head:
+            return False
+        return self._keyframes[seq % self._size]
+
+    def close(self) -> None:
+        self._closed = True
+        self._wakeup()
+
+    async def wait(self, seq: int) -> None:
+        # Wait until the chunk `seq` is written, or the buffer is closed
+        while seq >= self._head and not self._closed:
+            if self._waiter is None:
+                self._waiter = asyncio.get_running_loop().create_future()
+
+            # Shield the shared waiter so a cancelled reader doesn't cancel it for everyone else
+            await asyncio.shield(self._waiter)
+
+    def _wakeup(self) -> None:
+        if self._waiter is not None:
+            if not self._waiter.done():
+                self._waiter.set_result(None)
+            self._waiter = None
+
+    def __repr__(self) -> str:
+        return f"RingBuffer<size={self._size}, head={self._head}, closed={self._closed}>"
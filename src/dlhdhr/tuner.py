@@ -1,87 +1,270 @@
 import asyncio
+import bisect
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
 import time
+from typing import Callable
 import weakref
 
-from dlhdhr.dlhd import DLHDChannel
+from dlhdhr.dlhd import DLHDChannel, DLHDClient
 from dlhdhr.ffmpeg import FFMpegProcess
+from dlhdhr.hls import HLSStream
+from dlhdhr.mpegts import TS_PACKET_SIZE, ProgramTables, find_keyframe
+from dlhdhr.ringbuffer import RingBuffer
 from m3u8.httpclient import urllib
 
 from dlhdhr import config
 
 
+@dataclass()
+class TunerStats:
+    # Counters for a channel, kept across the tuners which come and go for it
+    bytes_in: int = 0
+    bytes_out: int = 0
+    # How many times a tuner's source has been started, anything after the first is a restart
+    starts: int = 0
+
+
 class Tuner:
     TUNER_TIMEOUT: int = 20
 
     _channel: DLHDChannel
-    _ffmpeg_process: FFMpegProcess
+    _source: FFMpegProcess | HLSStream
+    _buffer: RingBuffer
+    _remainder: bytes = b""
+    _tables: ProgramTables
+    _lag_actions: Counter[str]
+    _stats: TunerStats
     _listeners: weakref.WeakSet["Tuner.Listener"]
     _stream_task: asyncio.Task | None = None
+    _started_at: float = 0
+    _on_idle: Callable[["Tuner"], bool] | None
+    # Standby tuners keep streaming into their buffer even when nobody is listening
+    standby: bool = False
 
     class Listener:
-        _queue: asyncio.Queue
+        LAG_POLICIES = ("keyframe", "skip", "disconnect")
+
+        _buffer: RingBuffer
+        _cursor: int
+        _max_lag: int
+        _lag_policy: str
+        _lag_actions: Counter[str]
+        _stats: TunerStats
+        _write_size: int
+        _max_latency: float
+        _prefill: bytes = b""
+        _resync: bool = False
         _stopped: bool = False
 
-        def __init__(self):
-            self._queue = asyncio.Queue()
-
-        def write(self, chunk: bytes | None) -> None:
-            if not self._stopped:
-                self._queue.put_nowait(chunk)
+        def __init__(
+            self,
+            buffer: RingBuffer,
+            lag_actions: Counter[str],
+            *,
+            max_lag: int | None = None,
+            lag_policy: str | None = None,
+            start: int | None = None,
+            prefill: bytes = b"",
+            write_size: int | None = None,
+            max_latency: float | None = None,
+            stats: TunerStats | None = None,
+        ):
+            self._buffer = buffer
+            self._lag_actions = lag_actions
+            self._stats = stats if stats is not None else TunerStats()
+            self._write_size = max(1, write_size if write_size is not None else config.STREAM_WRITE_SIZE)
+            self._max_latency = max_latency if max_latency is not None else config.STREAM_MAX_LATENCY
+            self._max_lag = max_lag if max_lag is not None else config.LISTENER_MAX_LAG
+            self._lag_policy = lag_policy or config.LISTENER_LAG_POLICY
+            if self._lag_policy not in self.LAG_POLICIES:
+                msg = f"Unknown listener lag policy {self._lag_policy!r}"
+                raise ValueError(msg)
+
+            # Start reading from `start` (and send `prefill` first) if we can do so without
+            # already lagging behind, otherwise from the next chunk written to the buffer
+            self._cursor = buffer.head
+            if start is not None and start >= buffer.tail:
+                self._cursor = start
+                if self.is_lagging:
+                    self._cursor = buffer.head
+                else:
+                    self._prefill = prefill
+
+        @property
+        def lag(self) -> int:
+            # How many bytes behind the live edge this listener is
+            return self._buffer.bytes_written - self._buffer.offset(max(self._cursor, self._buffer.tail))
+
+        @property
+        def queued(self) -> int:
+            # How many chunks are waiting to be sent to this listener
+            return max(0, self._buffer.head - max(self._cursor, self._buffer.tail))
+
+        @property
+        def is_lagging(self) -> bool:
+            return self._cursor < self._buffer.tail or self.lag > self._max_lag
+
+        def _apply_lag_policy(self) -> None:
+            self._lag_actions[self._lag_policy] += 1
+
+            if self._lag_policy == "disconnect":
+                self._stop()
+            elif self._lag_policy == "keyframe":
+                keyframe = self._buffer.last_keyframe
+                if keyframe is not None and keyframe > self._cursor:
+                    self._cursor = keyframe
+                else:
+                    # There is no newer keyframe to jump to yet, so skip to
+                    # the live edge and drop everything until the next one
+                    self._cursor = self._buffer.head
+                    self._resync = True
+            elif self._lag_policy == "skip":
+                # Jump forward until we are within half of the allowed lag, every chunk
+                # in the buffer is TS packet aligned so this only ever drops whole packets
+                start = max(self._cursor, self._buffer.tail)
+                target = self._buffer.bytes_written - self._max_lag // 2
+                self._cursor = start + bisect.bisect_left(
+                    range(start, self._buffer.head), target, key=self._buffer.offset
+                )
 
         def _stop(self) -> None:
             self._stopped = True
-            self._queue.empty()
 
         def __aiter__(self) -> "Tuner.Listener":
             return self
 
-        async def __anext__(self):
-            if self._stopped:
+        async def __anext__(self) -> bytes:
+            # Batch up as many chunks as we can (up to `write_size`) into a single write. Once we
+            # have some data we sleep (rather than waking up for every chunk) for up to
+            # `max_latency` seconds to let more data arrive
+            chunks: list[bytes] = []
+            size = 0
+            slept = False
+            if self._prefill:
+                chunks.append(self._prefill)
+                size = len(self._prefill)
+                self._prefill = b""
+
+            while not self._stopped and size < self._write_size:
+                if self.is_lagging:
+                    self._apply_lag_policy()
+                    continue
+
+                while self._resync and self._cursor < self._buffer.head:
+                    if self._buffer.is_keyframe(self._cursor):
+                        self._resync = False
+                    else:
+                        self._cursor += 1
+
+                if self._cursor < self._buffer.head:
+                    chunk = self._buffer.get(self._cursor)
+                    self._cursor += 1
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    continue
+
+                if self._buffer.closed:
+                    break
+
+                if not chunks:
+                    await self._buffer.wait(self._cursor)
+                    continue
+
+                if slept or self._max_latency <= 0:
+                    break
+                slept = True
+                await asyncio.sleep(self._max_latency)
+
+            if not chunks or self._stopped:
                 raise StopAsyncIteration()
-            chunk = await self._queue.get()
-            if not chunk:
-                raise StopAsyncIteration()
-
-            return chunk
-
-    def __init__(self, channel: DLHDChannel):
-        # We can use the binding ip/port here since it should all local traffic
-        base_url = f"http://{config.HOST}:{config.PORT}/"
-        absolute_url = urllib.parse.urljoin(base_url, channel.playlist_m3u8)
-
+            self._stats.bytes_out += size
+            if len(chunks) == 1:
+                return chunks[0]
+            return b"".join(chunks)
+
+    def __init__(
+        self,
+        channel: DLHDChannel,
+        dlhd: DLHDClient,
+        lag_actions: Counter[str] | None = None,
+        on_idle: Callable[["Tuner"], bool] | None = None,
+        stats: TunerStats | None = None,
+    ):
         self._channel = channel
-        self._ffmpeg_process = FFMpegProcess(absolute_url)
+        self._on_idle = on_idle
+        if config.TUNER_ENGINE == "native":
+            self._source = HLSStream(dlhd, channel)
+        else:
+            # We can use the binding ip/port here since it should all local traffic
+            base_url = f"http://{config.HOST}:{config.PORT}/"
+            absolute_url = urllib.parse.urljoin(base_url, channel.playlist_m3u8)
+            self._source = FFMpegProcess(absolute_url)
+        # Bound the buffer by size in bytes, with enough slots for chunks as small as ~7 TS packets
+        self._buffer = RingBuffer(
+            max(1, config.TUNER_BUFFER_SIZE // (TS_PACKET_SIZE * 7)),
+            max_bytes=config.TUNER_BUFFER_SIZE,
+        )
+        self._tables = ProgramTables()
+        self._lag_actions = lag_actions if lag_actions is not None else Counter()
+        self._stats = stats if stats is not None else TunerStats()
         self._listeners = weakref.WeakSet()
 
     async def _stream(self) -> None:
         try:
             stream_timeout: float | None = None
-            async with self._ffmpeg_process:
-                async for chunk in self._ffmpeg_process:
+            async with self._source:
+                async for chunk in self._source:
+                    self._stats.bytes_in += len(chunk)
+
                     # If there are no listeners, stream for up to 20 more seconds
                     # to see if a listener comes back, if not, then stop the stream
-                    if not self._listeners:
+                    # (unless `on_idle` moves us to standby instead)
+                    if not self._listeners and not self.standby:
                         if not stream_timeout:
                             stream_timeout = time.time()
                         elif time.time() - stream_timeout > Tuner.TUNER_TIMEOUT:
-                            break
+                            if not self._on_idle or not self._on_idle(self):
+                                break
+                            stream_timeout = None
                         else:
                             continue
                     elif stream_timeout:
                         stream_timeout = None
 
-                    for listener in self._listeners:
-                        listener.write(chunk)
-                        # Make sure we don't hold any hard references to
-                        # these weakrefs
-                        del listener
+                    # Every listener reads from the same buffer at their own pace
+                    self._write(chunk)
         finally:
             self._stop()
 
+    def _write(self, chunk: bytes) -> None:
+        # Only write whole TS packets to the buffer, keeping any partial packet for the next chunk
+        if self._remainder:
+            chunk = self._remainder + chunk
+
+        end = len(chunk) - (len(chunk) % TS_PACKET_SIZE)
+        self._remainder = chunk[end:]
+        if not end:
+            return
+        if end != len(chunk):
+            chunk = chunk[:end]
+
+        self._tables.update(chunk)
+
+        keyframe = find_keyframe(chunk)
+        if keyframe > 0:
+            # Split the chunk so the keyframe starts a chunk of its own
+            self._buffer.write(chunk[:keyframe])
+            self._buffer.write(chunk[keyframe:], keyframe=True)
+        else:
+            self._buffer.write(chunk, keyframe=keyframe == 0)
+
     async def _start(self) -> None:
         if self._stream_task:
             return
 
+        self._stats.starts += 1
+        self._started_at = time.monotonic()
         self._stream_task = asyncio.create_task(self._stream())
 
     def _stop(self) -> None:
@@ -89,17 +272,26 @@ class Tuner:
             self._stream_task.cancel()
             self._stream_task = None
 
-        self._ffmpeg_process._stop()
+        self._source._stop()
+        self._buffer.close()
         for listener in self._listeners:
             listener._stop()
         self._listeners.clear()
 
     async def get_listener(self) -> "Tuner.Listener":
         # Make sure to add listener before starting the stream
-        listener = self.Listener()
+        # New listeners start from the most recent keyframe, with the latest PAT/PMT
+        # sent first, so they can start decoding video straight away
+        listener = self.Listener(
+            self._buffer,
+            self._lag_actions,
+            start=self._buffer.last_keyframe,
+            prefill=self._tables.packets,
+            stats=self._stats,
+        )
         self._listeners.add(listener)
 
-        if not self._ffmpeg_process.started:
+        if not self._source.started:
             await self._start()
 
         return listener
@@ -108,6 +300,34 @@ class Tuner:
     def channel(self) -> DLHDChannel:
         return self._channel
 
+    @property
+    def running(self) -> bool:
+        return self._stream_task is not None
+
+    @property
+    def stopped(self) -> bool:
+        # Whether the tuner has been stopped, it can't be started again
+        return self._buffer.closed
+
+    @property
+    def engine(self) -> str:
+        return "native" if isinstance(self._source, HLSStream) else "ffmpeg"
+
+    @property
+    def uptime(self) -> float:
+        # Seconds since the source was started
+        if not self.running:
+            return 0
+        return time.monotonic() - self._started_at
+
+    @property
+    def stats(self) -> TunerStats:
+        return self._stats
+
+    @property
+    def listeners(self) -> list["Tuner.Listener"]:
+        return list(self._listeners)
+
     @property
     def has_listeners(self) -> bool:
         return bool(self.num_listeners)
@@ -117,7 +337,7 @@ class Tuner:
         return len(self._listeners)
 
     def __repr__(self) -> str:
-        return f"Tuner<channel={self.channel}, num_listeners={self.num_listeners}>"
+        return f"Tuner<channel={self.channel}, num_listeners={self.num_listeners}, standby={self.standby}>"
 
 
 class NoAvailableTunersError(Exception):
@@ -129,15 +349,52 @@ class TunerNotFoundError(Exception):
 
 
 class TunerManager:
+    STANDBY_CHECK_INTERVAL: int = 10
+
+    _dlhd: DLHDClient
     _max_tuners: int
     _tuners: weakref.WeakValueDictionary[DLHDChannel, Tuner]
-
-    def __init__(self, max_tuners: int = 2) -> None:
+    _standby: OrderedDict[DLHDChannel, Tuner]
+    _recent: OrderedDict[DLHDChannel, None]
+    _standby_task: asyncio.Task | None = None
+    _lag_actions: Counter[str]
+    _stats: dict[str, TunerStats]
+
+    def __init__(self, dlhd: DLHDClient, max_tuners: int = 2) -> None:
+        self._dlhd = dlhd
         self._max_tuners = max_tuners
         self._tuners = weakref.WeakValueDictionary()
+        self._standby = OrderedDict()
+        self._recent = OrderedDict()
+        self._lag_actions = Counter({policy: 0 for policy in Tuner.Listener.LAG_POLICIES})
+        self._stats = {}
 
     def __repr__(self) -> str:
-        return f"TunerManager<num_tuners={self._max_tuners}, tuners={self._tuners}>"
+        return (
+            f"TunerManager<num_tuners={self._max_tuners}, tuners={self._tuners}, "
+            f"standby={list(self._standby.values())}, lag_actions={self.lag_actions}>"
+        )
+
+    @property
+    def lag_actions(self) -> dict[str, int]:
+        # Number of times each slow listener policy has been applied across all tuners
+        return dict(self._lag_actions)
+
+    @property
+    def stats(self) -> dict[str, TunerStats]:
+        # Counters for every channel which has been tuned, by channel number
+        return dict(self._stats)
+
+    @property
+    def tuners(self) -> list[Tuner]:
+        # Every claimed and standby tuner
+        return [*self._tuners.values(), *self._standby.values()]
+
+    def _create_tuner(self, channel: DLHDChannel) -> Tuner:
+        stats = self._stats.get(channel.number)
+        if stats is None:
+            stats = self._stats[channel.number] = TunerStats()
+        return Tuner(channel, self._dlhd, lag_actions=self._lag_actions, on_idle=self._release, stats=stats)
 
     @property
     def max_tuners(self) -> int:
@@ -145,6 +402,7 @@ class TunerManager:
 
     @property
     def available_tuners(self) -> int:
+        # Standby tuners don't count against our capacity until they are claimed
         return self.max_tuners - len(self._tuners)
 
     @property
@@ -162,19 +420,98 @@ class TunerManager:
 
         return total_listeners + max(1, self.available_tuners)
 
+    def _keep_warm(self, channel: DLHDChannel) -> bool:
+        hot_channels = config.TUNER_HOT_CHANNELS or set()
+        return channel.number in hot_channels or channel in self._recent
+
+    def _add_standby(self, tuner: Tuner) -> None:
+        tuner.standby = True
+        self._standby[tuner.channel] = tuner
+
+    def _release(self, tuner: Tuner) -> bool:
+        # Called when a claimed tuner has no more listeners, returns whether the
+        # tuner was moved to standby (and should keep streaming) or should stop
+        if self._tuners.get(tuner.channel) is tuner:
+            del self._tuners[tuner.channel]
+
+        if tuner.running and self._keep_warm(tuner.channel):
+            self._add_standby(tuner)
+            return True
+        return False
+
+    def _touch_recent(self, channel: DLHDChannel) -> None:
+        if config.TUNER_STANDBY_RECENT <= 0:
+            return
+
+        self._recent[channel] = None
+        self._recent.move_to_end(channel)
+        while len(self._recent) > config.TUNER_STANDBY_RECENT:
+            evicted, _ = self._recent.popitem(last=False)
+            if evicted in self._standby and not self._keep_warm(evicted):
+                self._standby.pop(evicted)._stop()
+
+    async def _start_standby(self, channel: DLHDChannel) -> None:
+        tuner = self._create_tuner(channel)
+        self._add_standby(tuner)
+        await tuner._start()
+
+    async def _check_standby(self) -> None:
+        # Drop any standby tuners whose stream has ended
+        for channel, tuner in list(self._standby.items()):
+            if not tuner.running:
+                del self._standby[channel]
+
+        # Make sure every hot channel is tuned, either claimed or on standby
+        for number in config.TUNER_HOT_CHANNELS or set():
+            hot_channel = self._dlhd.get_channel(number)
+            if not hot_channel or hot_channel in self._standby:
+                continue
+            existing = self._tuners.get(hot_channel)
+            if existing is not None:
+                # A claimed tuner which isn't running yet is about to be started by its first listener
+                if not existing.stopped:
+                    continue
+                # Its stream has ended, replace it rather than tuning the channel twice
+                del self._tuners[hot_channel]
+            await self._start_standby(hot_channel)
+
+    async def _maintain_standby(self) -> None:
+        while True:
+            await self._check_standby()
+            await asyncio.sleep(self.STANDBY_CHECK_INTERVAL)
+
+    async def start(self) -> None:
+        if not self._standby_task:
+            self._standby_task = asyncio.create_task(self._maintain_standby())
+
+    def stop(self) -> None:
+        if self._standby_task:
+            self._standby_task.cancel()
+            self._standby_task = None
+
+        for tuner in [*self._tuners.values(), *self._standby.values()]:
+            tuner._stop()
+        self._standby.clear()
+
     def claim_tuner(self, channel: DLHDChannel) -> Tuner:
         # Cleanup any silent tuners first
         for tuner in list(self._tuners.values()):
-            if not tuner.has_listeners:
+            if not tuner.has_listeners and not self._release(tuner):
                 tuner._stop()
-                del self._tuners[tuner.channel]
 
-        if len(self._tuners) >= self._max_tuners:
-            raise NoAvailableTunersError()
+        self._touch_recent(channel)
 
         if channel in self._tuners:
             return self._tuners[channel]
 
-        tuner = Tuner(channel)
+        if len(self._tuners) >= self._max_tuners:
+            raise NoAvailableTunersError()
+
+        standby = self._standby.pop(channel) if channel in self._standby else None
+        if standby is not None and standby.running:
+            standby.standby = False
+            tuner = standby
+        else:
+            tuner = self._create_tuner(channel)
         self._tuners[channel] = tuner
         return tuner
@@ -0,0 +1,3 @@
+# SPDX-FileCopyrightText: 2023-present Brett Langdon <me@brett.is>
+#
+# SPDX-License-Identifier: MIT
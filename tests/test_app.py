@@ -0,0 +1,65 @@
+import datetime
+import urllib.parse
+
+import pytest
+from starlette.requests import Request
+
+from dlhdhr.app import _parse_xmltv_filter
+
+
+def parse(**params: str):
+    query = urllib.parse.urlencode(params).encode()
+    return _parse_xmltv_filter(Request({"type": "http", "query_string": query, "headers": []}))
+
+
+def test_no_filter():
+    assert parse() == (None, None, None)
+
+
+def test_start_timestamp():
+    start, end, numbers = parse(start="1700000000")
+    assert start == datetime.datetime(2023, 11, 14, 22, 13, 20, tzinfo=datetime.UTC)
+    assert end is None
+    assert numbers is None
+
+
+def test_start_isoformat():
+    start, _, _ = parse(start="2024-01-01T12:00:00+01:00")
+    assert start == datetime.datetime(2024, 1, 1, 11, 0, tzinfo=datetime.UTC)
+
+    # Without a timezone it is taken as UTC
+    start, _, _ = parse(start="2024-01-01T12:00:00")
+    assert start == datetime.datetime(2024, 1, 1, 12, 0, tzinfo=datetime.UTC)
+
+
+def test_hours():
+    start, end, _ = parse(start="1700000000", hours="1.5")
+    assert end - start == datetime.timedelta(hours=1.5)
+
+    # Without a start the window starts now
+    before = datetime.datetime.now(datetime.UTC)
+    start, end, _ = parse(hours="2")
+    assert before <= start <= datetime.datetime.now(datetime.UTC)
+    assert end - start == datetime.timedelta(hours=2)
+
+
+def test_channels():
+    _, _, numbers = parse(channels="51, 52,,53")
+    assert numbers == {"51", "52", "53"}
+
+
+@pytest.mark.parametrize("start", ["tomorrow", "inf", "nan", "1e300", "2024-13-01"])
+def test_invalid_start(start):
+    with pytest.raises(ValueError, match="Invalid start"):
+        parse(start=start)
+
+
+@pytest.mark.parametrize("hours", ["soon", "inf", "-inf", "nan", "1e20"])
+def test_invalid_hours(hours):
+    with pytest.raises(ValueError, match="Invalid hours"):
+        parse(hours=hours)
+
+
+def test_hours_beyond_datetime():
+    with pytest.raises(ValueError, match="Invalid hours"):
+        parse(start="9999-12-31T12:00:00", hours="24")
@@ -0,0 +1,47 @@
+import asyncio
+from collections.abc import AsyncIterator
+
+from dlhdhr.cache import StreamCache
+
+
+def generate(*chunks: bytes):
+    async def stream() -> AsyncIterator[bytes]:
+        for chunk in chunks:
+            yield chunk
+
+    return stream
+
+
+async def read(cache: StreamCache[str], key: str, *chunks: bytes) -> bytes:
+    return b"".join([chunk async for chunk in cache.stream(key, generate(*chunks), ttl=60)])
+
+
+def test_stream_cache_hits_and_misses():
+    async def run() -> StreamCache[str]:
+        cache: StreamCache[str] = StreamCache(max_bytes=1024)
+        assert await read(cache, "a", b"a", b"b") == b"ab"
+        assert await read(cache, "a", b"not fetched") == b"ab"
+        assert await read(cache, "b", b"c") == b"c"
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.hits == 1
+    assert cache.misses == 2
+    assert cache.prefetches == 0
+    assert cache.size == 3
+
+
+def test_stream_cache_prefetches():
+    async def run() -> StreamCache[str]:
+        cache: StreamCache[str] = StreamCache(max_bytes=1024)
+        cache.prefetch("a", generate(b"a"), ttl=60)
+        # Prefetching something already cached or downloading doesn't count again
+        cache.prefetch("a", generate(b"not fetched"), ttl=60)
+        assert await read(cache, "a", b"not fetched") == b"a"
+        return cache
+
+    # Prefetches are counted on their own, and the reader which finds the prefetched segment is a hit
+    cache = asyncio.run(run())
+    assert cache.prefetches == 1
+    assert cache.hits == 1
+    assert cache.misses == 0
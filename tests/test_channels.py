@@ -0,0 +1,52 @@
+import pytest
+
+from dlhdhr import config
+from dlhdhr.dlhd.channels import DLHDChannel, get_registry, reload_channels
+
+
+@pytest.fixture()
+def restore_registry(monkeypatch):
+    yield
+    # Put back a registry of the built in channels without the test's filters
+    monkeypatch.undo()
+    reload_channels()
+
+
+def test_indexes_keep_every_channel():
+    registry = get_registry()
+    assert [c.number for c in registry.by_call_sign["WNBC"]] == ["53", "769"]
+    assert [c.number for c in registry.by_xmltv_id["Eurosport1.uk"]] == ["41"]
+    assert [c.number for c in registry.by_epgsky_id["4004"]] == ["41"]
+    assert all(c.country_code == "uk" for c in registry.by_country["uk"])
+    assert registry.get("53") is registry.by_number["53"]
+    assert registry.get("0") is None
+
+
+def test_indexes_skip_missing_values():
+    registry = get_registry()
+    assert "" not in registry.by_xmltv_id
+    assert "" not in registry.by_call_sign
+    assert "" not in registry.by_epgsky_id
+
+
+@pytest.mark.usefixtures("restore_registry")
+def test_reload_channels(monkeypatch):
+    before = get_registry()
+    monkeypatch.setattr(config, "CHANNEL_ALLOW", {"53", "54"})
+    registry = reload_channels()
+
+    assert get_registry() is registry
+    assert registry.version == before.version + 1
+    assert [c.number for c in registry] == ["53", "54"]
+    assert [c.number for c in registry.by_call_sign["WNBC"]] == ["53"]
+    # The old snapshot is left as it was for anyone still using it
+    assert len(before) > len(registry)
+    assert "769" in before.by_number
+
+
+@pytest.mark.usefixtures("restore_registry")
+def test_reload_channels_list():
+    channel = DLHDChannel(number="1", name="Test", country_code="us", call_sign="TEST")
+    registry = reload_channels([channel])
+    assert list(registry) == [channel]
+    assert registry.by_call_sign == {"TEST": (channel,)}
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from dlhdhr import config
+from dlhdhr.dlhd.channels import get_channels
+from dlhdhr.epg.epgsky import EPGSky
+from dlhdhr.epg.provider import EPGProvider
+from dlhdhr.epg.zap2it import Zap2it
+
+
+def mock_upstream(provider: EPGProvider, handler) -> None:
+    provider._get_client = lambda: httpx.AsyncClient(
+        base_url=provider._BASE_URL, transport=httpx.MockTransport(handler)
+    )
+
+
+def test_epgsky_concurrency(monkeypatch):
+    monkeypatch.setattr(config, "EPG_PROVIDER_CONCURRENCY", 2)
+    services = [c.epgsky_id for c in get_channels() if c.epgsky_id]
+    now = int(time.time())
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+        sids = request.url.path.rpartition("/")[2].split(",")
+        assert len(sids) <= 20
+        events = [{"st": now, "d": 1800, "t": "Title"}]
+        return httpx.Response(200, json={"schedule": [{"sid": sid, "events": events} for sid in sids]})
+
+    provider = EPGSky()
+    mock_upstream(provider, handler)
+    listings = asyncio.run(provider._fetch_listings())
+
+    assert set(listings) == set(services)
+    assert max_in_flight == 2
+
+
+def test_epgsky_failure(monkeypatch):
+    monkeypatch.setattr(config, "EPG_PROVIDER_CONCURRENCY", 4)
+    requests = 0
+    completed = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal requests, completed
+        requests += 1
+        if requests == 1:
+            return httpx.Response(500, request=request)
+        await asyncio.sleep(0.05)
+        completed += 1
+        return httpx.Response(200, json={"schedule": []})
+
+    async def run() -> None:
+        provider = EPGSky()
+        mock_upstream(provider, handler)
+        with pytest.raises(httpx.HTTPStatusError):
+            await provider._fetch_listings()
+        await asyncio.sleep(0.1)
+
+    # The first failure is raised as is, and cancels the other requests
+    asyncio.run(run())
+    assert requests > 1
+    assert completed == 0
+
+
+def test_zap2it_failure(monkeypatch):
+    monkeypatch.setattr(config, "ZAP2IT_CONCURRENCY", 8)
+    monkeypatch.setattr(config, "ZAP2IT_RETRIES", 0)
+    requests = 0
+    completed = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal requests, completed
+        requests += 1
+        if requests == 1:
+            return httpx.Response(400, request=request)
+        await asyncio.sleep(0.05)
+        completed += 1
+        return httpx.Response(200, json={"channels": []})
+
+    async def run() -> None:
+        provider = Zap2it()
+        mock_upstream(provider, handler)
+        with pytest.raises(httpx.HTTPStatusError):
+            await provider._fetch_listings()
+        await asyncio.sleep(0.1)
+
+    # The first page to fail cancels every other page's request, rather than leaving them running
+    asyncio.run(run())
+    assert requests > 1
+    assert completed == 0
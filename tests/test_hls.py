@@ -0,0 +1,51 @@
+import asyncio
+
+import m3u8
+import pytest
+
+from dlhdhr import hls
+from dlhdhr.dlhd.channels import get_registry
+from dlhdhr.hls import HLSStream, HLSStreamError
+
+ciphers = pytest.importorskip("cryptography.hazmat.primitives.ciphers")
+
+KEY = bytes(range(16))
+
+
+class FakeDLHD:
+    async def get_channel_key(self, *_args) -> bytes:
+        return KEY
+
+
+def encrypt(data: bytes, iv: bytes) -> bytes:
+    # PKCS7 padding, always at least one byte
+    pad = 16 - len(data) % 16
+    encryptor = ciphers.Cipher(ciphers.algorithms.AES(KEY), ciphers.modes.CBC(iv)).encryptor()
+    return encryptor.update(data + bytes([pad]) * pad) + encryptor.finalize()
+
+
+def create_key(iv: str | None = None) -> m3u8.Key:
+    return m3u8.Key(method="AES-128", base_uri="https://example.com/", uri="key", iv=iv)
+
+
+def decrypt(data: bytes, key: m3u8.Key, sequence: int) -> bytes:
+    stream = HLSStream(FakeDLHD(), get_registry().get("51"))
+    return asyncio.run(stream._decrypt(data, key, sequence))
+
+
+def test_decrypt_with_sequence_iv():
+    # Without an IV in the playlist, the media sequence number is the IV
+    data = b"x" * 100
+    assert decrypt(encrypt(data, (7).to_bytes(16, "big")), create_key(), 7) == data
+
+
+def test_decrypt_with_explicit_iv():
+    iv = bytes(range(16, 32))
+    data = b"y" * 32
+    assert decrypt(encrypt(data, iv), create_key(iv="0x" + iv.hex()), 7) == data
+
+
+def test_decrypt_without_cryptography(monkeypatch):
+    monkeypatch.setattr(hls, "HAS_CRYPTOGRAPHY", False)
+    with pytest.raises(HLSStreamError):
+        decrypt(b"", create_key(), 0)
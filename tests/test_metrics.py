@@ -0,0 +1,76 @@
+import re
+from collections import defaultdict
+
+from dlhdhr.dlhd import DLHDClient, PoolStats
+from dlhdhr.dlhd.channels import get_registry
+from dlhdhr.epg import EPG
+from dlhdhr.metrics import Histogram, MetricsWriter, render_metrics
+from dlhdhr.tuner import TunerManager
+
+SAMPLE = re.compile(r"^(?P<name>\w+)(?:\{(?P<labels>.*)\})? (?P<value>\S+)$")
+
+
+def parse(document: bytes) -> dict[str, list[tuple[dict[str, str], str]]]:
+    samples = defaultdict(list)
+    for line in document.decode().splitlines():
+        if line.startswith("#"):
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match["labels"] or ""))
+        samples[match["name"]].append((labels, match["value"]))
+    return samples
+
+
+def test_histogram():
+    histogram = Histogram((1.0, 2.0))
+    for value in (0.5, 1.0, 1.5, 3.0):
+        histogram.observe(value)
+
+    writer = MetricsWriter()
+    writer.add_histogram("latency", "Latency.", [({"host": "example.com"}, histogram)])
+    samples = parse(writer.render())
+    assert [(labels["le"], value) for labels, value in samples["latency_bucket"]] == [
+        ("1.0", "2"),
+        ("2.0", "3"),
+        ("+Inf", "4"),
+    ]
+    assert samples["latency_sum"] == [({"host": "example.com"}, "6.0")]
+    assert samples["latency_count"] == [({"host": "example.com"}, "4")]
+
+
+def test_label_escaping():
+    writer = MetricsWriter()
+    writer.add("name", "gauge", "Name.", [({"value": 'a "b"\\\n'}, 1)])
+    assert writer.render() == b'# HELP name Name.\n# TYPE name gauge\nname{value="a \\"b\\"\\\\\\n"} 1\n'
+
+
+def test_consistent_labels():
+    dlhd = DLHDClient()
+    dlhd._pool_stats["example.com"] = PoolStats(requests=5, connections=2)
+    samples = parse(render_metrics(dlhd, TunerManager(dlhd), EPG()))
+
+    # Every sample of a metric has the same label names
+    for name, metric in samples.items():
+        assert len({frozenset(labels) for labels, _ in metric}) == 1, name
+
+    assert samples["dlhdhr_cache_hits_total"] == [
+        ({"cache": "segments"}, "0"),
+        ({"cache": "sources"}, "0"),
+        ({"cache": "keys"}, "0"),
+    ]
+    assert samples["dlhdhr_upstream_connections_total"] == [({"host": "example.com"}, "2")]
+    assert samples["dlhdhr_upstream_connection_reuses_total"] == [({"host": "example.com"}, "3")]
+    assert samples["dlhdhr_segment_cache_prefetches_total"] == [({}, "0")]
+
+
+def test_tuner_active_only_counts_running_tuners():
+    dlhd = DLHDClient()
+    tuners = TunerManager(dlhd)
+    tuner = tuners.claim_tuner(get_registry().get("51"))
+
+    # Claimed, but not started by a listener yet
+    assert not tuner.running
+    samples = parse(render_metrics(dlhd, tuners, EPG()))
+    assert samples["dlhdhr_tuner_active"] == []
+    assert samples["dlhdhr_tuner_listeners"] == [({"channel": "51"}, "0")]
@@ -0,0 +1,124 @@
+from dlhdhr.mpegts import NULL_PID, TS_PACKET_SIZE, ContinuityCounters, find_keyframe, find_sync, is_keyframe_packet
+
+VIDEO_PES = b"\x00\x00\x01\xe0"
+AUDIO_PES = b"\x00\x00\x01\xc0"
+RANDOM_ACCESS = 0x40
+
+
+def packet(
+    pid: int = 0x100,
+    *,
+    start: bool = True,
+    adaptation: bytes | None = None,
+    payload: bytes | None = b"",
+    counter: int = 0,
+) -> bytes:
+    # adaptation_field_control is 1 for a payload only, 2 for an adaptation field only and 3 for both
+    control = (0x20 if adaptation is not None else 0) | (0x10 if payload is not None else 0)
+    data = bytes([0x47, (0x40 if start else 0) | (pid >> 8), pid & 0xFF, control | counter])
+    if adaptation is not None:
+        data += bytes([len(adaptation)]) + adaptation
+    data += payload or b""
+    return data.ljust(TS_PACKET_SIZE, b"\xff")
+
+
+def keyframe(**kwargs) -> bytes:
+    return packet(adaptation=bytes([RANDOM_ACCESS]), payload=VIDEO_PES, **kwargs)
+
+
+def counters(data: bytes) -> list[int]:
+    return [data[offset + 3] & 0x0F for offset in range(0, len(data), TS_PACKET_SIZE)]
+
+
+def test_keyframe_packet():
+    assert is_keyframe_packet(keyframe())
+
+
+def test_keyframe_packet_with_stuffing():
+    # Stuffing bytes in the adaptation field move the PES header along
+    data = packet(adaptation=bytes([RANDOM_ACCESS]) + b"\xff" * 20, payload=VIDEO_PES)
+    assert is_keyframe_packet(data)
+
+
+def test_not_keyframe_packets():
+    # Audio random access points
+    assert not is_keyframe_packet(packet(adaptation=bytes([RANDOM_ACCESS]), payload=AUDIO_PES))
+    # Without the random access indicator
+    assert not is_keyframe_packet(packet(adaptation=b"\x00", payload=VIDEO_PES))
+    # Continuing a PES packet rather than starting one
+    assert not is_keyframe_packet(keyframe(start=False))
+    # Without an adaptation field
+    assert not is_keyframe_packet(packet(payload=VIDEO_PES))
+    # An empty adaptation field
+    assert not is_keyframe_packet(packet(adaptation=b"", payload=VIDEO_PES))
+    # An adaptation field without a payload
+    assert not is_keyframe_packet(packet(adaptation=bytes([RANDOM_ACCESS]), payload=None))
+
+
+def test_adaptation_field_filling_packet():
+    # The adaptation field claims the whole packet, leaving no room for a PES header
+    data = bytearray(keyframe())
+    data[4] = TS_PACKET_SIZE - 5
+    assert not is_keyframe_packet(bytes(data))
+
+
+def test_keyframe_packet_bad_sync_byte():
+    data = bytearray(keyframe())
+    data[0] = 0x48
+    assert not is_keyframe_packet(bytes(data))
+
+
+def test_find_keyframe():
+    assert find_keyframe(packet() + packet() + keyframe() + keyframe()) == TS_PACKET_SIZE * 2
+    assert find_keyframe(keyframe()) == 0
+    assert find_keyframe(packet() + packet()) == -1
+    # Partial packets at the end are ignored
+    assert find_keyframe(packet() + keyframe()[:100]) == -1
+
+
+def test_find_sync():
+    packets = packet() + packet() + packet()
+    assert find_sync(packets) == 0
+    # A stray sync byte which isn't followed by another a packet later is skipped
+    assert find_sync(b"\x00\x47\x00\x00\x00" + packets) == 5
+    # A single packet can't be checked against the next one
+    assert find_sync(b"\x00\x00" + packet()) == 2
+    assert find_sync(b"\x00" * 500) == -1
+    assert find_sync(b"") == -1
+
+
+def test_continuity_counters():
+    fixer = ContinuityCounters()
+
+    # The first packet of each PID keeps its counter
+    first = bytearray(packet(counter=5) + packet(counter=6) + packet(0x101, counter=9))
+    fixer.fix(first)
+    assert counters(first) == [5, 6, 9]
+
+    # The next segment starts counting from 0 again, and is renumbered to carry on from the last one
+    second = bytearray(packet(counter=0) + packet(0x101, counter=0) + packet(counter=1))
+    fixer.fix(second)
+    assert counters(second) == [7, 10, 8]
+
+
+def test_continuity_counters_wraparound():
+    fixer = ContinuityCounters()
+    data = bytearray(b"".join(packet(counter=14) for _ in range(4)))
+    fixer.fix(data)
+    assert counters(data) == [14, 15, 0, 1]
+
+
+def test_continuity_counters_skipped_packets():
+    fixer = ContinuityCounters()
+    bad_sync = bytearray(packet(counter=3))
+    bad_sync[0] = 0x00
+    data = bytearray(
+        packet(counter=4)
+        # Packets without a payload don't increment the counter
+        + packet(adaptation=b"\x00", payload=None, counter=12)
+        + packet(NULL_PID, counter=7)
+        + bytes(bad_sync)
+        + packet(counter=0)
+    )
+    fixer.fix(data)
+    assert counters(data) == [4, 12, 7, 3, 5]
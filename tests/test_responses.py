@@ -0,0 +1,115 @@
+import asyncio
+import gzip
+from collections.abc import AsyncIterator
+
+import pytest
+from starlette.requests import Request
+
+from dlhdhr.responses import CachedBody, DocumentCache, accepts_encoding, brotli
+
+
+def generate(*chunks: bytes):
+    async def stream() -> AsyncIterator[bytes]:
+        for chunk in chunks:
+            yield chunk
+
+    return stream
+
+
+async def render(cache: DocumentCache, key: int, document: bytes, *, complete: bool = True) -> bytes:
+    stream = cache.render(key, generate(document), is_complete=lambda: complete)
+    content = b"".join([chunk async for chunk in stream])
+    # Let the rendering finish building its body
+    while cache._rendering:
+        await asyncio.sleep(0.001)
+    return content
+
+
+def test_document_cache():
+    async def run() -> None:
+        cache = DocumentCache("application/xml")
+        assert cache.get(1) is None
+
+        assert await render(cache, 1, b"<tv/>") == b"<tv/>"
+        body = cache.get(1)
+        assert body is not None
+        assert body.content == b"<tv/>"
+
+        # A new key means a new rendering
+        assert cache.get(2) is None
+
+    asyncio.run(run())
+
+
+def test_document_cache_incomplete_not_kept():
+    async def run() -> None:
+        cache = DocumentCache("application/xml")
+        assert await render(cache, 1, b"<tv/>", complete=False) == b"<tv/>"
+        assert cache.get(1) is None
+
+    asyncio.run(run())
+
+
+def test_document_cache_incomplete_ttl():
+    async def run() -> None:
+        cache = DocumentCache("application/xml", incomplete_ttl=0.05)
+        await render(cache, 1, b"<tv/>", complete=False)
+        body = cache.get(1)
+        assert body is not None
+        assert body.content == b"<tv/>"
+
+        await asyncio.sleep(0.06)
+        assert cache.get(1) is None
+
+        # A complete rendering doesn't expire
+        await render(cache, 1, b"<tv></tv>")
+        await asyncio.sleep(0.06)
+        assert cache.get(1) is not None
+
+    asyncio.run(run())
+
+
+def request(**headers: str) -> Request:
+    return Request(
+        {"type": "http", "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]}
+    )
+
+
+def test_accepts_encoding():
+    assert accepts_encoding(request(accept_encoding="gzip, br"), "gzip")
+    assert accepts_encoding(request(accept_encoding="br;q=0.5, GZIP;q=1"), "gzip")
+    assert not accepts_encoding(request(accept_encoding="gzip;q=0, br"), "gzip")
+    assert not accepts_encoding(request(accept_encoding="gzip;q=high"), "gzip")
+    assert not accepts_encoding(request(accept_encoding="br"), "gzip")
+    assert not accepts_encoding(request(), "gzip")
+
+
+def test_cached_body_etag_per_encoding():
+    body = CachedBody.build(b"<tv/>" * 100, "application/xml")
+
+    identity = body.response(request())
+    gzipped = body.response(request(accept_encoding="gzip"))
+    assert identity.headers["etag"] == body.etag
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.headers["etag"] == f'{body.etag[:-1]}-gz"'
+    assert gzip.decompress(gzipped.body) == body.content
+
+    # Every representation only matches its own ETag
+    etag = gzipped.headers["etag"]
+    assert body.response(request(accept_encoding="gzip", if_none_match=etag)).status_code == 304
+    assert body.response(request(accept_encoding="gzip", if_none_match=f"W/{etag}")).status_code == 304
+    assert body.response(request(if_none_match=etag)).status_code == 200
+    assert body.response(request(accept_encoding="gzip", if_none_match=body.etag)).status_code == 200
+    assert body.response(request(if_none_match=f"{etag}, {body.etag}")).status_code == 304
+
+    not_modified = body.response(request(accept_encoding="gzip", if_none_match=etag))
+    assert not_modified.headers["etag"] == etag
+    assert not_modified.body == b""
+
+
+@pytest.mark.skipif(brotli is None, reason="brotli is not installed")
+def test_cached_body_brotli_etag():
+    body = CachedBody.build(b"<tv/>" * 100, "application/xml")
+    response = body.response(request(accept_encoding="gzip, br"))
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["etag"] == f'{body.etag[:-1]}-br"'
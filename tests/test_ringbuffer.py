@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from dlhdhr.ringbuffer import RingBuffer
+
+
+def test_size_must_be_positive():
+    with pytest.raises(ValueError):
+        RingBuffer(0)
+
+
+def test_write_and_get():
+    buffer = RingBuffer(4)
+    buffer.write(b"a")
+    buffer.write(b"bc")
+
+    assert buffer.tail == 0
+    assert buffer.head == 2
+    assert buffer.get(0) == b"a"
+    assert buffer.get(1) == b"bc"
+    assert buffer.bytes_written == 3
+    assert buffer.offset(0) == 0
+    assert buffer.offset(1) == 1
+    assert buffer.offset(2) == 3
+
+    with pytest.raises(IndexError):
+        buffer.get(2)
+    with pytest.raises(IndexError):
+        buffer.offset(3)
+
+
+def test_slot_wraparound():
+    buffer = RingBuffer(3)
+    for i in range(7):
+        buffer.write(bytes([i]) * (i + 1))
+
+    # Only the last 3 chunks are kept, in slots which have been reused twice
+    assert buffer.tail == 4
+    assert buffer.head == 7
+    assert [buffer.get(seq) for seq in range(4, 7)] == [b"\x04" * 5, b"\x05" * 6, b"\x06" * 7]
+    assert buffer.offset(4) == sum(range(1, 5))
+    assert buffer.offset(7) == buffer.bytes_written == sum(range(1, 8))
+
+    for seq in range(4):
+        with pytest.raises(IndexError):
+            buffer.get(seq)
+        with pytest.raises(IndexError):
+            buffer.offset(seq)
+
+
+def test_max_bytes_eviction():
+    buffer = RingBuffer(10, max_bytes=10)
+    for _ in range(5):
+        buffer.write(b"x" * 4)
+
+    # Chunks are dropped once the bytes written since them exceed max_bytes
+    assert buffer.head == 5
+    assert buffer.tail == 3
+    assert buffer.bytes_written - buffer.offset(buffer.tail) <= 10
+    with pytest.raises(IndexError):
+        buffer.get(2)
+
+
+def test_max_bytes_keeps_newest_chunk():
+    buffer = RingBuffer(10, max_bytes=10)
+    buffer.write(b"x" * 4)
+    buffer.write(b"y" * 100)
+
+    # A chunk bigger than the limit is still readable
+    assert buffer.tail == 1
+    assert buffer.get(1) == b"y" * 100
+
+
+def test_keyframe_index():
+    buffer = RingBuffer(3)
+    assert buffer.last_keyframe is None
+
+    buffer.write(b"a", keyframe=True)
+    buffer.write(b"b")
+    assert buffer.last_keyframe == 0
+    assert buffer.is_keyframe(0)
+    assert not buffer.is_keyframe(1)
+
+    buffer.write(b"c", keyframe=True)
+    assert buffer.last_keyframe == 2
+
+    # Once the keyframe has been evicted it is forgotten, until the next one
+    buffer.write(b"d")
+    buffer.write(b"e")
+    buffer.write(b"f")
+    assert buffer.tail == 3
+    assert buffer.last_keyframe is None
+    assert not buffer.is_keyframe(2)
+
+    # A reused slot doesn't keep the keyframe flag of its previous chunk
+    assert not buffer.is_keyframe(5)
+
+
+def test_keyframe_is_keyword_only():
+    buffer = RingBuffer(3)
+    with pytest.raises(TypeError):
+        buffer.write(b"a", True)
+
+
+def test_closed_buffer_ignores_writes():
+    buffer = RingBuffer(3)
+    buffer.close()
+    buffer.write(b"a")
+
+    assert buffer.closed
+    assert buffer.head == 0
+
+
+def test_wait():
+    async def run() -> list[bytes]:
+        buffer = RingBuffer(3)
+        received = []
+
+        async def reader() -> None:
+            seq = 0
+            while True:
+                await buffer.wait(seq)
+                if seq >= buffer.head:
+                    return
+                received.append(buffer.get(seq))
+                seq += 1
+
+        task = asyncio.create_task(reader())
+        await asyncio.sleep(0)
+        buffer.write(b"a")
+        buffer.write(b"b")
+        await asyncio.sleep(0)
+        buffer.write(b"c")
+        buffer.close()
+        await asyncio.wait_for(task, 1)
+        return received
+
+    assert asyncio.run(run()) == [b"a", b"b", b"c"]
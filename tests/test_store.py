@@ -0,0 +1,104 @@
+import datetime
+
+from dlhdhr.dlhd.channels import DLHDChannel
+from dlhdhr.epg.program import Program
+from dlhdhr.epg.store import ProgramStore
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+
+
+def program(start: int, end: int, title: str = "Title") -> Program:
+    # `start` and `end` in minutes from START
+    return Program.create(
+        start_time=START + datetime.timedelta(minutes=start),
+        end_time=START + datetime.timedelta(minutes=end),
+        title=title,
+        description="",
+        tags=[],
+    )
+
+
+def at(minutes: int) -> datetime.datetime:
+    return START + datetime.timedelta(minutes=minutes)
+
+
+def spans(programs: list[Program]) -> list[tuple[int, int]]:
+    return [((p.start - int(START.timestamp())) // 60, (p.end - int(START.timestamp())) // 60) for p in programs]
+
+
+def test_sorted():
+    store = ProgramStore([program(60, 90), program(0, 30), program(30, 60)])
+    assert spans(store.programs) == [(0, 30), (30, 60), (60, 90)]
+    assert len(store) == 3
+
+
+def test_merge():
+    store = ProgramStore([program(0, 30), program(30, 60)])
+    store.merge([program(60, 90), program(90, 120)])
+    assert spans(store.programs) == [(0, 30), (30, 60), (60, 90), (90, 120)]
+
+
+def test_merge_deduplicates():
+    store = ProgramStore([program(0, 30, "Old"), program(30, 60, "Old")])
+    store.merge([program(30, 60, "New"), program(30, 60, "Newer"), program(30, 45, "Short")])
+
+    # Programmes with the same start and end replace the existing one, the last one wins
+    assert sorted((span, p.title) for span, p in zip(spans(store.programs), store.programs, strict=True)) == [
+        ((0, 30), "Old"),
+        ((30, 45), "Short"),
+        ((30, 60), "Newer"),
+    ]
+
+
+def test_merge_replaces_lists():
+    store = ProgramStore([program(0, 30)])
+    before = store.programs
+    store.merge([program(30, 60)])
+    assert spans(before) == [(0, 30)]
+
+
+def test_between():
+    store = ProgramStore([program(0, 30), program(30, 60), program(60, 180), program(180, 210)])
+
+    # Anything airing at some point in the window, including the long programme which started before it
+    assert spans(store.between(at(90), at(100))) == [(60, 180)]
+    assert spans(store.between(at(30), at(60))) == [(30, 60)]
+    assert spans(store.between(at(29), at(61))) == [(0, 30), (30, 60), (60, 180)]
+    assert spans(store.between(at(170), at(300))) == [(60, 180), (180, 210)]
+
+
+def test_between_open_ended():
+    store = ProgramStore([program(0, 30), program(30, 60), program(60, 90)])
+    assert spans(store.between(None, None)) == [(0, 30), (30, 60), (60, 90)]
+    assert spans(store.between(at(45), None)) == [(30, 60), (60, 90)]
+    assert spans(store.between(None, at(30))) == [(0, 30)]
+    assert store.between(at(90), None) == []
+    assert store.between(None, at(0)) == []
+
+
+def test_prune():
+    store = ProgramStore([program(0, 30), program(30, 60), program(0, 120), program(60, 90)])
+
+    # Only programmes which have ended are dropped, even ones which started earlier than a programme still airing
+    assert store.prune(at(60)) == 2
+    assert spans(store.programs) == [(0, 120), (60, 90)]
+    assert spans(store.between(at(100), None)) == [(0, 120)]
+
+    assert store.prune(at(60)) == 0
+    assert store.prune(at(120)) == 2
+    assert len(store) == 0
+    assert store.prune(at(500)) == 0
+
+
+def test_merge_keeps_unchanged():
+    existing = program(0, 30)
+    store = ProgramStore([existing, program(30, 60, "Old")])
+    channel = DLHDChannel(number="1", name="Channel", country_code="us")
+    fragment = existing.xmltv_fragment(channel)
+
+    store.merge([program(0, 30), program(30, 60, "New")])
+
+    # The unchanged programme (and its cached fragment) is kept, the changed one replaced
+    assert store.programs[0] is existing
+    assert store.programs[0].xmltv_fragment(channel) is fragment
+    assert store.programs[1].title == "New"
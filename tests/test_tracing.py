@@ -0,0 +1,87 @@
+import asyncio
+from collections.abc import AsyncIterator
+
+import m3u8
+
+from dlhdhr import config
+from dlhdhr.dlhd import ChannelSource, DLHDClient
+from dlhdhr.dlhd.channels import get_registry
+from dlhdhr.dlhd.tracing import Trace, Tracer
+
+PLAYLIST = """#EXTM3U
+#EXT-X-TARGETDURATION:4
+#EXTINF:4.0,
+segment-1.ts
+#EXTINF:4.0,
+segment-2.ts
+"""
+
+
+def create_client() -> DLHDClient:
+    dlhd = DLHDClient()
+    dlhd._tracer = Tracer(sample_rate=1, slow=0, keep=10)
+    return dlhd
+
+
+def test_detach():
+    tracer = Tracer(sample_rate=1, slow=0, keep=10)
+    with tracer.trace("channel_playlist", "51") as trace:
+        assert tracer.current() is trace
+        with tracer.detach():
+            assert tracer.current() is None
+        assert tracer.current() is trace
+    assert tracer.current() is None
+
+
+def test_prefetched_key_not_in_playlist_trace():
+    dlhd = create_client()
+    channel = get_registry().get("51")
+    traces: list[Trace | None] = []
+
+    async def get_channel_key(*_args) -> bytes:
+        await asyncio.sleep(0)
+        traces.append(dlhd._tracer.current())
+        return b"key"
+
+    dlhd.get_channel_key = get_channel_key
+
+    async def run() -> Trace | None:
+        with dlhd._tracer.trace("channel_playlist", channel.number) as trace:
+            dlhd.prefetch_channel_key(channel, "https://example.com/key")
+        await asyncio.gather(*dlhd._tasks)
+        return trace
+
+    trace = asyncio.run(run())
+    assert trace is not None
+    assert trace.duration is not None
+    assert traces == [None]
+
+
+def test_prefetched_segments_not_in_playlist_trace(monkeypatch):
+    monkeypatch.setattr(config, "SEGMENT_PREFETCH", 2)
+    dlhd = create_client()
+    channel = get_registry().get("51")
+    traces: list[Trace | None] = []
+
+    async def get_channel_source(*_args) -> ChannelSource:
+        return ChannelSource(referer="https://example.com/", playlist_url="https://example.com/playlist.m3u8")
+
+    async def stream(*_args, trace: Trace | None = None, **_kwargs) -> AsyncIterator[bytes]:
+        await asyncio.sleep(0)
+        traces.append(trace or dlhd._tracer.current())
+        yield b"segment"
+
+    dlhd.get_channel_source = get_channel_source
+    dlhd._stream = stream
+
+    async def run() -> Trace | None:
+        with dlhd._tracer.trace("channel_playlist", channel.number) as trace:
+            await dlhd._prefetch_segments(channel, m3u8.loads(PLAYLIST))
+        await asyncio.gather(*dlhd._segments._downloads)
+        return trace
+
+    trace = asyncio.run(run())
+    assert trace is not None
+    assert trace.spans == []
+    # Upstream is assumed to be fast until measured, so only the newest segment is prefetched
+    assert traces == [None]
@@ -0,0 +1,193 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from dlhdhr import config
+from dlhdhr.dlhd.channels import DLHDChannel, get_registry
+from dlhdhr.mpegts import TS_PACKET_SIZE
+from dlhdhr.ringbuffer import RingBuffer
+from dlhdhr.tuner import Tuner, TunerManager, TunerStats
+
+# Every chunk is a single TS packet, filled with its sequence number
+MAX_LAG = TS_PACKET_SIZE * 5
+
+
+def chunk(seq: int) -> bytes:
+    return bytes([seq]) * TS_PACKET_SIZE
+
+
+def create_listener(buffer: RingBuffer, lag_policy: str, lag_actions: Counter[str]) -> Tuner.Listener:
+    return Tuner.Listener(
+        buffer, lag_actions, max_lag=MAX_LAG, lag_policy=lag_policy, write_size=TS_PACKET_SIZE * 100, max_latency=0
+    )
+
+
+def read(listener: Tuner.Listener) -> bytes:
+    async def run() -> bytes:
+        return await asyncio.wait_for(anext(listener), 1)
+
+    return asyncio.run(run())
+
+
+def test_unknown_lag_policy():
+    with pytest.raises(ValueError):
+        Tuner.Listener(RingBuffer(10), Counter(), lag_policy="rewind")
+
+
+def test_listener_options_are_keyword_only():
+    with pytest.raises(TypeError):
+        Tuner.Listener(RingBuffer(10), Counter(), MAX_LAG, "skip")
+
+
+def test_not_lagging():
+    buffer = RingBuffer(100)
+    lag_actions: Counter[str] = Counter()
+    listener = create_listener(buffer, "disconnect", lag_actions)
+    for seq in range(3):
+        buffer.write(chunk(seq))
+
+    assert listener.lag == TS_PACKET_SIZE * 3
+    assert listener.queued == 3
+    assert not listener.is_lagging
+    assert read(listener) == chunk(0) + chunk(1) + chunk(2)
+    assert not lag_actions
+
+
+def test_disconnect_policy():
+    buffer = RingBuffer(100)
+    lag_actions: Counter[str] = Counter()
+    listener = create_listener(buffer, "disconnect", lag_actions)
+    for seq in range(20):
+        buffer.write(chunk(seq))
+
+    assert listener.is_lagging
+    with pytest.raises(StopAsyncIteration):
+        read(listener)
+    assert lag_actions == {"disconnect": 1}
+
+
+def test_skip_policy():
+    buffer = RingBuffer(100)
+    lag_actions: Counter[str] = Counter()
+    listener = create_listener(buffer, "skip", lag_actions)
+    for seq in range(20):
+        buffer.write(chunk(seq))
+
+    # Skips to within half of the allowed lag, on a chunk boundary
+    data = read(listener)
+    assert data == chunk(18) + chunk(19)
+    assert len(data) <= MAX_LAG // 2
+    assert lag_actions == {"skip": 1}
+
+
+def test_skip_policy_past_the_buffer():
+    # The listener's cursor has been dropped out of the buffer altogether
+    buffer = RingBuffer(4)
+    lag_actions: Counter[str] = Counter()
+    listener = create_listener(buffer, "skip", lag_actions)
+    for seq in range(10):
+        buffer.write(chunk(seq))
+
+    assert buffer.tail == 6
+    assert listener.is_lagging
+    assert read(listener) == chunk(8) + chunk(9)
+    assert lag_actions == {"skip": 1}
+
+
+def test_keyframe_policy():
+    buffer = RingBuffer(100)
+    lag_actions: Counter[str] = Counter()
+    listener = create_listener(buffer, "keyframe", lag_actions)
+    for seq in range(20):
+        buffer.write(chunk(seq), keyframe=seq in (5, 16))
+
+    # Jumps to the newest keyframe
+    assert read(listener) == b"".join(chunk(seq) for seq in range(16, 20))
+    assert lag_actions == {"keyframe": 1}
+
+
+def test_keyframe_policy_without_keyframe():
+    async def run() -> bytes:
+        buffer = RingBuffer(100)
+        listener = create_listener(buffer, "keyframe", lag_actions)
+        for seq in range(20):
+            buffer.write(chunk(seq))
+
+        # With no keyframe to jump to, everything is dropped until the next keyframe is written
+        task = asyncio.create_task(anext(listener))
+        await asyncio.sleep(0)
+        buffer.write(chunk(20))
+        await asyncio.sleep(0)
+        buffer.write(chunk(21))
+        buffer.write(chunk(22), keyframe=True)
+        buffer.write(chunk(23))
+        return await asyncio.wait_for(task, 1)
+
+    lag_actions: Counter[str] = Counter()
+    assert asyncio.run(run()) == chunk(22) + chunk(23)
+    assert lag_actions == {"keyframe": 1}
+
+
+def test_stats():
+    buffer = RingBuffer(100)
+    stats = TunerStats()
+    listener = Tuner.Listener(buffer, Counter(), max_latency=0, stats=stats)
+    buffer.write(chunk(0))
+    read(listener)
+
+    assert stats.bytes_out == TS_PACKET_SIZE
+
+
+class FakeDLHD:
+    def get_channel(self, number: str) -> DLHDChannel | None:
+        return get_registry().get(number)
+
+
+async def fake_start(self: Tuner) -> None:
+    # Pretend to stream without starting ffmpeg
+    self._stream_task = asyncio.get_running_loop().create_future()
+
+
+def test_hot_channel_claimed_before_it_starts(monkeypatch):
+    monkeypatch.setattr(config, "TUNER_HOT_CHANNELS", {"51"})
+    monkeypatch.setattr(Tuner, "_start", fake_start)
+
+    async def run() -> None:
+        manager = TunerManager(FakeDLHD())
+        channel = get_registry().get("51")
+        tuner = manager.claim_tuner(channel)
+        assert not tuner.running
+
+        # The claimed tuner is about to be started by its listener, so no second tuner is started
+        await manager._check_standby()
+        assert manager.tuners == [tuner]
+
+        await tuner.get_listener()
+        await manager._check_standby()
+        assert manager.tuners == [tuner]
+
+    asyncio.run(run())
+
+
+def test_hot_channel_claimed_and_stopped(monkeypatch):
+    monkeypatch.setattr(config, "TUNER_HOT_CHANNELS", {"51"})
+    monkeypatch.setattr(Tuner, "_start", fake_start)
+
+    async def run() -> None:
+        manager = TunerManager(FakeDLHD())
+        channel = get_registry().get("51")
+        tuner = manager.claim_tuner(channel)
+        listener = await tuner.get_listener()
+        tuner._stop()
+
+        # The stopped tuner is replaced by a standby tuner
+        await manager._check_standby()
+        (standby,) = manager.tuners
+        assert standby is not tuner
+        assert standby.standby
+        assert standby.running
+        assert manager.claim_tuner(channel) is standby
+        del listener
+
+    asyncio.run(run())